@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# Feeds synthetic multi-megabyte coqtop replies through PromptFramer and the
+# framing loop it replaced, to compare reply throughput.
+#
+#   python3 bench/bench_framer.py [--sizes 1,4,16] [--chunk 4096]
+
+import os, re, sys, time, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from coqtop import PromptFramer
+
+PROMPT = b'\xfe<prompt>Coq < 12 |foo| 0 < </prompt>'
+
+def make_reply(size):
+    line = b'lemma_name_0123456789 : forall n m : nat, n + m = m + n\n'
+    body = line * (size // len(line) + 1)
+    return body[:size] + b'\n' + PROMPT
+
+def chunks(stream, chunk_size):
+    for i in range(0, len(stream), chunk_size):
+        yield stream[i:i + chunk_size]
+
+def legacy(stream, chunk_size):
+    replies = []
+    source = chunks(stream, chunk_size)
+    while True:
+        buf = b''
+        while not buf.endswith(b'</prompt>'):
+            chunk = next(source, b'')
+            if len(chunk) == 0:
+                return replies
+            buf += chunk
+        buf = re.sub(rb'\A\n*<prompt>.*</prompt>|[\xfe\xff]', b'', buf, flags=re.S)
+        replies.append(buf.decode('utf-8'))
+
+def framed(stream, chunk_size):
+    replies = []
+    framer = PromptFramer()
+    for chunk in chunks(stream, chunk_size):
+        replies.extend(framer.feed(chunk))
+    return replies
+
+def measure(fn, stream, chunk_size):
+    started = time.perf_counter()
+    replies = fn(stream, chunk_size)
+    return time.perf_counter() - started, len(replies)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1,4,16',
+                        help='reply sizes in MB, comma-separated')
+    parser.add_argument('--chunk', type=int, default=4096,
+                        help='bytes returned per pipe read')
+    parser.add_argument('--batch', type=int, default=200,
+                        help='number of small replies arriving in one read')
+    args = parser.parse_args()
+
+    print('{:>12} {:>10} {:>10} {:>10}'.format('reply', 'legacy', 'framer', 'speedup'))
+    for mb in [int(x) for x in args.sizes.split(',')]:
+        stream = make_reply(mb * 1024 * 1024)
+        (t_old, _), (t_new, n) = (measure(legacy, stream, args.chunk),
+                                  measure(framed, stream, args.chunk))
+        assert n == 1
+        print('{:>10}MB {:>9.3f}s {:>9.3f}s {:>9.1f}x'
+              .format(mb, t_old, t_new, t_old / t_new))
+
+    # Many short replies delivered by a single read, as happens when sentences
+    # are pipelined; the legacy loop merges them into one.
+    stream = make_reply(200) * args.batch
+    (t_new, n) = measure(framed, stream, len(stream))
+    print('{:>5} replies in one read: {:.4f}s, {} frames (legacy: {})'
+          .format(args.batch, t_new, n, len(legacy(stream, len(stream)))))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# Runs the plugin end to end against bench/fake_coqtop.py, with
+# bench/sublime_stub.py for Sublime Text, and measures stepping one sentence at
+# a time, Go Here over the whole file, undoing, and searches. Coqtop takes
+# --latency seconds per sentence, so the time beyond that is the plugin's:
+# reported per sentence as overhead, and as the CPU time the plugin's threads
+# used. Memory is the peak traced by tracemalloc and the peak RSS.
+#
+#   python3 bench/bench_manager.py [--lemmas 50] [--latency 0.002] [--goal-size 200]
+#                                  [--search-size 100] [--window 16] [--runs 3]
+#                                  [--file f.v] [--session recorded.jsonl]
+
+import os, sys, json, time, argparse, resource, tempfile, tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sublime_stub
+
+FAKE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_coqtop.py')
+
+LEMMA = '''Definition d{0} := {0}.
+Lemma l{0} : True /\\ True.
+Proof.
+  split.
+  - auto.
+  - auto.
+Qed.
+
+'''
+
+def synthetic(lemmas):
+    return ''.join(LEMMA.format(i) for i in range(lemmas))
+
+def fake_coqtop(directory, script):
+    # A script, so that coqtop_path names one executable.
+    script_path = os.path.join(directory, 'script.json')
+    with open(script_path, 'w') as f:
+        json.dump(script, f)
+    path = os.path.join(directory, 'coqtop')
+    with open(path, 'w') as f:
+        f.write('#!/bin/sh\nexec "{}" "{}" --script "{}" "$@"\n'.format(
+            sys.executable, FAKE, script_path))
+    os.chmod(path, 0o755)
+    return path
+
+class Session:
+    def __init__(self, plugin, window, text):
+        self.plugin = plugin
+        self.view = window.new_file()
+        self.view.text = text
+        self.view.settings().set('syntax', 'Packages/Sublime-Coq/Coq.sublime-syntax')
+        self.view.run_command('coq_start')
+        self.manager = plugin.managers[self.view.buffer_id()]
+        self.wait(lambda: True)
+        self.output = plugin.CoqtopManager.coqtop_view
+
+    def wait(self, predicate):
+        sublime_stub.wait_until(lambda: self.manager.ready and not self.manager.autorun_enabled
+                                and predicate(), timeout=600)
+
+    def go(self, point):
+        self.view.run_command('coq_go_here', {'point': point})
+        self.wait(lambda: self.manager.position == point or point > self.manager.position and
+                  self.manager.sentence_index().next(self.manager.position) is None)
+
+    def stop(self):
+        self.view.run_command('coq_stop')
+
+def measure(name, count, latency, fn):
+    # Runs `fn` and prints what it cost for each of the `count` sentences it
+    # sends, or of as many as it returns.
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    cpu, begin = time.process_time(), time.time()
+    count = fn() or count
+    wall, cpu = time.time() - begin, time.process_time() - cpu
+    _current, peak = tracemalloc.get_traced_memory()
+    print('{:10} {:6} sent  {:8.1f} /s  overhead {:7.3f} ms  cpu {:7.3f} ms  peak {:7.1f} KiB'
+          .format(name, count, count / wall, (wall - count * latency) / count * 1000,
+                  cpu / count * 1000, peak / 1024.0))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lemmas', type=int, default=50)
+    parser.add_argument('--file', help='a .v file to step through instead')
+    parser.add_argument('--latency', type=float, default=0.002)
+    parser.add_argument('--goal-size', type=int, default=200)
+    parser.add_argument('--search-size', type=int, default=100)
+    parser.add_argument('--searches', type=int, default=50)
+    parser.add_argument('--window', type=int, default=16)
+    parser.add_argument('--session', help='a session recorded by fake_coqtop.py --record')
+    parser.add_argument('--runs', type=int, default=3)
+    options = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='sublime-coq-bench-')
+    coqtop = fake_coqtop(directory, {
+        'latency': options.latency,
+        'goal_size': options.goal_size,
+        'search_size': options.search_size,
+        'session': options.session and os.path.abspath(options.session),
+    })
+    if options.file:
+        with open(options.file, encoding='utf-8') as f:
+            text = f.read()
+    else:
+        text = synthetic(options.lemmas)
+
+    settings = {
+        'coqtop_path': coqtop,
+        'coq_pool_size': 0,
+        'coq_query_delay': 0,
+        'coq_query_process': False,
+        'coq_lookahead': False,
+        'coq_result_cache': False,
+        'coq_prelude_snapshot': False,
+        'coq_debug': [],
+    }
+    window = sublime_stub.install(settings, folder=directory)
+    plugin = sublime_stub.load_plugin()
+    package_settings = plugin.sublime.load_settings('Sublime-Coq.sublime-settings')
+    tracemalloc.start()
+
+    for run in range(options.runs):
+        print('run {}'.format(run + 1))
+        session = Session(plugin, window, text)
+        manager, view = session.manager, session.view
+        end = view.size()
+        count = len(list(manager.sentence_index().until(0, end)))
+
+        def step():
+            while manager.sentence_index().next(manager.position) is not None:
+                position = manager.position
+                view.run_command('coq_next_statement')
+                session.wait(lambda: manager.position != position)
+                if manager.pending_error:
+                    break
+        measure('step', count, options.latency, step)
+
+        def undo():
+            # Each undo sends one BackTo, for however many sentences it undoes.
+            undos = 0
+            while not manager.empty():
+                depth = len(manager.stack)
+                view.run_command('coq_undo_statement')
+                session.wait(lambda: len(manager.stack) < depth)
+                undos += 1
+            return undos
+        measure('undo', count, options.latency, undo)
+
+        package_settings.set('coq_pipeline_window', options.window)
+        measure('go here', count, options.latency, lambda: session.go(end))
+        measure('retract', 1, options.latency, lambda: session.go(0))
+        package_settings.set('coq_pipeline_window', 1)
+        measure('autorun', count, options.latency, lambda: session.go(end))
+
+        panel = plugin._create_panel(window, 'Search')
+        def search():
+            for i in range(options.searches):
+                changes = panel.change_count()
+                manager.queries.submit(panel, 'SearchPattern (nat_{}).'.format(i))
+                sublime_stub.wait_until(lambda: panel.change_count() != changes, timeout=600)
+        measure('search', options.searches, options.latency, search)
+        session.stop()
+
+    print('peak rss   {:8.1f} MiB'.format(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# Measures the time from asking for a coqtop to having its welcome reply, for
+# cold starts and for processes handed out by CoqtopPool.
+#
+#   python3 bench/bench_startup.py [--coqtop PATH] [--runs 5] [-- coqtop args]
+
+import os, sys, time, queue, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from coqtop import Coqtop, CoqtopPool, find_coqtop
+
+class Waiter:
+    def __init__(self):
+        self.replies = queue.Queue()
+
+    def receive(self, output, prompt):
+        self.replies.put((output, prompt))
+
+def started(pool, path, args):
+    waiter = Waiter()
+    begin = time.time()
+    coqtop, _warm = pool.acquire(Coqtop, waiter, path, args, debug=False)
+    coqtop.attach(waiter)
+    waiter.replies.get(timeout=60)
+    latency = time.time() - begin
+    coqtop.kill()
+    return latency
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--coqtop', default=find_coqtop())
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('args', nargs='*')
+    options = parser.parse_args()
+    if options.coqtop is None:
+        parser.error('cannot find coqtop')
+
+    for name, size in [('cold', 0), ('pooled', 1)]:
+        pool = CoqtopPool(size=size)
+        started(pool, options.coqtop, options.args)
+        # Give the pool time to start the next process, as a user would.
+        latencies = []
+        for _ in range(options.runs):
+            time.sleep(2)
+            latencies.append(started(pool, options.coqtop, options.args))
+        pool.clear()
+        print('{:7} min {:8.1f} ms  mean {:8.1f} ms'.format(
+            name, min(latencies) * 1000, sum(latencies) / len(latencies) * 1000))
+
+if __name__ == '__main__':
+    main()
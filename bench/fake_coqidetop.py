@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# A scripted stand-in for `coqidetop -main-channel stdfds`, for exercising the
+# XML backend without a Coq install. It understands Init, Add, Observe, EditAt,
+# Goals, Status, Query and SetOptions, and models sentences only as far as
+# opening and closing proofs. A JSON script passed with --script can set:
+#
+#   "errors":        {"substring": "message"}  sentences that fail when observed
+#   "async_errors":  {"substring": "message"}  tactics whose failure is only
+#                                              reported later, as if by a worker
+#   "latency":       seconds spent running each sentence
+#   "async_delay":   seconds before a worker reports back
+#
+#   python3 bench/fake_coqidetop.py [--script script.json] -main-channel stdfds
+
+import re, sys, json, time, argparse, threading
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+DEFAULT_SCRIPT = {
+    'errors': {'fail': 'failed.'},
+    'async_errors': {'async_fail': 'proof body rejected.'},
+    'latency': 0.0,
+    'async_delay': 0.2,
+}
+
+RE_OPENS  = re.compile(r'(Theorem|Lemma|Remark|Fact|Corollary|Example|Goal)\b\s*([^\s:(]*)')
+RE_CLOSES = re.compile(r'(Qed|Defined|Admitted|Save|Abort)\b')
+RE_DEFINES = re.compile(r'(Definition|Fixpoint|Inductive)\s+([^\s:(]+)')
+
+class Sentence:
+    def __init__(self, state, text, parent):
+        self.state = state
+        self.text = text
+        self.parent = parent
+        self.proofs = []
+        self.executed = parent is None
+        self.goals = 0
+
+class Fake:
+    def __init__(self, script):
+        self.script = script
+        self.out = sys.stdout.buffer
+        self.write_lock = threading.Lock()
+        self.states = {1: Sentence(1, '', None)}
+        self.next_state = 2
+        self.tip = 1
+
+    def write(self, xml):
+        with self.write_lock:
+            self.out.write(xml.encode('utf-8'))
+            self.out.flush()
+
+    def good(self, body):
+        self.write('<value val="good">{}</value>'.format(body))
+
+    def message(self, state, level, text, route=0):
+        self.write('<feedback object="state" route="{}"><state_id val="{}"/>'
+                   '<feedback_content val="message"><message><message_level val="{}"/>'
+                   '<option val="none"/><richpp><_>{}</_></richpp></message>'
+                   '</feedback_content></feedback>'.format(route, state, level, escape(text)))
+
+    def matching(self, table, text):
+        for pattern, message in table.items():
+            if pattern in text:
+                return message
+
+    def handle(self, call):
+        name = call.get('val')
+        getattr(self, 'call_' + name)(call)
+
+    def call_Init(self, call):
+        self.good('<state_id val="1"/>')
+
+    def call_SetOptions(self, call):
+        self.good('<unit/>')
+
+    def call_Add(self, call):
+        text = call.find('pair/pair/string').text or ''
+        parent = self.states[int(call.find('pair/pair[2]/state_id').get('val'))]
+        sentence = Sentence(self.next_state, text, parent)
+        self.states[sentence.state] = sentence
+        self.next_state += 1
+        self.tip = sentence.state
+        self.good('<pair><state_id val="{}"/><pair><union val="in_l"><unit/></union>'
+                  '<string></string></pair></pair>'.format(sentence.state))
+
+    def run(self, sentence):
+        time.sleep(self.script.get('latency', 0))
+        text = sentence.text.strip()
+        sentence.proofs = list(sentence.parent.proofs)
+        sentence.goals = sentence.parent.goals
+        if RE_CLOSES.match(text) and sentence.proofs:
+            name = sentence.proofs.pop()
+            if not text.startswith('Abort'):
+                self.message(sentence.state, 'info', '{} is defined'.format(name))
+        elif RE_OPENS.match(text):
+            sentence.proofs.append(RE_OPENS.match(text).group(2) or 'Unnamed_thm')
+            sentence.goals = 1
+        elif RE_DEFINES.match(text):
+            self.message(sentence.state, 'info', '{} is defined'.format(RE_DEFINES.match(text).group(2)))
+        sentence.executed = True
+
+    def call_Observe(self, call):
+        chain = []
+        sentence = self.states[int(call.find('state_id').get('val'))]
+        while not sentence.executed:
+            chain.append(sentence)
+            sentence = sentence.parent
+
+        late = []
+        for sentence in reversed(chain):
+            error = self.matching(self.script.get('async_errors', {}), sentence.text)
+            if error is not None:
+                late.append((sentence.state, error))
+            elif self.matching(self.script.get('errors', {}), sentence.text) is not None:
+                error = self.matching(self.script.get('errors', {}), sentence.text)
+                self.message(sentence.state, 'error', error)
+                self.write('<value val="fail"><state_id val="{}"/><richpp><_>{}</_></richpp>'
+                           '</value>'.format(sentence.parent.state, escape(error)))
+                return
+            self.run(sentence)
+
+        if late:
+            def report():
+                time.sleep(self.script.get('async_delay', 0))
+                for state, error in late:
+                    self.message(state, 'error', error)
+            threading.Thread(target=report, daemon=True).start()
+        self.good('<unit/>')
+
+    def call_EditAt(self, call):
+        self.tip = int(call.find('state_id').get('val'))
+        self.good('<union val="in_l"><unit/></union>')
+
+    def call_Status(self, call):
+        proofs = ''.join('<string>{}</string>'.format(escape(name))
+                         for name in self.states[self.tip].proofs)
+        self.good('<status><list/><option val="none"/><list>{}</list><int>0</int></status>'
+                  .format(proofs))
+
+    def call_Goals(self, call):
+        sentence = self.states[self.tip]
+        if not sentence.proofs:
+            self.good('<option val="none"/>')
+            return
+        goals = ''.join('<goal><string>{0}</string><list><richpp><_>H{0} : True</_></richpp>'
+                        '</list><richpp><_>goal_{1}</_></richpp></goal>'.format(i, self.tip)
+                        for i in range(sentence.goals))
+        self.good('<option val="some"><goals><list>{}</list><list/><list/><list/></goals>'
+                  '</option>'.format(goals))
+
+    def call_Query(self, call):
+        text = call.find('pair/pair/string').text or ''
+        route = call.find('pair/route_id').get('val')
+        self.message(self.tip, 'notice', '{} = 42 : nat'.format(text.rstrip('.')), route)
+        self.good('<unit/>')
+
+class Calls:
+    def __init__(self, fake):
+        self.fake = fake
+        self.builder = None
+        self.depth = 0
+
+    def start(self, tag, attrs):
+        self.depth += 1
+        if self.depth == 2:
+            self.builder = ET.TreeBuilder()
+        if self.depth >= 2:
+            self.builder.start(tag, attrs)
+
+    def end(self, tag):
+        if self.depth >= 2:
+            self.builder.end(tag)
+        if self.depth == 2:
+            self.fake.handle(self.builder.close())
+        self.depth -= 1
+
+    def data(self, data):
+        if self.depth >= 2:
+            self.builder.data(data)
+
+    def close(self):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--script')
+    args, _coq_args = parser.parse_known_args()
+
+    script = dict(DEFAULT_SCRIPT)
+    if args.script:
+        with open(args.script) as f:
+            script.update(json.load(f))
+
+    fake = Fake(script)
+    xml = ET.XMLParser(target=Calls(fake))
+    xml.feed('<calls>')
+    while True:
+        chunk = sys.stdin.buffer.read1(65536) if hasattr(sys.stdin.buffer, 'read1') \
+            else sys.stdin.buffer.read(1)
+        if not chunk:
+            return
+        xml.feed(chunk)
+
+if __name__ == '__main__':
+    main()
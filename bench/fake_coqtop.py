@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# A scripted stand-in for `coqtop -emacs`, for exercising and benchmarking the
+# plugin without a Coq install. It models sentences only as far as opening and
+# closing proofs, counting goals, and going back with `BackTo`; SIGINT stops a
+# sentence as it would coqtop's. A JSON script, passed with --script or named
+# by FAKE_COQTOP_SCRIPT, can set:
+#
+#   "latency":      seconds spent running each sentence
+#   "goal_size":    bytes of hypotheses shown with each goal
+#   "search_size":  lines in the reply to a Search
+#   "errors":       {"substring": "message"}  sentences that fail
+#   "session":      a session recorded with --record; sentences found there
+#                   get the replies they got then, in the order they did
+#
+#   python3 bench/fake_coqtop.py [--script script.json] -emacs [coqtop args]
+#
+# With --record, it runs a real coqtop instead and writes each sentence sent
+# to it and the reply, one JSON object per line:
+#
+#   python3 bench/fake_coqtop.py --record session.jsonl --coqtop coqtop -emacs [args]
+
+import os, re, sys, json, time, signal, argparse, threading, subprocess
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from coqlexer import lex_one
+from coqtop import PromptFramer, RE_ERROR
+
+DEFAULT_SCRIPT = {
+    'latency': 0.0,
+    'goal_size': 0,
+    'search_size': 3,
+    'errors': {'fail': 'failed.'},
+    'session': None,
+}
+
+RE_OPENS   = re.compile(r'(Theorem|Lemma|Remark|Fact|Corollary|Example|Goal)\b\s*([^\s:(]*)')
+RE_CLOSES  = re.compile(r'(Qed|Defined|Admitted|Save|Abort)\b')
+RE_DEFINES = re.compile(r'(Definition|Fixpoint|Inductive|Axiom|Parameter)\s+([^\s:(]+)')
+RE_QUERY   = re.compile(r'(Search\w*|Locate|Check|Print|Compute|About|Show)\b')
+RE_OPTION  = re.compile(r'(Set|Unset)\b')
+
+class Interrupted(Exception):
+    pass
+
+running = False
+
+def interrupted(signum, frame):
+    # Coqtop ignores an interrupt that comes while it waits for input.
+    if running:
+        raise Interrupted()
+
+class State:
+    def __init__(self, proofs=(), goals=0):
+        self.proofs = proofs
+        self.goals = goals
+
+class Fake:
+    def __init__(self, script):
+        self.script = script
+        self.states = {1: State()}
+        self.tip = 1
+        self.recorded = {}
+        if script['session']:
+            with open(script['session'], encoding='utf-8') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.recorded.setdefault(entry['sentence'].strip(), deque()).append(entry['output'])
+
+    def prompt(self):
+        state = self.states[self.tip]
+        return '<prompt>{} < {} |{}| {} < </prompt>'.format(
+            state.proofs[-1] if state.proofs else 'Coq', self.tip,
+            '|'.join(state.proofs), len(state.proofs))
+
+    def goals(self, state):
+        if state.goals == 0:
+            return 'No more subgoals.'
+        hypotheses = ''
+        for i in range(self.script['goal_size'] // 12):
+            hypotheses += '  h{:<4} : nat\n'.format(i)
+        return '{} subgoal{}\n  \n{}  ============================\n   goal_{}'.format(
+            state.goals, '' if state.goals == 1 else 's', hypotheses, self.tip)
+
+    def advance(self, state):
+        self.tip += 1
+        self.states[self.tip] = state
+
+    def run(self, sentence):
+        if self.script['latency']:
+            time.sleep(self.script['latency'])
+        for substring, message in self.script['errors'].items():
+            if substring in sentence:
+                return 'Toplevel input, characters 0-{}:\n> {}\nError: {}'.format(
+                    len(sentence), sentence, message)
+
+        replies, tip = self.recorded.get(sentence), self.tip
+        output = self.model(sentence)
+        if replies:
+            output = replies[0] if len(replies) == 1 else replies.popleft()
+            if re.search(RE_ERROR, output, re.M):
+                self.tip = tip
+        return output
+
+    def model(self, sentence):
+        state = self.states[self.tip]
+        match = re.match(r'BackTo\s+(\d+)', sentence)
+        if match:
+            self.tip = int(match.group(1))
+            return ''
+
+        match = RE_QUERY.match(sentence)
+        if match:
+            if match.group(1).startswith('Search'):
+                return '\n'.join('lemma_{}: forall n : nat, n = n'.format(i)
+                                 for i in range(self.script['search_size']))
+            if match.group(1) == 'Show':
+                return self.goals(state)
+            return '     = 42\n     : nat'
+
+        if RE_OPTION.match(sentence):
+            self.advance(State(state.proofs, state.goals))
+            return ''
+
+        match = RE_OPENS.match(sentence)
+        if match:
+            name = match.group(2) or 'Unnamed_thm'
+            self.advance(State(state.proofs + (name,), 1))
+            return self.goals(self.states[self.tip])
+        match = RE_CLOSES.match(sentence)
+        if match and state.proofs:
+            self.advance(State(state.proofs[:-1]))
+            return '' if match.group(1) == 'Abort' else '{} is defined'.format(state.proofs[-1])
+        match = RE_DEFINES.match(sentence)
+        if match:
+            self.advance(State(state.proofs))
+            return '{} is defined'.format(match.group(2))
+
+        if state.proofs:
+            goals = state.goals
+            if re.search(r'\bsplit\b', sentence):
+                goals += 1
+            elif re.search(r'\b(auto|trivial|reflexivity|done|exact)\b', sentence):
+                goals = max(goals - 1, 0)
+            self.advance(State(state.proofs, goals))
+            return self.goals(self.states[self.tip])
+        self.advance(State(state.proofs))
+        return ''
+
+def sentences(stream):
+    # The sentences read from `stream`, as soon as each is complete.
+    text, position = '', 0
+    for line in stream:
+        text += line
+        while True:
+            sentence = lex_one(text, position)
+            if sentence is None:
+                break
+            kind, begin, position = sentence
+            if kind == 'statement':
+                yield text[begin:position]
+        text, position = text[position:], 0
+
+def serve(script):
+    fake = Fake(script)
+    out = sys.stdout.buffer
+    out.write(('Welcome to Coq (fake)\n' + fake.prompt()).encode('utf-8'))
+    out.flush()
+    global running
+    signal.signal(signal.SIGINT, interrupted)
+    for sentence in sentences(sys.stdin):
+        try:
+            running = True
+            output = fake.run(sentence.strip())
+        except Interrupted:
+            output = 'Error: User interrupt.'
+        finally:
+            running = False
+        out.write(b'\xfe' + ((output + '\n' if output else '') + fake.prompt()).encode('utf-8'))
+        out.flush()
+
+def record(path, coqtop, args):
+    proc = subprocess.Popen([coqtop] + args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    sent = deque()
+    lock = threading.Lock()
+
+    def forward():
+        # A sentence is queued before coqtop can have replied to it.
+        for sentence in sentences(sys.stdin):
+            with lock:
+                sent.append(sentence.strip())
+            proc.stdin.write((sentence + '\n').encode('utf-8'))
+            proc.stdin.flush()
+        proc.stdin.close()
+    thread = threading.Thread(target=forward)
+    thread.daemon = True
+    thread.start()
+    signal.signal(signal.SIGINT, lambda signum, frame: proc.send_signal(signal.SIGINT))
+
+    framer, welcome = PromptFramer(), True
+    with open(path, 'w', encoding='utf-8') as f:
+        while True:
+            chunk = proc.stdout.read1(65536)
+            if not chunk:
+                break
+            sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            for output, _prompt in framer.feed(chunk):
+                if welcome:
+                    welcome = False
+                    continue
+                with lock:
+                    sentence = sent.popleft() if sent else ''
+                f.write(json.dumps({'sentence': sentence, 'output': output.strip()}) + '\n')
+                f.flush()
+    return proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--script', default=os.environ.get('FAKE_COQTOP_SCRIPT'))
+    parser.add_argument('--record', help='run --coqtop and record the session to this file')
+    parser.add_argument('--coqtop', default='coqtop')
+    options, args = parser.parse_known_args()
+
+    if options.record:
+        return record(options.record, options.coqtop, args)
+    script = dict(DEFAULT_SCRIPT)
+    if options.script:
+        with open(options.script, encoding='utf-8') as f:
+            script.update(json.load(f))
+    serve(script)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,371 @@
+# Just enough of Sublime Text's `sublime` and `sublime_plugin` modules to run
+# the plugin outside the editor. Views hold plain text and regions, and know no
+# syntax; `set_timeout` callbacks run one at a time on a thread standing in for
+# the UI thread, and `set_timeout_async` ones on another. Every command run and
+# callback notifies `changed`, for drivers waiting on the plugin's state.
+#
+#   import sublime_stub
+#   sublime_stub.install(settings={'coqtop_path': ...})
+#   module = sublime_stub.load_plugin()
+
+import os, re, sys, json, time, heapq, types, tempfile, threading, importlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+changed = threading.Condition()
+
+def notify():
+    with changed:
+        changed.notify_all()
+
+def wait_until(predicate, timeout=60):
+    deadline = time.time() + timeout
+    with changed:
+        while not predicate():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise RuntimeError('timed out')
+            changed.wait(min(remaining, 0.05))
+
+class Loop:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.queue = []
+        self.count = 0
+        thread = threading.Thread(target=self.work)
+        thread.daemon = True
+        thread.start()
+
+    def call(self, fn, delay=0):
+        with self.cond:
+            self.count += 1
+            heapq.heappush(self.queue, (time.time() + delay / 1000.0, self.count, fn))
+            self.cond.notify()
+
+    def work(self):
+        while True:
+            with self.cond:
+                while not self.queue or self.queue[0][0] > time.time():
+                    self.cond.wait(self.queue[0][0] - time.time() if self.queue else None)
+                _due, _count, fn = heapq.heappop(self.queue)
+            fn()
+            notify()
+
+# sublime
+
+class Region:
+    def __init__(self, a, b=None):
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def size(self):
+        return self.end() - self.begin()
+
+    def empty(self):
+        return self.a == self.b
+
+    def contains(self, x):
+        if isinstance(x, Region):
+            return self.begin() <= x.begin() and x.end() <= self.end()
+        return self.begin() <= x <= self.end()
+
+    def __eq__(self, other):
+        return isinstance(other, Region) and (self.a, self.b) == (other.a, other.b)
+
+    def __repr__(self):
+        return '({}, {})'.format(self.a, self.b)
+
+class Settings:
+    def __init__(self, values=None):
+        self.values = dict(values or {})
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+    def erase(self, key):
+        self.values.pop(key, None)
+
+    def has(self, key):
+        return key in self.values
+
+    def add_on_change(self, key, fn):
+        pass
+
+    def clear_on_change(self, key):
+        pass
+
+class Edit:
+    pass
+
+class View:
+    count = 0
+
+    def __init__(self, window, text='', name=''):
+        View.count += 1
+        self.view_id = View.count
+        self._window = window
+        self.text = text
+        self._name = name
+        self._file_name = None
+        self._settings = Settings()
+        self._sel = []
+        self.regions = {}
+        self.changes = 0
+
+    def id(self):
+        return self.view_id
+
+    def buffer_id(self):
+        return self.view_id
+
+    def window(self):
+        return self._window
+
+    def file_name(self):
+        return self._file_name
+
+    def name(self):
+        return self._name
+
+    def set_name(self, name):
+        self._name = name
+
+    def settings(self):
+        return self._settings
+
+    def size(self):
+        return len(self.text)
+
+    def change_count(self):
+        return self.changes
+
+    def substr(self, x):
+        if isinstance(x, Region):
+            return self.text[x.begin():x.end()]
+        return self.text[x:x + 1]
+
+    def sel(self):
+        return Selection(self._sel)
+
+    def line(self, x):
+        point = x.begin() if isinstance(x, Region) else x
+        begin = self.text.rfind('\n', 0, point) + 1
+        end = self.text.find('\n', point)
+        return Region(begin, len(self.text) if end == -1 else end)
+
+    def rowcol(self, point):
+        return self.text.count('\n', 0, point), point - self.text.rfind('\n', 0, point) - 1
+
+    def find(self, pattern, start, flags=0):
+        match = re.compile(pattern).search(self.text, start)
+        return Region(match.start(), match.end()) if match else Region(-1, -1)
+
+    def find_by_selector(self, selector):
+        return []
+
+    def add_regions(self, key, regions, scope='', icon='', flags=0):
+        self.regions[key] = list(regions)
+
+    def get_regions(self, key):
+        return list(self.regions.get(key, []))
+
+    def erase_regions(self, key):
+        self.regions.pop(key, None)
+
+    def replace(self, edit, region, text):
+        self.text = self.text[:region.begin()] + text + self.text[region.end():]
+        self.changes += 1
+
+    def insert(self, edit, point, text):
+        self.replace(edit, Region(point), text)
+        return len(text)
+
+    def run_command(self, name, args=None):
+        cls = sublime_plugin.text_commands.get(name)
+        if cls is not None:
+            command = cls(self)
+            if command.is_enabled():
+                command.run(Edit(), **(args or {}))
+        notify()
+
+    def set_read_only(self, value):
+        pass
+
+    def set_scratch(self, value):
+        pass
+
+    def is_scratch(self):
+        return False
+
+    def set_syntax_file(self, path):
+        pass
+
+    def show(self, x, show_surrounds=True):
+        pass
+
+    def show_at_center(self, x):
+        pass
+
+    def viewport_extent(self):
+        return 800.0, 600.0
+
+    def em_width(self):
+        return 8.0
+
+    def text_to_layout(self, point):
+        return 0.0, 0.0
+
+    def set_viewport_position(self, position, animate=True):
+        pass
+
+class Selection(object):
+    def __init__(self, regions):
+        self.regions = regions
+
+    def __getitem__(self, i):
+        return self.regions[i]
+
+    def __iter__(self):
+        return iter(self.regions)
+
+    def __len__(self):
+        return len(self.regions)
+
+    def clear(self):
+        del self.regions[:]
+
+    def add(self, region):
+        self.regions.append(region)
+
+class Window:
+    def __init__(self, folders):
+        self._folders = list(folders)
+        self.views = []
+        self.panels = {}
+        self.groups = 1
+
+    def id(self):
+        return 1
+
+    def folders(self):
+        return self._folders
+
+    def new_file(self):
+        view = View(self)
+        self.views.append(view)
+        return view
+
+    def num_groups(self):
+        return self.groups
+
+    def active_view(self):
+        return self.views[0] if self.views else None
+
+    def active_view_in_group(self, group):
+        while len(self.views) <= group:
+            self.new_file()
+        return self.views[group]
+
+    def focus_view(self, view):
+        pass
+
+    def run_command(self, name, args=None):
+        if name == 'new_pane':
+            self.groups += 1
+            self.new_file()
+
+    def create_output_panel(self, name, unlisted=False):
+        panel = self.panels[name] = View(self, name=name)
+        return panel
+
+    def find_output_panel(self, name):
+        return self.panels.get(name)
+
+    def active_panel(self):
+        return None
+
+    def show_quick_panel(self, items, on_select, flags=0, selected_index=-1, on_highlight=None):
+        pass
+
+    def show_input_panel(self, caption, initial, on_done, on_change, on_cancel):
+        pass
+
+sublime = types.ModuleType('sublime')
+sublime_plugin = types.ModuleType('sublime_plugin')
+
+def install(settings=None, folder=None):
+    ui, background = Loop(), Loop()
+    cache = tempfile.mkdtemp(prefix='sublime-coq-cache-')
+    window = Window([folder or tempfile.mkdtemp(prefix='sublime-coq-folder-')])
+
+    with open(os.path.join(ROOT, 'Sublime-Coq.sublime-settings'), encoding='utf-8') as f:
+        text = re.sub(r'^\s*//.*$', '', f.read(), flags=re.M)
+    values = json.loads(re.sub(r',(\s*[}\]])', r'\1', text))
+    values.update(settings or {})
+    package_settings = Settings(values)
+
+    sublime.Region = Region
+    sublime.Window = Window
+    sublime.View = View
+    for i, name in enumerate(['HIDDEN', 'DRAW_NO_FILL', 'DRAW_NO_OUTLINE',
+                              'DRAW_SQUIGGLY_UNDERLINE', 'OP_EQUAL', 'OP_NOT_EQUAL']):
+        setattr(sublime, name, 1 << i)
+    sublime.load_settings = lambda name: package_settings
+    sublime.save_settings = lambda name: None
+    sublime.set_timeout = lambda fn, delay=0: ui.call(fn, delay)
+    sublime.set_timeout_async = lambda fn, delay=0: background.call(fn, delay)
+    sublime.status_message = lambda message: None
+    sublime.error_message = lambda message: sys.stderr.write('error: {}\n'.format(message))
+    sublime.message_dialog = lambda message: None
+    sublime.cache_path = lambda: cache
+    sublime.active_window = lambda: window
+    sublime.windows = lambda: [window]
+    sublime.version = lambda: '4000'
+    sublime.platform = lambda: 'linux'
+
+    class TextCommand:
+        def __init__(self, view):
+            self.view = view
+
+        def is_enabled(self):
+            return True
+
+    class EventListener:
+        pass
+
+    class TextInputHandler:
+        pass
+
+    class ListInputHandler:
+        pass
+
+    sublime_plugin.TextCommand = TextCommand
+    sublime_plugin.EventListener = EventListener
+    sublime_plugin.TextInputHandler = TextInputHandler
+    sublime_plugin.ListInputHandler = ListInputHandler
+    sublime_plugin.text_commands = {}
+
+    sys.modules['sublime'] = sublime
+    sys.modules['sublime_plugin'] = sublime_plugin
+    return window
+
+def load_plugin():
+    # Imports the package as Sublime Text would, and registers its commands.
+    packages = tempfile.mkdtemp(prefix='sublime-coq-packages-')
+    os.symlink(ROOT, os.path.join(packages, 'SublimeCoq'))
+    sys.path.insert(0, packages)
+    module = importlib.import_module('SublimeCoq.sublimecoq')
+    for name, value in vars(module).items():
+        if isinstance(value, type) and issubclass(value, sublime_plugin.TextCommand):
+            command = re.sub(r'(?<!^)(?=[A-Z])', '_', name[:-len('Command')]).lower()
+            sublime_plugin.text_commands[command] = value
+    return module
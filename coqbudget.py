@@ -0,0 +1,47 @@
+import os, subprocess
+
+# Keeps the coqtops of open buffers within a budget of sessions and of memory.
+# A session is every process a buffer runs (its coqtop, and any side or
+# lookahead process); once the live ones are over either limit, the least
+# recently used idle ones are suspended until they are back under it.
+
+try:
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    PAGE_SIZE = 4096
+
+def rss(pid):
+    # The resident size of a process in bytes, or None where it can't be told.
+    try:
+        with open('/proc/{:d}/statm'.format(pid)) as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    if os.name == 'nt':
+        return None
+    try:
+        output = subprocess.check_output(['ps', '-o', 'rss=', '-p', str(pid)],
+                                         stderr=subprocess.DEVNULL)
+        return int(output.split()[0]) * 1024
+    except (OSError, ValueError, IndexError, subprocess.CalledProcessError):
+        return None
+
+def session_rss(procs):
+    # The resident size of the live processes among `procs`, counting those
+    # that can't be told as nothing.
+    return sum(rss(proc.pid) or 0 for proc in procs if proc.poll() is None)
+
+def over_budget(sessions, max_sessions=0, max_bytes=0):
+    # `sessions` are (key, last used, bytes, idle) for the live sessions. The
+    # keys of those to suspend, least recently used first; a limit of 0 is none.
+    count, total = len(sessions), sum(size for _key, _used, size, _idle in sessions)
+    victims = []
+    for key, _used, size, idle in sorted(sessions, key=lambda session: session[1]):
+        if ((not max_sessions or count <= max_sessions) and
+                (not max_bytes or total <= max_bytes)):
+            break
+        if idle:
+            victims.append(key)
+            count -= 1
+            total -= size
+    return victims
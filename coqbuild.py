@@ -0,0 +1,180 @@
+import os, json, time, hashlib, threading, subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+try:
+    from .coqcheck import dependencies
+except (ImportError, SystemError):
+    from coqcheck import dependencies
+
+# Compiles the files of a project that are out of date, each once the files it
+# requires are, with up to `jobs` coqc processes at a time. Every file has a
+# key: a hash of its text, of the keys of the files it requires, and of coqc
+# and its arguments. A file is compiled again when it has no `.vo`, when its
+# key is not the one it was last compiled with, or when a file it requires is
+# compiled again; so a change is carried to everything that depends on it,
+# and nothing else is touched. Keys are kept in `state_file` between builds.
+#
+# Progress is reported as records, as check_all does: one when a file starts
+# compiling, and one with its status, 'ok', 'failed' or 'skipped', when done.
+
+class Build:
+    def __init__(self, project, coqc, state_file, jobs=1, args=[]):
+        self.project = project
+        self.coqc = coqc
+        self.state_file = state_file
+        self.jobs = max(jobs, 1)
+        self.args = project.args + list(args)
+        self.lock = threading.Lock()
+        self.procs = set()
+        self.cancelled = False
+
+    def plan(self, required_by=None):
+        # The files to compile, each after those it requires, and the graph
+        # of dependencies. With `required_by`, only what that file requires.
+        files = sorted(set(self.project.files) | set([required_by] if required_by else []))
+        graph = dependencies(self.project, files)
+        order, cycle = _order(graph)
+        if required_by is not None:
+            needed, stack = set(), list(graph[required_by])
+            while stack:
+                path = stack.pop()
+                if path not in needed:
+                    needed.add(path)
+                    stack.extend(graph[path])
+            order = [path for path in order if path in needed]
+            cycle = [path for path in cycle if path in needed]
+
+        keys, stored, outdated = {}, self._load(), set()
+        for path in order:
+            try:
+                with open(path, 'rb') as f:
+                    digest = hashlib.sha1(f.read()).hexdigest()
+            except OSError:
+                digest = None
+            keys[path] = hashlib.sha1('\0'.join(
+                [self._root(), str(digest)] + sorted(keys[dep] for dep in graph[path])
+            ).encode('utf-8')).hexdigest()
+            if (stored.get(path) != keys[path] or not os.path.exists(_vo(path)) or
+                    graph[path] & outdated):
+                outdated.add(path)
+        self.keys = keys
+        return [path for path in order if path in outdated] + cycle, graph
+
+    def run(self, files, graph, emit):
+        # Compiles `files` from plan, calling `emit` with a record for each
+        # step. Returns whether all of them compiled.
+        waiting = dict((path, graph[path] & set(files)) for path in files)
+        running, done, failed = {}, set(), set()
+        ok = True
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while waiting or running:
+                for path in [path for path, deps in waiting.items() if deps & failed]:
+                    emit({'file': path, 'status': 'skipped',
+                          'blocked_by': sorted(waiting.pop(path) & failed)})
+                    failed.add(path)
+                    ok = False
+
+                for path in [path for path in files if path in waiting and waiting[path] <= done]:
+                    del waiting[path]
+                    if self.cancelled:
+                        failed.add(path)
+                        continue
+                    emit({'file': path, 'status': 'compiling'})
+                    running[pool.submit(self._compile, path)] = path
+
+                if not running:
+                    for path in sorted(waiting):
+                        emit({'file': path, 'status': 'skipped',
+                              'blocked_by': sorted(waiting[path]),
+                              'message': 'Error: Circular dependency.'})
+                    return False
+
+                finished, _pending = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    path = running.pop(future)
+                    record = future.result()
+                    emit(record)
+                    if record['status'] == 'ok':
+                        done.add(path)
+                    else:
+                        failed.add(path)
+                        ok = False
+        return ok and not self.cancelled
+
+    def cancel(self):
+        self.cancelled = True
+        with self.lock:
+            procs = list(self.procs)
+        for proc in procs:
+            if proc.poll() is None:
+                proc.kill()
+
+    def _compile(self, path):
+        started = time.time()
+        try:
+            proc = subprocess.Popen([self.coqc] + self.args + [path],
+                stderr=subprocess.STDOUT,
+                stdout=subprocess.PIPE)
+        except OSError as e:
+            return {'file': path, 'status': 'failed', 'message': 'Error: {}'.format(e)}
+        with self.lock:
+            self.procs.add(proc)
+        output = proc.communicate()[0].decode('utf-8', 'replace')
+        with self.lock:
+            self.procs.discard(proc)
+
+        record = {'file': path, 'seconds': round(time.time() - started, 3)}
+        if proc.returncode != 0 or self.cancelled:
+            record.update(status='failed', message=output.strip() or 'Error: coqc was stopped.')
+            self._save(path, None)
+        else:
+            record.update(status='ok')
+            self._save(path, self.keys[path])
+        return record
+
+    def _root(self):
+        try:
+            mtime = os.stat(self.coqc).st_mtime
+        except OSError:
+            mtime = None
+        return '\0'.join([self.coqc, str(mtime)] + self.args)
+
+    def _load(self):
+        try:
+            with open(self.state_file, encoding='utf-8') as f:
+                return json.load(f)['keys']
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def _save(self, path, key):
+        # Written after every file, so that a build that stops keeps what it did.
+        with self.lock:
+            keys = self._load()
+            if key is None:
+                keys.pop(path, None)
+            else:
+                keys[path] = key
+            directory = os.path.dirname(self.state_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temporary = self.state_file + '.tmp'
+            with open(temporary, 'w', encoding='utf-8') as f:
+                json.dump({'keys': keys}, f)
+            os.replace(temporary, self.state_file)
+
+def _vo(path):
+    return os.path.splitext(path)[0] + '.vo'
+
+def _order(graph):
+    # The files of `graph` each after those it requires, and those that
+    # require themselves, indirectly, apart.
+    order, placed, remaining = [], set(), sorted(graph)
+    while remaining:
+        ready = [path for path in remaining if graph[path] <= placed]
+        if not ready:
+            break
+        order += ready
+        placed.update(ready)
+        remaining = [path for path in remaining if path not in placed]
+    return order, remaining
@@ -0,0 +1,95 @@
+import os, json, time, hashlib, threading
+
+try:
+    from .coqcheck import RE_REQUIRE
+    from .coqprelude import deps_digest
+except (ImportError, SystemError):
+    from coqcheck import RE_REQUIRE
+    from coqprelude import deps_digest
+
+# What each statement of a file replied, kept on disk between sessions. A
+# statement is known by a hash of its text chained after those of the
+# statements before it, so a statement is found only if nothing before it
+# changed either. The chain starts from coqtop and its arguments, and takes in
+# the `.vo` files each `Require` may load. There is a file of results per
+# source file; results not used for `max_age` seconds are dropped when it is
+# written, and the least recently written files once all of them exceed
+# `max_bytes`.
+
+class Chain:
+    def __init__(self, path, args):
+        self.path = path
+        self.args = args
+        self.digest = hashlib.sha1('\0'.join([path] + list(args) + [deps_digest([], path, args)])
+                                   .encode('utf-8')).hexdigest()
+
+    def next(self, statement):
+        statement = statement.strip()
+        deps = deps_digest([statement], self.path, self.args) if RE_REQUIRE.match(statement) else ''
+        self.digest = hashlib.sha1('{}\0{}\0{}'.format(self.digest, statement, deps)
+                                   .encode('utf-8')).hexdigest()
+        return self.digest
+
+class ResultCache:
+    def __init__(self, directory, max_bytes=64 << 20, max_age=30 * 86400):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+
+    def _file(self, source):
+        name = hashlib.sha1(os.path.abspath(source).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.json')
+
+    def load(self, source):
+        # {hash: (output, theorem)}
+        try:
+            with open(self._file(source), encoding='utf-8') as f:
+                entries = json.load(f)['results']
+        except (OSError, ValueError, KeyError):
+            return {}
+        return dict((key, (output, theorem)) for key, (output, theorem, _used) in entries.items())
+
+    def save(self, source, results):
+        # `results` are (hash, output, theorem), added to those already kept.
+        now = time.time()
+        with self.lock:
+            try:
+                with open(self._file(source), encoding='utf-8') as f:
+                    entries = json.load(f)['results']
+            except (OSError, ValueError, KeyError):
+                entries = {}
+            entries = dict((key, entry) for key, entry in entries.items()
+                           if now - entry[2] < self.max_age)
+            for key, output, theorem in results:
+                entries[key] = [output, theorem, now]
+
+            os.makedirs(self.directory, exist_ok=True)
+            temporary = self._file(source) + '.tmp'
+            with open(temporary, 'w', encoding='utf-8') as f:
+                json.dump({'source': source, 'results': entries}, f)
+            os.replace(temporary, self._file(source))
+            self._evict()
+
+    def forget(self, source):
+        with self.lock:
+            try:
+                os.remove(self._file(source))
+            except OSError:
+                pass
+
+    def _evict(self):
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.json'):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        total = sum(size for _mtime, size, _path in files)
+        now = time.time()
+        for mtime, size, path in files:
+            if total <= self.max_bytes and now - mtime < self.max_age:
+                continue
+            os.remove(path)
+            total -= size
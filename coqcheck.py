@@ -0,0 +1,337 @@
+import os, re, sys, json, time, queue, shlex, argparse, subprocess, multiprocessing
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+try:
+    from .coqtop import Coqtop, find_coqtop, RE_ERROR
+    from .coqlexer import lex
+except (ImportError, SystemError):
+    from coqtop import Coqtop, find_coqtop, RE_ERROR
+    from coqlexer import lex
+
+# Checks Coq files without the editor, for CI and pre-commit hooks:
+#
+#   python -m coqtop check [--project _CoqProject] [--jobs N] [file.v ...]
+#
+# Each file is streamed sentence by sentence through its own `coqtop -emacs`,
+# stopping at the first error as coqc would. Files run in a process pool in the
+# order given by their `Require`s; a file that others in the run depend on is
+# compiled with coqc once it checks, so they can load it. Every problem and
+# every file's result is printed as one JSON object per line.
+#
+#   python -m coqtop build [--project _CoqProject] [--jobs N]
+#
+# compiles the files of a project that changed, and those that depend on them
+# (see Build), printing the same kind of records.
+
+RE_WARNING  = r'^Warning:'
+RE_LOCATION = r'^Toplevel input, characters (\d+)-(\d+):'
+RE_REQUIRE  = re.compile(r'(?:From\s+(\S+)\s+)?Require\s+(?:(?:Import|Export)\s+)?(.*)\.$', re.S)
+
+class Session:
+    # Stands in for the editor's manager: replies are queued in order for
+    # whoever is waiting on them.
+
+    def __init__(self, path, args, timeout=None, backend=Coqtop, debug=False, output_limit=None):
+        self.replies = queue.Queue()
+        self.timeout = timeout
+        self.coqtop = backend(self, path, args, debug)
+        self.coqtop.output_limit = output_limit
+        self.welcome = self.reply()
+
+    def receive(self, output, prompt, parse_time=0.0):
+        self.replies.put((output, prompt))
+
+    def proof_failed(self, state, output):
+        pass
+
+    def reply(self):
+        waited = 0
+        while True:
+            try:
+                return self.replies.get(timeout=0.5)
+            except queue.Empty:
+                waited += 0.5
+            if self.coqtop.proc.poll() is not None and self.replies.empty():
+                raise EOFError('coqtop exited with status {}'.format(self.coqtop.proc.returncode))
+            if self.timeout is not None and waited >= self.timeout:
+                raise EOFError('no reply from coqtop in {} seconds'.format(self.timeout))
+
+    def close(self):
+        self.coqtop.kill()
+        self.coqtop.proc.wait()
+
+class Lines:
+    def __init__(self, text):
+        self.starts = [0] + [match.end() for match in re.finditer(r'\n', text)]
+
+    def at(self, offset):
+        # 1-based line and column of a character offset.
+        line = bisect_right(self.starts, offset)
+        return line, offset - self.starts[line - 1] + 1
+
+def _record(path, lines, severity, begin, end, message):
+    line, column = lines.at(begin)
+    end_line, end_column = lines.at(end)
+    return {'file': path, 'severity': severity, 'line': line, 'column': column,
+            'end_line': end_line, 'end_column': end_column, 'message': message}
+
+def _problem(path, text, lines, begin, end, output, pattern, severity):
+    match = re.search(pattern, output, re.M)
+    if match is None:
+        return None
+
+    # Locations are byte offsets into the sentence as it was sent.
+    location = re.search(RE_LOCATION, output, re.M)
+    if location is not None:
+        sentence = text[begin:end].encode('utf-8')
+        first, last = int(location.group(1)), int(location.group(2))
+        begin, end = (begin + len(sentence[:first].decode('utf-8', 'ignore')),
+                      begin + len(sentence[:last].decode('utf-8', 'ignore')))
+    return _record(path, lines, severity, begin, end, output[match.start():].strip())
+
+def check_file(path, coqtop, args, window=16, timeout=None, coqc=None):
+    started = time.time()
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    lines = Lines(text)
+
+    sentences, end = [], 0
+    for kind, begin, end in lex(text + '\n'):
+        if kind == 'statement':
+            sentences.append((begin, end))
+
+    records, checked = [], 0
+    session = Session(coqtop, args, timeout)
+    try:
+        # Keep up to `window` sentences queued in coqtop; stop sending at the
+        # first error, since what follows would only fail because of it.
+        sent = 0
+        while checked < len(sentences):
+            while sent < len(sentences) and sent - checked < window:
+                begin, end_ = sentences[sent]
+                session.coqtop.send(text[begin:end_])
+                sent += 1
+
+            output, _prompt = session.reply()
+            begin, end_ = sentences[checked]
+            checked += 1
+            warning = _problem(path, text, lines, begin, end_, output, RE_WARNING, 'warning')
+            if warning is not None:
+                records.append(warning)
+            error = _problem(path, text, lines, begin, end_, output, RE_ERROR, 'error')
+            if error is not None:
+                records.append(error)
+                break
+    except EOFError as e:
+        begin, end_ = sentences[checked] if checked < len(sentences) else (end, end)
+        records.append(_record(path, lines, 'error', begin, end_, 'Error: {}.'.format(e)))
+    finally:
+        session.close()
+
+    failed = any(record['severity'] == 'error' for record in records)
+    if not failed and text[end:].strip():
+        end += len(text[end:]) - len(text[end:].lstrip())
+        records.append(_record(path, lines, 'error', end, len(text),
+                               'Error: Unterminated sentence or comment.'))
+        failed = True
+
+    if not failed and coqc is not None:
+        proc = subprocess.Popen([coqc] + args + [path],
+            stderr=subprocess.STDOUT,
+            stdout=subprocess.PIPE)
+        output = proc.communicate()[0].decode('utf-8', 'replace')
+        if proc.returncode != 0:
+            records.append(_record(path, lines, 'error', 0, 0,
+                                   'Error: coqc failed:\n' + output.strip()))
+            failed = True
+
+    records.append({'file': path, 'status': 'failed' if failed else 'ok',
+                    'sentences': checked, 'seconds': round(time.time() - started, 3)})
+    return records
+
+# Projects and dependencies
+
+class Project:
+    def __init__(self, path=None):
+        self.path = path
+        self.args = []
+        self.files = []
+        self.roots = []
+
+        if path is None:
+            return
+        root = os.path.dirname(os.path.abspath(path))
+        with open(path, encoding='utf-8') as f:
+            words = shlex.split(f.read(), comments=True)
+
+        while words:
+            word = words.pop(0)
+            if word in ['-R', '-Q'] and len(words) >= 2:
+                directory, logical = os.path.join(root, words.pop(0)), words.pop(0)
+                self.args += [word, directory, logical]
+                self.roots.append((directory, logical))
+            elif word == '-I' and words:
+                self.args += [word, os.path.join(root, words.pop(0))]
+            elif word == '-arg' and words:
+                self.args += shlex.split(words.pop(0))
+            elif word.endswith('.v'):
+                self.files.append(os.path.join(root, word))
+
+    def module(self, path):
+        path = os.path.abspath(path)
+        for directory, logical in self.roots:
+            relative = os.path.relpath(path, directory)
+            if not relative.startswith(os.pardir):
+                name = os.path.splitext(relative)[0].replace(os.sep, '.')
+                return logical + '.' + name if logical else name
+        return os.path.splitext(os.path.basename(path))[0]
+
+def requires(text):
+    # (From, name) for every module a file requires.
+    for kind, begin, end in lex(text + '\n'):
+        match = RE_REQUIRE.match(text, begin, end) if kind == 'statement' else None
+        if match is not None:
+            for name in match.group(2).split():
+                yield match.group(1), name.strip('()')
+
+def _provides(module, prefix, name):
+    if prefix is not None:
+        if not module.startswith(prefix + '.'):
+            return False
+        module = module[len(prefix) + 1:]
+    return module == name or module.endswith('.' + name)
+
+def dependencies(project, files):
+    # Maps each file to the files it requires among `files`.
+    modules = {path: project.module(path) for path in files}
+    graph = {}
+    for path in files:
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        graph[path] = set(other for prefix, name in requires(text)
+                                for other in files
+                                if other != path and _provides(modules[other], prefix, name))
+    return graph
+
+def check_all(files, project, options, jobs, emit):
+    # Runs check_file on every file whose dependencies checked, and reports the
+    # rest as skipped. Returns whether everything checked.
+    graph = dependencies(project, files)
+    needed = set(dep for deps in graph.values() for dep in deps)
+    waiting, running, failed = dict(graph), {}, set()
+    ok = True
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        while waiting or running:
+            for path in [path for path, deps in waiting.items() if deps & failed]:
+                emit({'file': path, 'status': 'skipped',
+                      'blocked_by': sorted(waiting.pop(path) & failed)})
+                failed.add(path)
+                ok = False
+
+            done = set(graph) - set(waiting) - set(running) - failed
+            for path in sorted(path for path, deps in waiting.items() if deps <= done):
+                del waiting[path]
+                coqc = options['coqc'] if path in needed else None
+                future = pool.submit(check_file, path, options['coqtop'], options['args'],
+                                     options['window'], options['timeout'], coqc)
+                running[future] = path
+
+            if not running:
+                # Whatever is still waiting requires itself, indirectly.
+                for path in sorted(waiting):
+                    emit({'file': path, 'status': 'skipped', 'blocked_by': sorted(waiting[path]),
+                          'message': 'Error: Circular dependency.'})
+                return False
+
+            finished, _pending = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                path = running.pop(future)
+                try:
+                    records = future.result()
+                except Exception as e:
+                    records = [{'file': path, 'status': 'failed', 'message': 'Error: {}'.format(e)}]
+                for record in records:
+                    emit(record)
+                if records[-1]['status'] != 'ok':
+                    failed.add(path)
+                    ok = False
+    return ok
+
+def find_project(start):
+    # The nearest `_CoqProject` in `start` or a directory above it.
+    directory = os.path.abspath(start)
+    while True:
+        path = os.path.join(directory, '_CoqProject')
+        if os.path.exists(path):
+            return path
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m coqtop')
+    commands = parser.add_subparsers(dest='command')
+    check = commands.add_parser('check', help='check Coq files, printing JSON lines')
+    check.add_argument('files', nargs='*',
+                       help='files to check; defaults to those listed in the project')
+    check.add_argument('--project', help='a _CoqProject file; by default the nearest one')
+    check.add_argument('--coqtop', help='path to coqtop; by default found in PATH')
+    check.add_argument('--coqc', help='path to coqc; by default found in PATH')
+    check.add_argument('--no-compile', action='store_true',
+                       help='do not compile files that others in the run require')
+    check.add_argument('--arg', action='append', default=[],
+                       help='an extra argument to coqtop and coqc, may be repeated')
+    check.add_argument('--jobs', '-j', type=int, default=multiprocessing.cpu_count())
+    check.add_argument('--window', type=int, default=16,
+                       help='sentences queued in coqtop ahead of their replies')
+    check.add_argument('--timeout', type=float,
+                       help='seconds to wait for any one sentence')
+    build = commands.add_parser('build', help='compile the out of date files of a project')
+    build.add_argument('--project', help='a _CoqProject file; by default the nearest one')
+    build.add_argument('--coqc', help='path to coqc; by default found in PATH')
+    build.add_argument('--state', help='where to keep what was compiled; '
+                                       'by default .coqbuild.json next to the project')
+    build.add_argument('--arg', action='append', default=[],
+                       help='an extra argument to coqc, may be repeated')
+    build.add_argument('--jobs', '-j', type=int, default=multiprocessing.cpu_count())
+    options = parser.parse_args(argv)
+    if options.command not in ['check', 'build']:
+        parser.print_help()
+        return 2
+
+    project_file = options.project or find_project(os.getcwd())
+    project = Project(project_file)
+    def emit(record):
+        print(json.dumps(record, sort_keys=True))
+        sys.stdout.flush()
+
+    if options.command == 'build':
+        try:
+            from .coqbuild import Build
+        except (ImportError, SystemError):
+            from coqbuild import Build
+        if project_file is None:
+            parser.error('cannot find _CoqProject')
+        coqc = options.coqc or find_coqtop('coqc')
+        if coqc is None:
+            parser.error('cannot find coqc')
+        state = options.state or os.path.join(os.path.dirname(os.path.abspath(project_file)),
+                                              '.coqbuild.json')
+        builder = Build(project, coqc, state, max(options.jobs, 1), options.arg)
+        files, graph = builder.plan()
+        return 0 if builder.run(files, graph, emit) else 1
+
+    files = sorted(set(os.path.abspath(path) for path in options.files or project.files))
+    coqtop = options.coqtop or find_coqtop('coqtop')
+    if coqtop is None:
+        parser.error('cannot find coqtop')
+    coqc = None if options.no_compile else options.coqc or find_coqtop('coqc')
+
+    ok = check_all(files, project, {
+        'coqtop': coqtop, 'coqc': coqc, 'args': project.args + options.arg,
+        'window': max(options.window, 1), 'timeout': options.timeout,
+    }, max(options.jobs, 1), emit)
+    return 0 if ok else 1
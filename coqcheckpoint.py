@@ -0,0 +1,73 @@
+import os, re, glob, hashlib, subprocess
+
+try:
+    from .coqcache import Chain
+except (ImportError, SystemError):
+    from coqcache import Chain
+
+# The proven part of a file up to the end of a top-level proof, compiled with
+# coqc into a module of its own, so that coqtop can load it in the time it
+# takes to load a `.vo` rather than run every statement again. Modules are kept
+# in one directory under the logical name `SublimeCoqCheckpoint`, named after
+# the file and a Chain of the statements they hold: one compiled before is used
+# again as long as the statements, the `.vo` files they load and the arguments
+# are the same. Compiling one removes those compiled before for the same file.
+#
+# Loading a module doesn't bring along the `Import`s, scopes and options it set
+# for itself, so the statements that do are run again after.
+
+LOGICAL = 'SublimeCoqCheckpoint'
+
+RE_REPLAY = re.compile(r'\s*(?:(?:From\s+\S+\s+)?Require\b|Import\b|Export\b|'
+                       r'(?:Global\s+)?(?:Open|Close)\s+Scope\b|(?:Global\s+)?(?:Set|Unset)\s)')
+
+class Checkpoint:
+    def __init__(self, directory, source, statements, path, args):
+        chain = Chain(path, args)
+        for statement in statements:
+            chain.next(statement)
+        prefix = hashlib.sha1(os.path.abspath(source).encode('utf-8')).hexdigest()[:12]
+        self.prefix = 'M' + prefix
+        self.module = '{}_{}'.format(self.prefix, chain.digest[:16])
+        self.directory = directory
+        self.file = os.path.join(directory, self.module + '.v')
+        self.proc = None
+        self.cancelled = False
+
+    def args(self):
+        # What coqtop and coqc need to find the module.
+        return ['-Q', self.directory, LOGICAL]
+
+    def statement(self):
+        return 'Require Import {}.{}.'.format(LOGICAL, self.module)
+
+    def compiled(self):
+        return os.path.exists(os.path.join(self.directory, self.module + '.vo'))
+
+    def compile(self, coqc, args, text):
+        # Returns coqc's error, or None once the module is compiled.
+        os.makedirs(self.directory, exist_ok=True)
+        for path in glob.glob(os.path.join(self.directory, self.prefix + '_*')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with open(self.file, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+        if self.cancelled:
+            return 'Cancelled.'
+        self.proc = subprocess.Popen([coqc] + args + self.args() + [self.file],
+            stderr=subprocess.STDOUT,
+            stdout=subprocess.PIPE)
+        output = self.proc.communicate()[0].decode('utf-8', 'replace')
+        if self.cancelled:
+            return 'Cancelled.'
+        if self.proc.returncode != 0:
+            return 'Error: coqc failed:\n' + output.strip()
+        return None
+
+    def cancel(self):
+        self.cancelled = True
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.kill()
@@ -0,0 +1,142 @@
+import re, threading
+from bisect import bisect_left, insort
+
+try:
+    from .coqcheck import RE_REQUIRE
+except (ImportError, SystemError):
+    from coqcheck import RE_REQUIRE
+
+# The names a session knows of, for completion: those its statements defined,
+# and those of the libraries it required, listed by `SearchPattern _ inside`.
+# Names are added in layers, one for each sentence proven, and a layer goes
+# when its sentence is undone; so the index follows the proof without asking
+# coqtop anything once a library has been listed. Names are found by their
+# last component, since that is what is typed after a qualifier.
+
+RE_SEARCH_RESULT = re.compile(r"^([a-zA-Z_][\w'.]*)\s*:", re.M)
+
+class Trie:
+    # Each node is [children by character, {value: count}, the first LIMIT
+    # (key, value) under it in order]. Those lists are kept up to date as
+    # entries come and go, so that finding what starts with a prefix only
+    # walks down the prefix; one that lost an entry while full is listed again
+    # when next needed.
+
+    LIMIT = 100
+
+    def __init__(self):
+        self.root = [{}, {}, []]
+
+    def _path(self, key, create):
+        path, node = [self.root], self.root
+        for char in key:
+            child = node[0].get(char)
+            if child is None:
+                if not create:
+                    return None
+                child = node[0][char] = [{}, {}, []]
+            node = child
+            path.append(node)
+        return path
+
+    def add(self, key, value):
+        path = self._path(key, True)
+        count = path[-1][1].get(value, 0)
+        path[-1][1][value] = count + 1
+        if count:
+            return
+        entry = (key, value)
+        for node in path:
+            first = node[2]
+            if first is None:
+                continue
+            if len(first) < self.LIMIT:
+                insort(first, entry)
+            elif entry < first[-1]:
+                insort(first, entry)
+                first.pop()
+
+    def remove(self, key, value):
+        path = self._path(key, False)
+        if path is None or value not in path[-1][1]:
+            return
+        count = path[-1][1][value] - 1
+        if count > 0:
+            path[-1][1][value] = count
+            return
+        del path[-1][1][value]
+        entry = (key, value)
+        for node in path:
+            first = node[2]
+            if first is None:
+                continue
+            i = bisect_left(first, entry)
+            if i < len(first) and first[i] == entry:
+                if len(first) == self.LIMIT:
+                    node[2] = None
+                else:
+                    del first[i]
+        for i in range(len(key), 0, -1):
+            if path[i][0] or path[i][1]:
+                break
+            del path[i - 1][0][key[i - 1]]
+
+    def find(self, prefix, limit):
+        # Up to `limit` (key, value) under `prefix`, in order of their keys;
+        # Sublime Text ranks completions itself.
+        path = self._path(prefix, False)
+        if path is None:
+            return []
+        node = path[-1]
+        if node[2] is None:
+            node[2] = self._first(prefix, node)
+        return node[2][:limit]
+
+    def _first(self, prefix, node):
+        found, stack = [], [(prefix, node)]
+        while stack and len(found) < self.LIMIT:
+            key, (children, values, _first) = stack.pop()
+            found.extend((key, value) for value in sorted(values))
+            stack.extend((key + char, children[char]) for char in sorted(children, reverse=True))
+        return found[:self.LIMIT]
+
+class SymbolIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.trie = Trie()
+        self.layers = {}
+        # Names listed for each `Require`, kept after it is undone in case it
+        # is run again.
+        self.libraries = {}
+
+    def add(self, position, names, source):
+        with self.lock:
+            layer = self.layers.setdefault(position, [])
+            for name in names:
+                key = name.rsplit('.', 1)[-1]
+                self.trie.add(key, (name, source))
+                layer.append((key, (name, source)))
+
+    def remove(self, position):
+        with self.lock:
+            for key, value in self.layers.pop(position, []):
+                self.trie.remove(key, value)
+
+    def complete(self, prefix, limit=100):
+        with self.lock:
+            return self.trie.find(prefix, limit)
+
+def required_modules(statement):
+    # The modules a `Require` loads, qualified as written.
+    match = RE_REQUIRE.match(statement.strip())
+    if match is None:
+        return []
+    names = [name.strip('()') for name in match.group(2).split()]
+    if match.group(1):
+        names = [match.group(1) + '.' + name for name in names]
+    return names
+
+def search_results(output):
+    # The names in the reply to a `Search`.
+    return [name for name in RE_SEARCH_RESULT.findall(output)
+            if name not in ['Error', 'Warning', 'Toplevel']]
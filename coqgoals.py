@@ -0,0 +1,75 @@
+import re, difflib
+from collections import namedtuple
+
+# Replies that show goals are split into their parts, so that the output view
+# can be updated line by line from one tactic to the next: the header and any
+# messages before it, the hypotheses of the first goal, and everything from
+# its separator on. Two replies have the same shape when they have the same
+# header and hypothesis names; only then is the view patched rather than
+# replaced.
+
+Hypothesis = namedtuple('Hypothesis', 'names line text')
+
+RE_HEADER = re.compile(r'^\d+ (?:focused )?(?:sub)?goals?\b')
+RE_HYPOTHESIS = re.compile(r"^  ([a-zA-Z_][\w']*(?:, [a-zA-Z_][\w']*)*) :=? ")
+RE_SEPARATOR = re.compile(r'^  =+$')
+
+class Goals:
+    def __init__(self, lines, header, hypotheses):
+        self.lines = lines
+        self.header = header
+        self.hypotheses = hypotheses
+
+    def shape(self):
+        return self.header, [hypothesis.names for hypothesis in self.hypotheses]
+
+    def offsets(self):
+        offsets, offset = [], 0
+        for line in self.lines:
+            offsets.append(offset)
+            offset += len(line)
+        offsets.append(offset)
+        return offsets
+
+def parse_goals(output):
+    # None if the reply doesn't show goals.
+    lines = output.splitlines(True)
+    header = None
+    for i, line in enumerate(lines):
+        if RE_SEPARATOR.match(line.rstrip('\n')):
+            separator = i
+            break
+        if header is None and RE_HEADER.match(line):
+            header = i
+    else:
+        return None
+    if header is None:
+        return None
+
+    hypotheses = []
+    for i in range(header + 1, separator):
+        match = RE_HYPOTHESIS.match(lines[i])
+        if match:
+            hypotheses.append(Hypothesis(match.group(1), i, lines[i]))
+        elif hypotheses:
+            # Long hypotheses continue on more deeply indented lines.
+            last = hypotheses[-1]
+            hypotheses[-1] = last._replace(text=last.text + lines[i])
+    return Goals(lines, ''.join(lines[:header + 1]), hypotheses)
+
+def changed_hypotheses(old, new):
+    # The hypotheses of `new` that `old` doesn't have, or had otherwise.
+    before = dict((hypothesis.names, hypothesis.text) for hypothesis in old.hypotheses)
+    return [hypothesis for hypothesis in new.hypotheses
+            if before.get(hypothesis.names) != hypothesis.text]
+
+def line_edits(old, new):
+    # (begin, end, text) replacements that turn the text of `old` into that of
+    # `new`, last first so that they can be applied in order.
+    offsets = old.offsets()
+    matcher = difflib.SequenceMatcher(None, old.lines, new.lines, autojunk=False)
+    edits = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != 'equal':
+            edits.append((offsets[i1], offsets[i2], ''.join(new.lines[j1:j2])))
+    return edits[::-1]
@@ -0,0 +1,394 @@
+import os, re, queue, signal, subprocess, threading
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+try:
+    from .coqlexer import lex
+    from .coqtop import Idle, Replies, io_loop, truncate
+except (ImportError, SystemError):
+    from coqlexer import lex
+    from coqtop import Idle, Replies, io_loop, truncate
+
+# A backend for `coqidetop`, which speaks the XML protocol CoqIDE uses, with the
+# same interface as Coqtop: `send` takes sentences and the manager gets one
+# `receive(output, prompt)` per sentence, with an emacs-style prompt carrying the
+# state id and the open proofs.
+#
+# Sentences are only Added to coqidetop's document as they come in. The document
+# is Observed once nothing else is waiting to be sent, so a pipelined run lets
+# coqidetop delegate the bodies of finished proofs to its `-async-proofs`
+# workers. Errors found by a worker arrive after the proof has been reported as
+# proven; they are passed to `manager.proof_failed`.
+
+QUERIES = ['About', 'Check', 'Compute', 'Eval', 'Locate', 'Print', 'Search',
+           'SearchAbout', 'SearchHead', 'SearchPattern', 'SearchRewrite', 'Show']
+
+# Whether a proof is open after a sentence is only known from `Status`, which
+# tells it for the tip once the document is observed. The replies to the other
+# sentences of a batch carry a guess from the sentence itself, which misses
+# proofs opened otherwise: by an `Instance` or `Program` with obligations left,
+# or by a statement whose type has a `:=` in it.
+RE_OPENS_PROOF  = re.compile(r'''
+    (?:(?:Local|Global|Polymorphic|Program)\s+)*
+    (?:Theorem|Lemma|Remark|Fact|Corollary|Proposition|Example|Definition|Fixpoint|
+       CoFixpoint|Instance|Goal)\b(?:\s+([^\s:(]+))?''', re.X)
+RE_CLOSES_PROOF = re.compile(r'(?:Qed|Defined|Admitted|Save|Abort)\b')
+
+def _string(text):
+    return '<string>{}</string>'.format(escape(text))
+
+def _state_id(state):
+    return '<state_id val="{:d}"/>'.format(state)
+
+def _pair(first, second):
+    return '<pair>{}{}</pair>'.format(first, second)
+
+def _call(name, argument):
+    return '<call val="{}">{}</call>'.format(name, argument)
+
+def _text(element):
+    return ''.join(element.itertext()) if element is not None else ''
+
+def format_goals(goals):
+    # Renders the reply to `Goals` the way `coqtop -emacs` prints goals.
+    if goals is None or goals.find('option') is None or goals.find('option').get('val') != 'some':
+        return ''
+    focused = goals.find('option/goals/list')
+    focused = list(focused) if focused is not None else []
+    if not focused:
+        return 'No more subgoals.'
+
+    lines = ['{} subgoal{}'.format(len(focused), '' if len(focused) == 1 else 's'), '  ']
+    _ident, hyps, conclusion = list(focused[0])
+    for hyp in hyps:
+        lines.append('  ' + _text(hyp))
+    lines.append('  ============================')
+    lines.append('   ' + _text(conclusion))
+    for number, goal in enumerate(focused[1:], 2):
+        lines.extend(['', 'subgoal {} is:'.format(number), ' ' + _text(list(goal)[2])])
+    return '\n'.join(lines)
+
+class _Closed(Exception):
+    pass
+
+class _Stream:
+    # coqidetop writes a stream of XML elements with no common root; this parser
+    # target hands each top-level element over once it is complete.
+
+    def __init__(self, on_element):
+        self.on_element = on_element
+        self.builder = None
+        self.depth = 0
+
+    def start(self, tag, attrs):
+        self.depth += 1
+        if self.depth == 2:
+            self.builder = ET.TreeBuilder()
+        if self.depth >= 2:
+            self.builder.start(tag, attrs)
+
+    def end(self, tag):
+        if self.depth >= 2:
+            self.builder.end(tag)
+        if self.depth == 2:
+            self.on_element(self.builder.close())
+        self.depth -= 1
+
+    def data(self, data):
+        if self.depth >= 2:
+            self.builder.data(data)
+
+    def close(self):
+        pass
+
+class CoqideTop:
+    # Bytes of a reply kept in memory; see coqtop.Overflow.
+    output_limit = None
+
+    def __init__(self, manager, path, args=[], debug=True):
+        self.debug = debug
+
+        if self.debug:
+            print('coq: running ' + path)
+
+        self.manager = manager
+        self.manager_lock = threading.Lock()
+        self.parse_time = 0.0
+        self.proc = subprocess.Popen([path, "-main-channel", "stdfds"] + args,
+            stdout=subprocess.PIPE,
+            stdin =subprocess.PIPE,
+            bufsize=0)
+
+        self.sends = queue.Queue()
+        self.values = queue.Queue()
+        self.lock = threading.Lock()
+        self.messages = {}
+        self.route_messages = []
+        self.pending = []
+        self.tip = None
+        self.proofs = []
+        self.replies = Replies()
+        self.welcome = self.replies.expect()
+
+        self.parser = ET.XMLParser(target=_Stream(self._element))
+        self.parser.entity['nbsp'] = '\xa0'
+        self.parser.feed('<coqidetop>')
+        io_loop.add(self.proc.stdout, self.receive)
+
+        self.work_thread = threading.Thread(target=self.work)
+        self.work_thread.daemon = True
+        self.work_thread.start()
+
+    def kill(self):
+        if self.debug:
+            print('coq: killing')
+
+        self.sends.put(None)
+        self.proc.kill()
+
+    def interrupt(self):
+        # Coq stops what it is doing on SIGINT, which Windows has no way to send.
+        if os.name == 'nt':
+            return False
+        if self.debug:
+            print('coq: interrupting')
+        self.proc.send_signal(signal.SIGINT)
+        return True
+
+    def send(self, statement, receive=True):
+        # Returns a Future for the reply, which the manager is given as well
+        # unless `receive` is False.
+        if self.debug:
+            print('->coq ' + statement)
+        future = self.replies.expect(statement, receive)
+        self.sends.put(statement)
+        return future
+
+    def attach(self, manager):
+        with self.manager_lock:
+            idle, self.manager = self.manager, manager
+            if isinstance(idle, Idle):
+                for reply in idle.replies:
+                    manager.receive(*reply)
+
+    # Reading
+
+    def receive(self, chunk):
+        if len(chunk) == 0:
+            self.values.put(None)
+            return
+        self.parser.feed(chunk)
+
+    def _element(self, element):
+        if self.debug:
+            print('coq-> ' + ET.tostring(element, encoding='unicode'))
+
+        if element.tag == 'value':
+            self.values.put(element)
+        elif element.tag == 'feedback':
+            state = element.find('state_id')
+            content = element.find('feedback_content')
+            if content is None or content.get('val') != 'message':
+                return
+            level = content.find('message/message_level').get('val')
+            text = _text(list(content.find('message'))[-1])
+            if state is None or element.get('route', '0') != '0':
+                self._route_message(level, text)
+            else:
+                self._message(int(state.get('val')), level, text)
+        elif element.tag == 'message':
+            level = element.find('message_level').get('val')
+            self._route_message(level, _text(list(element)[-1]))
+
+    def _route_message(self, level, text):
+        # Kept for the worker thread, which takes them with the reply to the
+        # call they were printed by.
+        with self.lock:
+            self.route_messages.append((level, text))
+
+    def _message(self, state, level, text):
+        with self.lock:
+            if any(pending == state for pending, _sentence, _proofs in self.pending):
+                self.messages.setdefault(state, []).append((level, text))
+                return
+        if level == 'error':
+            self.sends.put((state, 'Error: ' + text))
+
+    # Talking to coqidetop; calls are answered strictly in order.
+
+    def _call(self, name, argument):
+        if self.debug:
+            print('->coq ' + name)
+        # Feedback comes before the value it goes with; what is left over from
+        # calls that didn't take theirs is not this call's.
+        self._route_output()
+        self.proc.stdin.write(_call(name, argument).encode('utf-8'))
+        self.proc.stdin.flush()
+
+        value = self.values.get()
+        if value is None:
+            raise _Closed()
+        return value
+
+    def _error(self, value):
+        message = value.find('richpp')
+        if message is None:
+            message = value.find('string')
+        return 'Error: ' + _text(message).strip()
+
+    def _prompt(self, state, proofs):
+        return '<prompt>{} < {} |{}| {} < </prompt>'.format(
+            proofs[-1] if proofs else 'Coq', state, '|'.join(proofs), len(proofs))
+
+    def _reply(self, output, state=None, proofs=None):
+        if state is None:
+            state, proofs = self.tip, self.proofs
+        output, _overflow = truncate(output, self.output_limit)
+        prompt = self._prompt(state, proofs)
+        if self.replies.resolve(output, prompt):
+            with self.manager_lock:
+                self.manager.receive(output, prompt, self.parse_time)
+
+    def _route_output(self):
+        with self.lock:
+            messages, self.route_messages = self.route_messages, []
+        return '\n'.join(text for _level, text in messages)
+
+    # Processing sentences
+
+    def work(self):
+        try:
+            value = self._call('Init', '<option val="none"/>')
+            self.tip = int(value.find('state_id').get('val'))
+            self._reply('Welcome to Coq ({})'.format('coqidetop'))
+
+            while True:
+                item = self.sends.get()
+                if item is None:
+                    return
+                if isinstance(item, tuple):
+                    self._flush()
+                    with self.manager_lock:
+                        self.manager.proof_failed(*item)
+                    continue
+                for _kind, begin, end in lex(item + '\n'):
+                    self._sentence(item[begin:end])
+                if self.sends.empty():
+                    self._flush()
+        except (_Closed, IOError):
+            return
+        finally:
+            self.replies.close(EOFError('coqidetop exited'))
+
+    def _sentence(self, sentence):
+        keyword = re.match(r'\s*(\S*)', sentence).group(1).rstrip('.')
+        match = re.match(r'BackTo\s+(\d+)\s*\.$', sentence)
+        if match:
+            self._flush()
+            self._edit_at(int(match.group(1)))
+            self._reply('')
+            return
+
+        match = re.match(r'Set\s+Printing\s+Width\s+(\d+)\s*\.$', sentence)
+        if match:
+            self._flush()
+            self._call('SetOptions',
+                '<list><pair><list><string>Printing</string><string>Width</string></list>'
+                '<option_value val="intvalue"><option val="some"><int>{}</int></option>'
+                '</option_value></pair></list>'.format(match.group(1)))
+            self._reply('')
+            return
+
+        if re.match(r'\s*Show\s*\.$', sentence):
+            self._flush()
+            self._reply(self._goals())
+        elif keyword in QUERIES:
+            self._flush()
+            self._reply(self._query(sentence))
+        else:
+            self._add(sentence)
+
+    def _add(self, sentence):
+        value = self._call('Add', _pair(_pair(_string(sentence), '<int>-1</int>'),
+                                        _pair(_state_id(self.tip), '<bool val="false"/>')))
+        if value.get('val') != 'good':
+            self._flush()
+            self._reply(self._error(value))
+            return
+
+        proofs = list(self.proofs)
+        opens, closes = RE_OPENS_PROOF.match(sentence), RE_CLOSES_PROOF.match(sentence)
+        if closes and proofs:
+            proofs.pop()
+        elif opens and ':=' not in sentence:
+            proofs.append(opens.group(1) or 'Unnamed_thm')
+
+        with self.lock:
+            self.tip = int(value.find('pair/state_id').get('val'))
+            self.proofs = proofs
+            self.pending.append((self.tip, sentence, proofs))
+
+    def _flush(self):
+        with self.lock:
+            pending = self.pending
+        if not pending:
+            return
+
+        # Feedback goes on arriving on the reading thread.
+        value = self._call('Observe', _state_id(self.tip))
+        with self.lock:
+            self.pending = []
+            messages, self.messages = self.messages, {}
+
+        failed, error = None, None
+        for state, _sentence, _proofs in pending:
+            for level, text in messages.get(state, []):
+                if level == 'error' and failed is None:
+                    failed, error = state, 'Error: ' + text
+        if value.get('val') != 'good':
+            safe = int(value.find('state_id').get('val'))
+            if failed is None:
+                failed = min(state for state, _sentence, _proofs in pending if state > safe)
+                error = self._error(value)
+            self._edit_at(safe)
+        else:
+            self._status()
+
+        for index, (state, _sentence, proofs) in enumerate(pending):
+            if failed is not None and state >= failed:
+                self._reply(error if state == failed else
+                            'Error: Not run because of an earlier error.')
+                continue
+            output = '\n'.join(text for _level, text in messages.get(state, []))
+            if index == len(pending) - 1:
+                proofs = self.proofs
+                output = '\n'.join(filter(None, [output, self._goals()]))
+            self._reply(output, state, proofs)
+
+    def _edit_at(self, state):
+        # A focus reply (`in_r`) reopens a proof and keeps what follows it, but
+        # the manager has dropped everything after `state`. Going to the same
+        # state again from inside the focus backtracks the whole document.
+        value = self._call('EditAt', _state_id(state))
+        if value.find('union') is not None and value.find('union').get('val') == 'in_r':
+            value = self._call('EditAt', _state_id(state))
+        if value.get('val') == 'good':
+            self.tip = state
+            self._status()
+
+    def _status(self):
+        value = self._call('Status', '<bool val="false"/>')
+        status = value.find('status')
+        if status is not None:
+            self.proofs = [_text(name) for name in status.findall('list')[1]]
+
+    def _goals(self):
+        return format_goals(self._call('Goals', '<unit/>'))
+
+    def _query(self, sentence):
+        value = self._call('Query', _pair('<route_id val="1"/>',
+                                          _pair(_string(sentence), _state_id(self.tip))))
+        if value.get('val') != 'good':
+            return self._error(value)
+        # Older versions return the output instead of sending it as feedback.
+        return '\n'.join(filter(None, [self._route_output(), _text(value.find('string'))]))
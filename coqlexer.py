@@ -0,0 +1,185 @@
+import re
+from bisect import bisect_left, bisect_right
+
+# Splits Coq source into sentences. Coq ends a sentence with a period that is
+# followed by whitespace (so not `Nat.add` or the `..` of recursive notations),
+# except inside comments, which nest, and strings, which may appear in comments.
+# Bullets and focusing braces are sentences on their own. A period at the very
+# end of the text ends nothing yet, as it may be the start of `Nat.add` being
+# typed; text known to be whole is lexed with a newline after it.
+
+RE_SPACE   = re.compile(r'\s*')
+RE_BULLET  = re.compile(r'([-+*])\1*|[{}]')
+RE_BODY    = re.compile(r'\(\*|"|\.(?=\s)')
+RE_COMMENT = re.compile(r'\(\*|\*\)|"')
+RE_STRING  = re.compile(r'(?:[^"]|"")*"')
+
+def skip_comment(text, position):
+    # `position` is just past the opening `(*`; returns the end of the comment.
+    depth = 1
+    while depth > 0:
+        match = RE_COMMENT.search(text, position)
+        if match is None:
+            return None
+        token = match.group(0)
+        if token == '"':
+            position = skip_string(text, match.end())
+            if position is None:
+                return None
+            continue
+        depth += 1 if token == '(*' else -1
+        position = match.end()
+    return position
+
+def skip_string(text, position):
+    # `position` is just past the opening quote; returns the end of the string.
+    match = RE_STRING.match(text, position)
+    if match is None:
+        return None
+    return match.end()
+
+def lex_one(text, position):
+    # Returns (kind, begin, end) of the sentence or comment after `position`,
+    # or None if the text ends before it is complete.
+    begin = RE_SPACE.match(text, position).end()
+    if begin == len(text):
+        return None
+
+    if text.startswith('(*', begin):
+        end = skip_comment(text, begin + 2)
+        if end is None:
+            return None
+        return 'comment', begin, end
+
+    match = RE_BULLET.match(text, begin)
+    if match:
+        return 'statement', begin, match.end()
+
+    position = begin
+    while True:
+        match = RE_BODY.search(text, position)
+        if match is None:
+            return None
+        token = match.group(0)
+        if token == '(*':
+            position = skip_comment(text, match.end())
+        elif token == '"':
+            position = skip_string(text, match.end())
+        elif match.start() > begin and text[match.start() - 1] == '.':
+            position = match.end()
+        else:
+            return 'statement', begin, match.end()
+        if position is None:
+            return None
+
+def lex(text, position=0):
+    while True:
+        sentence = lex_one(text, position)
+        if sentence is None:
+            return
+        yield sentence
+        _kind, _begin, position = sentence
+
+def first_difference(old, new, chunk=65536):
+    size = min(len(old), len(new))
+    start = 0
+    while start + chunk <= size and old[start:start + chunk] == new[start:start + chunk]:
+        start += chunk
+    end = min(start + chunk, size)
+    while start < end:
+        middle = (start + end) // 2
+        if old[start:middle + 1] == new[start:middle + 1]:
+            start = middle + 1
+        else:
+            end = middle
+    return start
+
+class SentenceIndex:
+    # Sorted sentence boundaries for one buffer. The text is lexed lazily, only
+    # as far as lookups need, and an edit only drops the sentences from the one
+    # it touches onwards, so lookups are a bisection and rescans stay local.
+
+    def __init__(self, text=''):
+        self.text = text
+        self.kinds = []
+        self.begins = []
+        self.ends = []
+        self.lexed = 0
+
+    def update(self, text):
+        if text != self.text:
+            self.invalidate(first_difference(self.text, text))
+            self.text = text
+
+    def edit(self, edits):
+        # Applies (begin, end, text) replacements as reported by the editor,
+        # each in the text the ones before it left, so that nothing has to be
+        # re-read or compared. The pieces of the new text are worked out
+        # first, and the text is rebuilt from them once.
+        pieces, first = [(self.text, 0, len(self.text))], len(self.text)
+        for begin, end, text in edits:
+            before, after, position = [], [], 0
+            for source, start, stop in pieces:
+                following = position + stop - start
+                if begin > position:
+                    before.append((source, start, start + min(begin, following) - position))
+                if end < following:
+                    after.append((source, start + max(end - position, 0), stop))
+                position = following
+            pieces = before + [(text, 0, len(text))] + after
+            first = min(first, begin)
+        self.text = ''.join(source[start:stop] for source, start, stop in pieces)
+        self.invalidate(first)
+
+    def invalidate(self, point):
+        # A sentence ending right at the edit may not end there anymore, e.g.
+        # when something is typed just after its period.
+        count = bisect_left(self.ends, point)
+        del self.kinds[count:]
+        del self.begins[count:]
+        del self.ends[count:]
+        self.lexed = self.ends[-1] if self.ends else 0
+
+    def _lex_until(self, point):
+        while not self.begins or self.begins[-1] < point:
+            sentence = lex_one(self.text, self.lexed)
+            if sentence is None:
+                return False
+            kind, begin, end = sentence
+            self.kinds.append(kind)
+            self.begins.append(begin)
+            self.ends.append(end)
+            self.lexed = end
+        return True
+
+    def _at(self, index):
+        return self.kinds[index], self.begins[index], self.ends[index]
+
+    def next(self, position):
+        # The first sentence that begins at or after `position`.
+        index = bisect_left(self.begins, position)
+        if index == len(self.begins):
+            if not self._lex_until(position):
+                return None
+            index = bisect_left(self.begins, position)
+        return self._at(index)
+
+    def before(self, point):
+        # The last sentence that ends at or before `point`.
+        self._lex_until(point)
+        index = bisect_right(self.ends, point)
+        if index == 0:
+            return None
+        return self._at(index - 1)
+
+    def until(self, position, point):
+        # Consecutive sentences starting from `position`, as long as the previous
+        # one ended before `point`.
+        sentences = []
+        while position < point:
+            sentence = self.next(position)
+            if sentence is None:
+                break
+            sentences.append(sentence)
+            _kind, _begin, position = sentence
+        return sentences
@@ -0,0 +1,238 @@
+import re, time, queue, threading
+from collections import namedtuple
+
+try:
+    from .coqtop import parse_prompt, RE_ERROR
+except (ImportError, SystemError):
+    from coqtop import parse_prompt, RE_ERROR
+
+# A second coqtop that, while the editor's waits for the user, runs the
+# statements after the proven part of the buffer. It first catches up with the
+# statements the editor has proven, then runs up to a given number past them,
+# stopping at the first that fails.
+#
+# When the editor steps over statements that were run ahead, the two processes
+# trade places: this one goes back to the last of them with `BackTo` and becomes
+# the editor's, and the editor's stays here, where it only has to catch up. The
+# worker thread does the handing over, once it is done with what it was running.
+
+Speculation = namedtuple('Speculation', 'begin end text output prompt state latency')
+
+class Promoted(Exception):
+    pass
+
+class Lookahead:
+    def __init__(self, backend, path, args, debug=False, output_limit=None):
+        self.debug = debug
+        self.cond = threading.Condition()
+        self.jobs = queue.Queue()
+        self.replies = queue.Queue()
+        self.paused = False
+        self.waiting = False
+        self.promotion = None
+        self.stopped = False
+
+        self.base_state = None
+        self.history = []
+        self.ahead = []
+        self.coqtop = backend(self, path, args, debug)
+        self.coqtop.output_limit = output_limit
+
+        self.thread = threading.Thread(target=self.work)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def receive(self, output, prompt, parse_time=0.0):
+        # An interrupt that came too late to stop anything is answered anyway.
+        if self.waiting or 'User interrupt' not in output:
+            self.replies.put((output, prompt))
+
+    def proof_failed(self, state, output):
+        pass
+
+    def follow(self, sentences, upcoming):
+        # `sentences` are the texts of the statements the editor has proven, and
+        # `upcoming` the (begin, end, text) of those after them to run ahead.
+        self.jobs.put((list(sentences), list(upcoming)))
+
+    def kill(self):
+        self.jobs.put(None)
+        with self.cond:
+            self.paused = False
+            self.cond.notify_all()
+        self.coqtop.kill()
+
+    def matching(self, sentences, statements):
+        # How many of `statements` were run ahead, right after `sentences`.
+        with self.cond:
+            return self._matching(sentences, statements)
+
+    def promote(self, sentences, statements, then):
+        # Hands over the process, back at the state after the last of
+        # `statements` it ran ahead: `then` is called on the worker thread with
+        # it, its base state, the states after each of `sentences` and the
+        # speculations; or with None if there are none by then. Returns False,
+        # and never calls `then`, if what runs now can't be interrupted.
+        with self.cond:
+            if self.stopped or self.waiting and not self.coqtop.interrupt():
+                return False
+            self.promotion = (sentences, statements, then)
+        self.jobs.put(())
+        return True
+
+    def adopt(self, coqtop, base_state, history):
+        # Takes over the editor's process, in exchange for the one promoted.
+        with self.cond:
+            while not self.replies.empty():
+                self.replies.get()
+            self.coqtop = coqtop
+            self.base_state = base_state
+            self.history = list(history)
+            self.ahead = []
+            coqtop.attach(self)
+            self.paused = False
+            self.cond.notify_all()
+
+    def _matching(self, sentences, statements):
+        if [text for text, _state in self.history] != sentences:
+            return 0
+        count = 0
+        for speculation, statement in zip(self.ahead, statements):
+            if (speculation.begin, speculation.end, speculation.text) != tuple(statement):
+                break
+            count += 1
+        return count
+
+    def _reply(self):
+        while True:
+            try:
+                return self.replies.get(timeout=0.5)
+            except queue.Empty:
+                pass
+            if self.coqtop.proc.poll() is not None and self.replies.empty():
+                raise EOFError()
+
+    def _call(self, statement):
+        self.waiting = True
+        try:
+            self.coqtop.send(statement)
+            return self._reply()
+        finally:
+            self.waiting = False
+
+    def _step(self, statement):
+        with self.cond:
+            if self.promotion is not None:
+                raise Promoted()
+            self.waiting = True
+        try:
+            self.coqtop.send(statement)
+            return self._reply()
+        finally:
+            with self.cond:
+                self.waiting = False
+                self.cond.notify_all()
+
+    def work(self):
+        try:
+            _output, prompt = self._reply()
+            with self.cond:
+                self.base_state = parse_prompt(prompt)[0]
+            while True:
+                job = self.jobs.get()
+                while job is not None and not self.jobs.empty():
+                    job = self.jobs.get()
+                if job is None:
+                    return
+                try:
+                    # An empty job only wakes the thread for a promotion.
+                    if job and self._sync(job[0]):
+                        self._run_ahead(job[1])
+                except Promoted:
+                    pass
+                self._promote()
+        except EOFError:
+            if self.debug:
+                print('coq: lookahead coqtop exited')
+        finally:
+            with self.cond:
+                self.stopped = True
+                promotion, self.promotion = self.promotion, None
+            if promotion is not None:
+                promotion[2](None)
+
+    def _promote(self):
+        with self.cond:
+            if self.promotion is None:
+                return
+            (sentences, statements, then), self.promotion = self.promotion, None
+            count = self._matching(sentences, statements)
+            speculations = self.ahead[:count]
+            states = [state for _text, state in self.history] + [s.state for s in speculations]
+            if count == 0:
+                taken = None
+            else:
+                taken = (self.coqtop, self.base_state, states, speculations)
+                back = self.ahead[-1].state != speculations[-1].state
+                self.paused = True
+        if taken is None:
+            then(None)
+            return
+        if back:
+            self._call('BackTo {:d}.'.format(speculations[-1].state))
+        then(taken)
+        # Nothing is sent to the process handed over; this waits for `adopt`.
+        with self.cond:
+            while self.paused:
+                self.cond.wait()
+
+    def _state(self):
+        if self.ahead:
+            return self.ahead[-1].state
+        return self.history[-1][1] if self.history else self.base_state
+
+    def _sync(self, sentences):
+        with self.cond:
+            common = 0
+            while (common < len(self.history) and common < len(sentences) and
+                    self.history[common][0] == sentences[common]):
+                common += 1
+            history = self.history[:common]
+            # What the editor went on to prove without taking it from here.
+            if common == len(self.history):
+                for speculation in self.ahead:
+                    if (len(history) == len(sentences) or
+                            sentences[len(history)].strip() != speculation.text):
+                        break
+                    history.append((sentences[len(history)], speculation.state))
+            state, current = history[-1][1] if history else self.base_state, self._state()
+
+        if state != current:
+            self._step('BackTo {:d}.'.format(state))
+        with self.cond:
+            self.history, self.ahead = history, []
+
+        for sentence in sentences[len(history):]:
+            if not self.jobs.empty():
+                return False
+            output, prompt = self._step(sentence)
+            if re.search(RE_ERROR, output, re.M):
+                return False
+            with self.cond:
+                self.history.append((sentence, parse_prompt(prompt)[0]))
+        return True
+
+    def _run_ahead(self, upcoming):
+        for begin, end, text in upcoming:
+            if not self.jobs.empty():
+                return
+            started = time.time()
+            output, prompt = self._step(text)
+            if re.search(RE_ERROR, output, re.M):
+                # Coqtop stays where it was, and nothing after this can work.
+                return
+            with self.cond:
+                self.ahead.append(Speculation(begin, end, text, output, prompt,
+                                              parse_prompt(prompt)[0], time.time() - started))
+            if self.debug:
+                print('coq: ran ahead to {:d}'.format(end))
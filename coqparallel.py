@@ -0,0 +1,194 @@
+import re, time, threading
+from collections import namedtuple
+
+try:
+    from .coqtop import parse_prompt, RE_ERROR
+    from .coqcheck import Session
+except (ImportError, SystemError):
+    from coqtop import parse_prompt, RE_ERROR
+    from coqcheck import Session
+
+# Most of the time taken to check a file goes on the bodies of proofs that end
+# with `Qed`, which nothing after them can see into. So the file can be run
+# with each of those proofs admitted right after its statement, the skeleton,
+# while worker coqtops check the bodies apart: each takes the next proof no
+# other has taken, runs the skeleton up to its statement, then the body. A
+# proof finished with `Qed` serves what follows as well as an admitted one, so
+# a worker goes on from there; one that failed is admitted in its place.
+
+RE_OPENS  = re.compile(r'\s*(?:(?:Local|Global|Polymorphic|Monomorphic)\s+)*'
+                       r'(?:Theorem|Lemma|Remark|Fact|Corollary|Proposition|Property|'
+                       r'Example|Goal)\b')
+RE_CLOSES = re.compile(r'\s*(Qed|Defined|Admitted|Save|Abort)\b')
+# Sentences that can't be part of a proof's body, so that no proof is taken to
+# run across them.
+RE_VERNACULAR = re.compile(r'\s*(?:(?:Local|Global|Polymorphic|Monomorphic)\s+)*'
+                           r'(?:Definition|Fixpoint|CoFixpoint|Instance|Program|Inductive|'
+                           r'CoInductive|Record|Structure|Class|Module|Section|End|Require|'
+                           r'Import|Export)\b')
+
+# `statement` is the index in the skeleton of the proof's statement; `body`
+# the sentences after it, up to and including `Qed`.
+Job = namedtuple('Job', 'statement body')
+
+def plan(sentences):
+    # (statement, end) indices of the proofs among `sentences` that end with
+    # `Qed`, and have no other proof or top-level sentence within them. A
+    # statement given with `:=` is complete, and opens no proof.
+    proofs, i = [], 0
+    while i < len(sentences):
+        if not RE_OPENS.match(sentences[i]) or ':=' in sentences[i]:
+            i += 1
+            continue
+        end = i + 1
+        while (end < len(sentences) and not RE_OPENS.match(sentences[end]) and
+                not RE_VERNACULAR.match(sentences[end]) and
+                not RE_CLOSES.match(sentences[end])):
+            end += 1
+        if end == len(sentences) or not RE_CLOSES.match(sentences[end]):
+            i = end
+            continue
+        if RE_CLOSES.match(sentences[end]).group(1) == 'Qed':
+            proofs.append((i, end))
+        i = end + 1
+    return proofs
+
+def skeleton(sentences, proofs, first=0):
+    # `sentences` with every proof of `proofs` admitted, and a Job for those
+    # that start from `first` on.
+    script, jobs, last = [], [], 0
+    for begin, end in proofs:
+        script.extend(sentences[last:begin + 1])
+        if begin >= first:
+            jobs.append(Job(len(script) - 1, sentences[begin + 1:end + 1]))
+        script.append('Admitted.')
+        last = end + 1
+    script.extend(sentences[last:])
+    return script, jobs
+
+class ParallelCheck:
+    def __init__(self, backend, path, args, script, jobs, workers, on_result, debug=False,
+                 output_limit=None):
+        # `on_result(job, failure, seconds)` is called on a worker's thread once
+        # a job is checked, with None or (index in its body, error) for
+        # `failure`, unless the job was dropped.
+        self.backend = backend
+        self.path = path
+        self.args = args
+        self.script = script
+        self.jobs = jobs
+        self.on_result = on_result
+        self.debug = debug
+        self.output_limit = output_limit
+
+        self.lock = threading.Lock()
+        self.next = 0
+        self.limit = len(jobs)
+        self.running = {}
+        self.sessions = []
+        self.killed = False
+        self.workers = max(min(workers, len(jobs)), 1)
+        self.left = self.workers
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+
+    def drop_from(self, job):
+        # Jobs from `job` on are no longer wanted. Workers checking one of them
+        # are stopped, since every job before it was taken already.
+        with self.lock:
+            self.limit = min(self.limit, job)
+            sessions = [session for session, index in self.running.items() if index >= job]
+        for session in sessions:
+            session.coqtop.kill()
+
+    def kill(self):
+        with self.lock:
+            self.killed = True
+            self.limit = 0
+            sessions = list(self.sessions)
+        for session in sessions:
+            session.coqtop.kill()
+
+    def _take(self, session):
+        with self.lock:
+            if self.next >= self.limit:
+                return None
+            self.next += 1
+            self.running[session] = self.next - 1
+            return self.next - 1
+
+    def _report(self, job, failure, started):
+        with self.lock:
+            self.running = dict((session, index) for session, index in self.running.items()
+                                if index != job)
+            wanted = job < self.limit
+        if wanted:
+            self.on_result(job, failure, time.time() - started)
+
+    def _run(self, session, sentences):
+        # Sends `sentences` at once. Returns the index and reply of the first
+        # that failed, or None, and the state after the last that didn't.
+        for sentence in sentences:
+            session.coqtop.send(sentence)
+        failure, state = None, None
+        for i in range(len(sentences)):
+            output, prompt = session.reply()
+            if failure is not None:
+                continue
+            if re.search(RE_ERROR, output, re.M):
+                failure = (i, output.strip())
+            else:
+                state = parse_prompt(prompt)[0]
+        return failure, state
+
+    def work(self):
+        session, job, started, error = None, None, None, None
+        try:
+            session = Session(self.path, self.args, backend=self.backend, debug=self.debug,
+                              output_limit=self.output_limit)
+            with self.lock:
+                self.sessions.append(session)
+                if self.killed:
+                    return
+            sent = 0
+            while True:
+                job = self._take(session)
+                if job is None:
+                    return
+                started = time.time()
+                statement, body = self.jobs[job]
+                failure, state = self._run(session, self.script[sent:statement + 1])
+                if failure is not None:
+                    # The editor's coqtop stops at the same sentence; this one
+                    # can't go on from there.
+                    self._report(job, (0, failure[1]), started)
+                    job = None
+                    return
+
+                failure, _state = self._run(session, body)
+                if failure is not None:
+                    self._run(session, ['BackTo {:d}.'.format(state)])
+                    sent = statement + 1
+                else:
+                    sent = statement + 2
+                if self.debug:
+                    print('coq: worker checked proof {} in {:.3f}s ({})'.format(
+                        job, time.time() - started, 'failed' if failure else 'ok'))
+                self._report(job, failure, started)
+                job = None
+        except (EOFError, OSError) as e:
+            error = 'Error: {}.'.format(e)
+            if job is not None:
+                self._report(job, (0, error), started)
+        finally:
+            if session is not None:
+                session.close()
+            with self.lock:
+                self.left -= 1
+                unclaimed = range(self.next, self.limit) if self.left == 0 else []
+                self.next = max(self.next, self.limit)
+            # No worker is left to check these.
+            for job in unclaimed:
+                self.on_result(job, (0, error or 'Error: No worker could check this proof.'), 0)
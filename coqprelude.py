@@ -0,0 +1,81 @@
+import os, re, hashlib
+
+try:
+    from .coqcheck import RE_REQUIRE
+except (ImportError, SystemError):
+    from coqcheck import RE_REQUIRE
+
+# Most files start with the same block of `Require Import`s, which can take
+# seconds to run. A process that has run a file's block ahead of time can be
+# handed out by CoqtopPool in place of a fresh one. The block is identified by
+# its text; the load path is part of the pool's key already, and the mtimes of
+# the `.vo` files it loads, and of coqtop itself, tell whether such a process is
+# out of date.
+
+RE_PRELUDE = re.compile(r'(?:From\s+\S+\s+)?(?:Require|Import|Export)\b')
+
+class Prelude:
+    def __init__(self, sentences, path, args):
+        # `sentences` are (kind, text) pairs, in order.
+        self.statements = [text for kind, text in sentences if kind == 'statement']
+        self.key = hashlib.sha1('\0'.join(self.statements).encode('utf-8')).hexdigest()
+        self.deps = deps_digest(self.statements, path, args)
+
+def find_prelude(index):
+    # The leading sentences of a file that only load libraries, up to the last
+    # of them: (kind, begin, end) from a SentenceIndex.
+    sentences, length, position = [], 0, 0
+    while True:
+        sentence = index.next(position)
+        if sentence is None:
+            break
+        kind, begin, position = sentence
+        if kind == 'statement' and not RE_PRELUDE.match(index.text, begin, position):
+            break
+        sentences.append(sentence)
+        if kind == 'statement':
+            length = len(sentences)
+    return sentences[:length]
+
+def _load_path(args):
+    # (directory, logical prefix) for each -R, -Q and -I argument.
+    roots = []
+    for i, arg in enumerate(args):
+        if arg in ['-R', '-Q'] and i + 2 < len(args):
+            roots.append((args[i + 1], args[i + 2]))
+        elif arg == '-I' and i + 1 < len(args):
+            roots.append((args[i + 1], ''))
+    return roots
+
+def _vo_files(statements, args):
+    # The `.vo` files in the load path that the statements may load. Libraries
+    # found elsewhere, such as the standard library, change with coqtop.
+    roots = _load_path(args)
+    for statement in statements:
+        match = RE_REQUIRE.match(statement.strip())
+        if match is None:
+            continue
+        for name in match.group(2).split():
+            name = name.strip('()')
+            if match.group(1):
+                name = match.group(1) + '.' + name
+            for directory, logical in roots:
+                if logical and name.startswith(logical + '.'):
+                    relative = name[len(logical) + 1:]
+                else:
+                    relative = name
+                path = os.path.join(directory, *relative.split('.')) + '.vo'
+                if os.path.exists(path):
+                    yield path
+
+def deps_digest(statements, path, args):
+    # Changes when coqtop, or a `.vo` file in the load path that the statements
+    # may load, does.
+    digest = hashlib.sha1()
+    for dep in sorted(set(_vo_files(statements, args))) + [path]:
+        try:
+            mtime = os.stat(dep).st_mtime
+        except OSError:
+            mtime = None
+        digest.update('{}\0{}\0'.format(dep, mtime).encode('utf-8'))
+    return digest.hexdigest()
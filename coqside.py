@@ -0,0 +1,113 @@
+import re, queue, threading
+
+try:
+    from .coqtop import parse_prompt, RE_ERROR
+    from .coqcheck import Session
+    from .coqparallel import plan, skeleton
+except (ImportError, SystemError):
+    from coqtop import parse_prompt, RE_ERROR
+    from coqcheck import Session
+    from coqparallel import plan, skeleton
+
+# A second coqtop that answers read-only queries, so that they neither wait for
+# nor hold up the proof. Before each query it is brought up to date with the
+# sentences the editor has proven at top level: whatever it ran that the editor
+# no longer has is undone with `BackTo`, and the rest is sent. Proofs that end
+# with `Qed` are opaque to queries, so only their statements are sent, each
+# followed by `Admitted` as in coqparallel's skeleton; those that end with
+# `Defined` are run whole. Interrupting it, or killing it where that is the
+# only way, leaves the proof alone.
+
+class SideSession:
+    def __init__(self, backend, path, args, debug=False, output_limit=None):
+        self.backend = backend
+        self.path = path
+        self.args = args
+        self.debug = debug
+        self.output_limit = output_limit
+
+        self.session = None
+        self.history = []
+        self.width = None
+        self.jobs = queue.Queue()
+
+        self.thread = threading.Thread(target=self.work)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def query(self, sentences, statement, on_reply, retry_on_empty=None, width=None):
+        # `on_reply` is called with the output, on another thread.
+        self.jobs.put((list(sentences), statement, on_reply, retry_on_empty, width))
+
+    def interrupt(self):
+        session = self.session
+        if session is not None and not session.coqtop.interrupt():
+            session.coqtop.kill()
+
+    def kill(self):
+        self.jobs.put(None)
+        if self.session is not None:
+            self.session.coqtop.kill()
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            sentences, statement, on_reply, retry_on_empty, width = job
+            try:
+                if self.session is None:
+                    self._start()
+                self._sync(sentences)
+                if width is not None and width != self.width:
+                    self._call('Set Printing Width {:d}.'.format(width))
+                    self.width = width
+                output = self._call(statement).strip()
+                if not output and retry_on_empty:
+                    output = self._call(retry_on_empty).strip()
+            except EOFError:
+                # Killed, or crashed; a new one is started for the next query.
+                self.session = None
+                output = 'Error: User interrupt.'
+            on_reply(output)
+
+    def _start(self):
+        self.session = Session(self.path, self.args, backend=self.backend, debug=self.debug,
+                               output_limit=self.output_limit)
+        self.base_state = parse_prompt(self.session.welcome[1])[0]
+        self.history = []
+        self.width = None
+
+    def _call(self, statement):
+        self.session.coqtop.send(statement)
+        output, _prompt = self.session.reply()
+        return output
+
+    def _sync(self, sentences):
+        sentences, _jobs = skeleton(sentences, plan(sentences))
+        common = 0
+        while (common < len(self.history) and common < len(sentences) and
+                self.history[common][0] == sentences[common]):
+            common += 1
+
+        if common < len(self.history):
+            state = self.history[common - 1][1] if common else self.base_state
+            self._call('BackTo {:d}.'.format(state))
+            del self.history[common:]
+            self.width = None
+
+        # Sent all at once; coqtop answers in order.
+        for sentence in sentences[common:]:
+            self.session.coqtop.send(sentence)
+        failed = False
+        for sentence in sentences[common:]:
+            output, prompt = self.session.reply()
+            if failed or re.search(RE_ERROR, output, re.M):
+                failed = True
+            else:
+                self.history.append((sentence, parse_prompt(prompt)[0]))
+        if failed:
+            # Anything that ran after the failure did so in the wrong context.
+            state = self.history[-1][1] if self.history else self.base_state
+            self._call('BackTo {:d}.'.format(state))
+            self.width = None
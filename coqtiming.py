@@ -0,0 +1,59 @@
+import csv, json
+from collections import namedtuple
+
+# What each proven sentence cost: `latency` is the wall-clock time from when
+# coqtop could start on it (it was sent, or the sentence before it in a pipeline
+# was answered) to its reply, `size` is the length of the reply and `parse` the
+# time spent framing and decoding it.
+
+Timing = namedtuple('Timing', 'begin end latency size parse text')
+
+FIELDS = ['line', 'column', 'begin', 'end', 'latency', 'size', 'parse', 'text']
+
+class Timings:
+    def __init__(self):
+        self.entries = {}
+
+    # Timings are kept under the position the manager's stack records for the
+    # sentence, which may come before it.
+
+    def add(self, position, timing):
+        self.entries[position] = timing
+
+    def remove(self, position):
+        return self.entries.pop(position, None)
+
+    def clear(self):
+        self.entries = {}
+
+    def slowest(self, count):
+        return sorted(self.entries.values(), key=lambda timing: -timing.latency)[:count]
+
+    def levels(self, thresholds):
+        # For each threshold, the sentences at least that slow but not as slow
+        # as the next one.
+        levels = [[] for _threshold in thresholds]
+        for timing in self.entries.values():
+            for level in reversed(range(len(thresholds))):
+                if timing.latency >= thresholds[level]:
+                    levels[level].append(timing)
+                    break
+        return levels
+
+    def export(self, path, rowcol):
+        # Writes CSV, or JSON if `path` ends with `.json`. `rowcol` maps an
+        # offset to a 0-based (line, column).
+        rows = []
+        for timing in sorted(self.entries.values()):
+            line, column = rowcol(timing.begin)
+            rows.append(dict(timing._asdict(), line=line + 1, column=column + 1,
+                             latency=round(timing.latency, 6), parse=round(timing.parse, 6)))
+
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            if path.endswith('.json'):
+                json.dump(rows, f, indent=2, sort_keys=True)
+            else:
+                writer = csv.DictWriter(f, FIELDS)
+                writer.writeheader()
+                writer.writerows(rows)
+        return len(rows)
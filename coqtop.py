@@ -1,11 +1,280 @@
-import re, os, subprocess, threading
+import re, os, sys, time, signal, tempfile, itertools, traceback, subprocess, threading
+from collections import deque, OrderedDict
+from concurrent.futures import Future
 
-def find_coqtop():
-    for path in [os.path.join(entry, 'coqtop') for entry in os.get_exec_path()]:
+try:
+    import selectors
+except ImportError:
+    # Python 3.3, which Sublime Text 3 runs plugins with.
+    selectors = None
+
+try:
+    from .coqlexer import lex
+except (ImportError, SystemError):
+    from coqlexer import lex
+
+RE_ERROR = r'^(Error:|Syntax [Ee]rror:)'
+
+def find_coqtop(name='coqtop'):
+    for path in [os.path.join(entry, name) for entry in os.get_exec_path()]:
         if os.access(path, os.X_OK):
             return path
 
+def parse_prompt(prompt):
+    # `<prompt>Name < 12 |Name|Other| 2 < </prompt>`: the state number, the open
+    # proofs and the proof depth.
+    match = re.search(r'<prompt>\S* < (\d+) \|(.*)\| (\d+) < </prompt>', prompt)
+    if match is None:
+        return None, '', 0
+    return int(match.group(1)), match.group(2), int(match.group(3))
+
+class Overflow:
+    # The part of a reply past `coq_output_limit` bytes, written to a temporary
+    # file as it arrives rather than kept in memory, and read back a page at a
+    # time. The most recent ones are kept for paging, by number.
+
+    KEEP = 16
+    RE_MARKER = re.compile(r'^\[(\d+) more bytes of reply (\d+): Coq: Show More Output\]$')
+
+    numbers = itertools.count(1)
+    recent = OrderedDict()
+    lock = threading.Lock()
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.size = 0
+        self.number = next(self.numbers)
+        with self.lock:
+            self.recent[self.number] = self
+            while len(self.recent) > self.KEEP:
+                _number, old = self.recent.popitem(last=False)
+                old.file.close()
+
+    @classmethod
+    def find(cls, number):
+        with cls.lock:
+            return cls.recent.get(number)
+
+    def write(self, data):
+        data = data.translate(None, b'\xfe\xff')
+        self.file.write(data)
+        self.size += len(data)
+
+    def marker(self, offset):
+        return '[{:d} more bytes of reply {:d}: Coq: Show More Output]'.format(
+            self.size - offset, self.number)
+
+    def page(self, offset, limit):
+        # The text from `offset`, up to `limit` bytes and the end of a line, and
+        # the offset after it.
+        with self.lock:
+            self.file.seek(offset)
+            data = self.file.read(limit)
+        if offset + len(data) < self.size:
+            data = data[:_cut(data, limit)]
+        return data.decode('utf-8', 'replace'), offset + len(data)
+
+def truncate(output, limit):
+    # For replies that arrive whole: the output cut at `limit` bytes, and an
+    # Overflow with the rest if there is any.
+    if limit is None or len(output) <= limit // 4:
+        return output, None
+    data = output.encode('utf-8')
+    if len(data) <= limit:
+        return output, None
+    overflow, head = Overflow(), _cut(data, limit)
+    overflow.write(data[head:])
+    output = data[:head].decode('utf-8', 'replace')
+    return output + ('' if output.endswith('\n') else '\n') + overflow.marker(0), overflow
+
+def _cut(data, limit):
+    # Where to cut `data` to keep at most `limit` bytes: after a line, if one
+    # ends in the second half, so that lines and characters stay whole.
+    end = data.rfind(b'\n', limit // 2, limit)
+    return end + 1 if end != -1 else limit
+
+class PromptFramer:
+    # Splits the stdout of `coqtop -emacs` into (output, prompt) replies. Only
+    # bytes that haven't been scanned yet are searched for the closing tag, and
+    # each reply is stripped and decoded once, so framing is linear in the size
+    # of the stream no matter how it is chunked or how many replies a read holds.
+    # With a `limit`, output past that many bytes goes to an Overflow as soon
+    # as it is read, but for a tail that may hold the prompt.
+
+    OPEN  = b'<prompt>'
+    CLOSE = b'</prompt>'
+    TAIL  = 4096
+
+    def __init__(self, limit=None):
+        self.buf = bytearray()
+        self.scanned = 0
+        self.limit = limit
+        self.overflow = None
+        self.head = 0
+
+    def feed(self, chunk):
+        self.buf += chunk
+
+        replies = []
+        start = 0
+        while True:
+            end = self.buf.find(self.CLOSE, max(start, self.scanned))
+            if end == -1:
+                break
+            end += len(self.CLOSE)
+            replies.append(self._parse(self.buf[start:end]))
+            start = end
+
+        if start:
+            del self.buf[:start]
+        if self.limit is not None and len(self.buf) > self.limit + self.TAIL:
+            if self.overflow is None:
+                self.overflow = Overflow()
+                self.head = _cut(self.buf, self.limit)
+            self.overflow.write(self.buf[self.head:-self.TAIL])
+            del self.buf[self.head:-self.TAIL]
+        # The closing tag may straddle two chunks; rescan only its possible prefix.
+        self.scanned = max(0, len(self.buf) - len(self.CLOSE) + 1)
+        return replies
+
+    def pending(self):
+        return len(self.buf)
+
+    def _parse(self, frame):
+        at = max(frame.rfind(self.OPEN), 0)
+        prompt = frame[at:].translate(None, b'\xfe\xff').decode('utf-8', 'replace')
+        output, overflow, self.overflow = frame[:at], self.overflow, None
+        if overflow is None and self.limit is not None and len(output) > self.limit:
+            overflow = Overflow()
+            self.head = _cut(output, self.limit)
+        if overflow is not None:
+            overflow.write(output[self.head:])
+            output = output[:self.head]
+
+        output = output.translate(None, b'\xfe\xff').decode('utf-8', 'replace')
+        if overflow is not None:
+            output += ('' if output.endswith('\n') else '\n') + overflow.marker(0)
+        elif output.endswith('\n'):
+            output = output[:-1]
+        return output, prompt
+
+class IOLoop:
+    # Reads the output of every coqtop on one thread: `on_data` is called there
+    # with each chunk read from a stream, and with b'' once it ends, so it must
+    # not wait for anything that takes a reply. Pipes can't be selected on
+    # Windows, nor without `selectors`; there each stream gets a thread.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.selector = None
+        self.wake = None
+        self.added = []
+
+    def add(self, stream, on_data):
+        if selectors is None or os.name == 'nt':
+            thread = threading.Thread(target=self._read, args=(stream, on_data))
+            thread.daemon = True
+            thread.start()
+            return
+        with self.lock:
+            if self.selector is None:
+                self.selector = selectors.DefaultSelector()
+                self.wake = os.pipe()
+                self.selector.register(self.wake[0], selectors.EVENT_READ)
+                thread = threading.Thread(target=self.run)
+                thread.daemon = True
+                thread.start()
+            # Streams are registered by the loop's thread, between selects.
+            self.added.append((stream.fileno(), on_data))
+        os.write(self.wake[1], b'.')
+
+    def run(self):
+        while True:
+            for key, _events in self.selector.select():
+                if key.fd == self.wake[0]:
+                    os.read(self.wake[0], 4096)
+                    with self.lock:
+                        added, self.added = self.added, []
+                    for fd, on_data in added:
+                        self.selector.register(fd, selectors.EVENT_READ, on_data)
+                    continue
+                # Select said there is something to read, so this won't block.
+                try:
+                    chunk = os.read(key.fd, 65536)
+                except OSError:
+                    chunk = b''
+                if not chunk:
+                    self.selector.unregister(key.fd)
+                self._call(key.data, chunk)
+
+    def _read(self, stream, on_data):
+        while True:
+            try:
+                chunk = stream.read(65536)
+            except (IOError, ValueError):
+                chunk = b''
+            self._call(on_data, chunk)
+            if not chunk:
+                return
+
+    def _call(self, on_data, chunk):
+        # One process's bug must not stop the others' output.
+        try:
+            on_data(chunk)
+        except Exception:
+            traceback.print_exc()
+
+io_loop = IOLoop()
+
+class Replies:
+    # Futures for the replies to what was sent, which come strictly in order:
+    # one for each sentence, the future getting the (output, prompt) of the
+    # last. A cancelled future is just passed over. `resolve` tells whether
+    # the reply is for the manager's `receive` as well.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = deque()
+        self.error = None
+
+    def expect(self, statement=None, receive=True):
+        future = Future()
+        count = 1
+        if statement is not None:
+            count = sum(1 for kind, _begin, _end in lex(statement + '\n') if kind == 'statement')
+        with self.lock:
+            if self.error is None:
+                self.pending.append([future, max(count, 1), receive])
+                return future
+        future.set_exception(self.error)
+        return future
+
+    def resolve(self, output, prompt):
+        with self.lock:
+            # An interrupt that came too late is answered with nothing waiting.
+            if not self.pending:
+                return True
+            entry = self.pending[0]
+            entry[1] -= 1
+            if entry[1] > 0:
+                return entry[2]
+            self.pending.popleft()
+        if entry[0].set_running_or_notify_cancel():
+            entry[0].set_result((output, prompt))
+        return entry[2]
+
+    def close(self, error):
+        with self.lock:
+            pending, self.pending = self.pending, deque()
+            self.error = self.error or error
+        for future, _count, _receive in pending:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(error)
+
 class Coqtop:
+    # Bytes of a reply kept in memory; see Overflow.
+    output_limit = None
+
     def __init__(self, manager, path, args=[], debug=True):
         self.debug = debug
 
@@ -13,15 +282,18 @@ class Coqtop:
             print('coq: running ' + path)
 
         self.manager = manager
+        self.manager_lock = threading.Lock()
+        self.parse_time = 0.0
+        self.framer = PromptFramer()
+        self.framing_time = 0.0
+        self.replies = Replies()
+        self.welcome = self.replies.expect()
         self.proc = subprocess.Popen([path, "-emacs"] + args,
             stderr=subprocess.STDOUT,
             stdout=subprocess.PIPE,
             stdin =subprocess.PIPE,
             bufsize=0)
-
-        self.out_thread = threading.Thread(target=self.receive)
-        self.out_thread.daemon = True
-        self.out_thread.start()
+        io_loop.add(self.proc.stdout, self.receive)
 
     def kill(self):
         if self.debug:
@@ -29,36 +301,156 @@ class Coqtop:
 
         self.proc.kill()
 
-    def receive(self):
-        while True:
-            buf = b''
-
-            while not buf.endswith(b'</prompt>'):
-                try:
-                    chunk = self.proc.stdout.read(65536)
-                    if len(chunk) == 0:
-                        return
-                    buf += chunk
-                except IOError as e:
-                    buf += str(e)
-
-            buf = re.sub(rb'\A\n*<prompt>.*</prompt>|[\xfe\xff]', b'', buf, flags=re.S)
-            buf = buf.decode('utf-8')
-            if buf.find('\n') == -1:
-                output = ''
-                prompt = buf
-            else:
-                (output, prompt) = buf.rsplit('\n', 1)
+    def receive(self, chunk):
+        if len(chunk) == 0:
+            self.replies.close(EOFError('coqtop exited'))
+            return
 
+        # Time spent framing is charged to the reply that completes it.
+        started = time.time()
+        self.framer.limit = self.output_limit
+        replies = self.framer.feed(chunk)
+        self.framing_time += time.time() - started
+        for output, prompt in replies:
             if self.debug:
                 print('coq-> ' + output.strip())
                 print('coq:> ' + prompt.strip())
 
             output = re.sub(r'<infomsg>\n?|\n?</infomsg>', '', output)
-            self.manager.receive(output, prompt)
+            self.parse_time, self.framing_time = self.framing_time, 0.0
+            if self.replies.resolve(output, prompt):
+                with self.manager_lock:
+                    self.manager.receive(output, prompt, self.parse_time)
+
+    def attach(self, manager):
+        with self.manager_lock:
+            idle, self.manager = self.manager, manager
+            if isinstance(idle, Idle):
+                for reply in idle.replies:
+                    manager.receive(*reply)
+
+    def interrupt(self):
+        # Coq stops what it is doing on SIGINT, which Windows has no way to send.
+        if os.name == 'nt':
+            return False
+        if self.debug:
+            print('coq: interrupting')
+        self.proc.send_signal(signal.SIGINT)
+        return True
 
-    def send(self, statement):
+    def send(self, statement, receive=True):
+        # Returns a Future for the reply, which the manager is given as well
+        # unless `receive` is False.
         if self.debug:
             print('->coq ' + statement)
-        self.proc.stdin.write((statement + '\n').encode('utf-8'))
-        self.proc.stdin.flush()
+        future = self.replies.expect(statement, receive)
+        try:
+            self.proc.stdin.write((statement + '\n').encode('utf-8'))
+            self.proc.stdin.flush()
+        except (IOError, ValueError):
+            self.replies.close(EOFError('coqtop exited'))
+            raise
+        return future
+
+class Idle:
+    # The manager of a pooled process until it is handed out; keeps its replies
+    # (the welcome message) to pass on then.
+
+    def __init__(self):
+        self.replies = []
+
+    def receive(self, output, prompt, parse_time=0.0):
+        self.replies.append((output, prompt, parse_time))
+
+    def proof_failed(self, state, output):
+        pass
+
+class CoqtopPool:
+    # Idle processes started ahead of time, keyed by backend, path and arguments
+    # (which include the load path), and by the prelude they have run, if any.
+    # `acquire` hands one out if there is one and starts a replacement in the
+    # background; idle ones are killed after `ttl` seconds, or once the files
+    # their prelude loaded have changed. Backends have to implement `attach`.
+
+    def __init__(self, size=0, ttl=600):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.starting = {}
+
+    def configure(self, size, ttl):
+        with self.lock:
+            self.size, self.ttl = size, ttl
+        self.expire()
+
+    def acquire(self, backend, manager, path, args=[], debug=True, prelude=None):
+        # Returns (process, warm). Either way it has to be attached to `manager`
+        # to get its replies; a warm one has been sent the prelude already.
+        key = (backend, path, tuple(args), prelude and prelude.key)
+        deps = prelude and prelude.deps
+        self.expire()
+        with self.lock:
+            idle = self.idle.get(key, [])
+            stale = [coqtop for coqtop, _since, entry_deps in idle if entry_deps != deps]
+            idle[:] = [entry for entry in idle if entry[2] == deps]
+            coqtop = idle.pop(0)[0] if idle else None
+        for process in stale:
+            process.kill()
+
+        warm = coqtop is not None
+        if warm:
+            coqtop.debug = debug
+        else:
+            coqtop = backend(Idle(), path, args, debug)
+        self._refill(key, deps, prelude and prelude.statements, debug)
+        return coqtop, warm
+
+    def _refill(self, key, deps, statements, debug):
+        with self.lock:
+            missing = self.size - len(self.idle.get(key, [])) - self.starting.get(key, 0)
+            if missing <= 0:
+                return
+            self.starting[key] = self.starting.get(key, 0) + missing
+
+        def start():
+            backend, path, args, _prelude = key
+            for _ in range(missing):
+                coqtop = backend(Idle(), path, list(args), debug)
+                for statement in statements or []:
+                    coqtop.send(statement)
+                with self.lock:
+                    self.starting[key] -= 1
+                    self.idle.setdefault(key, []).append((coqtop, time.time(), deps))
+            timer = threading.Timer(self.ttl, self.expire)
+            timer.daemon = True
+            timer.start()
+        thread = threading.Thread(target=start)
+        thread.daemon = True
+        thread.start()
+
+    def expire(self):
+        now, expired = time.time(), []
+        with self.lock:
+            for key, idle in self.idle.items():
+                keep = [entry for entry in idle
+                        if now - entry[1] < self.ttl and entry[0].proc.poll() is None]
+                expired += [entry[0] for entry in idle if entry not in keep]
+                self.idle[key] = keep[:max(self.size, 0)]
+                expired += [entry[0] for entry in keep[max(self.size, 0):]]
+        for coqtop in expired:
+            coqtop.kill()
+
+    def clear(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for entries in idle.values():
+            for coqtop, _since, _deps in entries:
+                coqtop.kill()
+
+if __name__ == '__main__':
+    try:
+        from .coqcheck import main
+    except (ImportError, SystemError):
+        from coqcheck import main
+    sys.exit(main())
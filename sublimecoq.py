@@ -1,35 +1,132 @@
-import re
+import os, re, time, hashlib, threading, multiprocessing
+from collections import deque, namedtuple, OrderedDict
 import sublime, sublime_plugin
-from .coqtop import Coqtop, find_coqtop
+from .coqtop import Coqtop, CoqtopPool, Idle, Overflow, find_coqtop, parse_prompt, RE_ERROR
+from .coqide import CoqideTop
+from .coqlexer import SentenceIndex, first_difference
+from .coqprelude import Prelude, find_prelude
+from .coqtiming import Timing, Timings
+from .coqside import SideSession
+from .coqlookahead import Lookahead
+from .coqgoals import parse_goals, changed_hypotheses, line_edits
+from .coqcache import Chain, ResultCache
+from .coqcheckpoint import Checkpoint, RE_REPLAY
+from .coqcheck import Project, find_project
+from .coqbuild import Build
+from .coqcomplete import SymbolIndex, required_modules, search_results
+from .coqparallel import ParallelCheck, plan, skeleton, RE_OPENS, RE_CLOSES
+from .coqbudget import over_budget, session_rss
+
+# What is to be done with the reply to a statement sent with `send`.
+Request = namedtuple('Request', 'sent_at expect_success retry_on_empty redirect_view on_reply')
+
+# Reports each edit to the buffer with its range, on build 4081 and later.
+TextChangeListener = getattr(sublime_plugin, 'TextChangeListener', None)
+
+RE_DEFINED = r'^([a-zA-Z_][a-zA-Z0-9_\']*) is (?:declared|defined)$'
+
+TIMING_SCOPES = ['markup.changed', 'markup.deleted', 'invalid']
 
 class CoqtopManager:
     coqtop_view = None
 
     def __init__(self):
         self.coqtop = None
+        self.side = None
+        self.lookahead = None
+        self.lookahead_generation = 0
         self.ready = False
         self.output_width = 78
         self.sentence_no = 0
         self.last_output = ""
-        self.expect_success = False
-        self.retry_on_empty = None
-        self.ignore_replies = 0
+        self.reply = None
+        self.interrupt_reason = None
         self.theorem = None
 
-        self.redirect_view = None
         self.editor_view = None
+        self.index = SentenceIndex()
+        self.index_dirty = True
+        # Edits not yet applied to the index, as (begin, end, text), where the
+        # editor reports them; the whole buffer is re-read otherwise.
+        self.index_edits = []
+        self.text_changes = None
+        self.sent_region = None
+        self.retract_point = None
+        self.retract_exact = False
+        self.pending_error = None
         self.autorun_point = None
         self.autorun_forward = True
         self.autorun_enabled = False
 
+        self.pipeline_lock = threading.Lock()
+        self.pipeline_queue = deque()
+        self.inflight = deque()
+        self.inflight_statements = 0
+        self.pipeline_window = 1
+        self.pipeline_error = None
+        self.pipeline_rollback = False
+        self.pipeline_state = None
+        self.pipeline_output = ""
+        self.pipeline_focus = True
+        self.pipeline_tolerant = False
+        self.pipeline_interrupted = False
+        self.pipeline_failures = 0
+        self.proven_batch = []
+        # Errors passed over by "Coq: Check File, Skipping Errors", by the
+        # position the stack records for the sentence: (begin, end, message).
+        self.errors = {}
+        # What `pop` took off the errors or the heatmap, drawn once after a batch.
+        self.errors_stale = False
+        self.timings_stale = False
+
+        self.start_time = None
+        self.startup_latency = None
+        self.warm = False
+
+        self.results = {}
+        self.reply_result = None
+        self.result_cache = None
+        self.restoring = False
+
+        self.symbols = SymbolIndex()
+        self.symbol_jobs = []
+        self.symbol_generation = 0
+        self.symbol_running = False
+
+        self.launch = None
+        self.output_limit = None
+        self.build = None
+        self.coqc_args = []
+        self.checkpoint = None
+        self.checkpoint_pending = None
+
+        self.parallel = None
+        self.parallel_at = {}
+        self.parallel_proofs = {}
+        self.parallel_pending = {}
+        self.parallel_counts = [0, 0]
+        self.parallel_rerun = None
+
+        self.suspended = False
+        self.resume_then = []
+        self.last_used = time.time()
+
+        self.timings = Timings()
+        self.last_reply_at = None
+        self.arrived = (None, 0.0)
+        self.reply_timing = None
+
         self.debug = False
         self.position = 0
+        self.state = None
+        self.base_state = None
         self.stack = []
         self.scope = 'toplevel'
 
         self.settings = sublime.load_settings('Sublime-Coq.sublime-settings')
         self.settings.add_on_change('coq_debug', self._update_debug)
         self._update_debug()
+        self.queries = QueryScheduler(self)
 
     def _update_debug(self):
         flags = self.settings.get('coq_debug')
@@ -39,84 +136,1316 @@ class CoqtopManager:
             self.coqtop.debug = 'coqtop' in flags
 
     def start(self):
-        path = self.settings.get('coqtop_path') or find_coqtop()
+        if self.settings.get('coq_backend') == 'xml':
+            backend, name = CoqideTop, 'coqidetop'
+        else:
+            backend, name = Coqtop, 'coqtop'
+
+        path = self.settings.get(name + '_path') or find_coqtop(name)
         if path is None:
-            sublime.error_message('Cannot find Coqtop.')
+            sublime.error_message('Cannot find {}.'.format(name))
             return False        
-        pwd = sublime.Window.folders(sublime.active_window())[0]
-        args = ["-R", pwd, "LF"]
-        args = self.settings.get('coqtop_args') + args
+        # The load path of the nearest _CoqProject, if there is one.
+        project_file = _project_file(self.editor_view)
+        if project_file is not None:
+            project = Project(project_file)
+            load_path = project.args
+        else:
+            pwd = sublime.Window.folders(sublime.active_window())[0]
+            load_path = ["-R", pwd, "LF"]
+        args = self.settings.get(name + '_args') + load_path
+        if self.settings.get('coq_ltac_profiling'):
+            args = args + ['-profile-ltac']
         debug = 'coqtop' in self.settings.get('coq_debug')
-
-        self.coqtop = Coqtop(self, path, args, debug)
+        self.launch = (backend, path, args, debug)
+        self.coqc_args = self.settings.get('coqtop_args') + load_path
+        self.output_limit = self.settings.get('coq_output_limit') or None
+
+        # What the file requires is compiled first, where it is out of date;
+        # without coqc, Coq just starts.
+        if (project_file is not None and self.editor_view.file_name() and
+                self.settings.get('coq_build_on_start')):
+            self.build = build_project(self.editor_view.window(), project,
+                                       self.editor_view.file_name(),
+                                       lambda ok: self._launch(), quiet=True)
+            if self.build is not None:
+                return True
+        self._launch()
         return True
 
+    def _launch(self):
+        if managers.get(self.editor_view.buffer_id()) is not self:
+            return
+        backend, path, args, debug = self.launch
+
+        prelude, sentences = None, []
+        if self.settings.get('coq_prelude_snapshot'):
+            for kind, begin, end in find_prelude(self.sentence_index()):
+                region = sublime.Region(begin, end)
+                sentences.append((kind, region, self.editor_view.substr(region)))
+            if sentences:
+                prelude = Prelude([(kind, text) for kind, _region, text in sentences], path, args)
+
+        restored = []
+        if self.settings.get('coq_result_cache') and self.editor_view.file_name():
+            self.result_cache = ResultCache(
+                os.path.join(sublime.cache_path(), 'Sublime-Coq', 'results'),
+                (self.settings.get('coq_result_cache_size') or 64) << 20,
+                (self.settings.get('coq_result_cache_days') or 30) * 86400)
+            restored = self.cached_prefix()
+            if len(restored) < len(sentences):
+                restored = []
+
+        pool.configure(self.settings.get('coq_pool_size', 0),
+                       self.settings.get('coq_pool_ttl', 600))
+        self.start_time = time.time()
+        self.coqtop, self.warm = pool.acquire(backend, self, path, args, debug, prelude)
+        self.coqtop.output_limit = self.output_limit
+        self._start_helpers()
+        if restored:
+            self.run_restore(restored, sent=len(sentences) if self.warm else 0)
+        else:
+            self.run_prelude(sentences, sent=self.warm)
+        self.coqtop.attach(self)
+        budget.schedule()
+
+    def _start_helpers(self):
+        backend, path, args, debug = self.launch
+        if self.settings.get('coq_query_process'):
+            self.side = SideSession(backend, path, args, debug, self.output_limit)
+        if self.settings.get('coq_lookahead'):
+            self.lookahead = Lookahead(backend, path, args, debug, self.output_limit)
+
     def stop(self):
+        if self.text_changes is not None:
+            self.text_changes.detach()
+        if self.build is not None:
+            self.build.cancel()
         if self.coqtop is not None:
             self.ready = False
             self.coqtop.kill()
+        if self.side is not None:
+            self.side.kill()
+        if self.lookahead is not None:
+            self.lookahead.kill()
+        if self.checkpoint_pending is not None:
+            self.checkpoint_pending[0].cancel()
+        if self.parallel is not None:
+            self.parallel.kill()
 
     def send(self, statement, expect_success=False, retry_on_empty=None,
-             redirect_view=None, need_output_width=None):
+             redirect_view=None, need_output_width=None, on_reply=None):
+        if self.suspended:
+            self.resume(lambda: self.send(statement, expect_success, retry_on_empty,
+                                          redirect_view, need_output_width, on_reply))
+            return
         self.ready = False
-
-        if self.redirect_view != redirect_view:
-            self.redirect_view = redirect_view
+        self.last_used = time.time()
 
         if need_output_width is not None and self.output_width != need_output_width:
             self.output_width = need_output_width
-            self.ignore_replies = 1
             statement = 'Set Printing Width {:d}. {}'\
                         .format(self.output_width, statement)
 
-        output_view = self.redirect_view or self.coqtop_view
+        output_view = redirect_view or self.coqtop_view
         sentence_no = self.sentence_no
         def show_progress():
             if not self.ready and self.sentence_no == sentence_no:
                 output_view.run_command('coq_output', {'output': 'Running...'})
         sublime.set_timeout_async(show_progress, 100)
 
-        self.expect_success = expect_success
-        self.retry_on_empty = retry_on_empty
-        self.coqtop.send(statement)
+        request = Request(time.time(), expect_success, retry_on_empty, redirect_view, on_reply)
+        self._expect(self.coqtop.send(statement, receive=False), request)
+        if expect_success:
+            self.watch()
+
+    def _expect(self, future, request):
+        # What is done with the reply to a statement sent outside a pipeline
+        # goes with its Future, and is done on the UI thread. The reply is
+        # dropped if the process was replaced or stopped in the meantime.
+        coqtop, self.reply = self.coqtop, future
+        def done(future):
+            if future.cancelled() or future.exception() is not None:
+                return
+            output, prompt = future.result()
+            arrived = (time.time(), coqtop.parse_time)
+            sublime.set_timeout(
+                lambda: self._handle(output, prompt, arrived, (coqtop, future, request)), 0)
+        future.add_done_callback(done)
+
+    # Backends call `receive` and `proof_failed` from the I/O loop's thread or
+    # their own; both are handled on the UI thread, in the order they came.
+    # Replies to pipelined statements come through `receive`; the others
+    # were sent with `send`, and come through their Futures.
+
+    def receive(self, output, prompt, parse_time=0.0):
+        arrived = (time.time(), parse_time)
+        sublime.set_timeout(lambda: self._handle(output, prompt, arrived), 0)
+
+    def proof_failed(self, state, output):
+        sublime.set_timeout(lambda: self._proof_failed(state, output), 0)
+
+    def _handle(self, output, prompt, arrived, sent=None):
+        self.arrived = arrived
+        with self.pipeline_lock:
+            if sent is not None:
+                coqtop, future, request = sent
+                if coqtop is not self.coqtop or future is not self.reply:
+                    return
+                self.reply = None
+                self._receive(request, output, prompt)
+            elif self.inflight:
+                self._receive_pipelined(output, prompt)
+            else:
+                return
+        self._parallel_apply()
+        self._retract_deferred()
+        if self.ready:
+            self.schedule_lookahead()
+            self.schedule_symbols()
 
-    def receive(self, output, prompt):
+    def _receive(self, request, output, prompt):
         self.ready = True
         self.sentence_no += 1
+        self._update_state(prompt)
+        self._time_reply(request.sent_at, output)
 
         output = output.strip()
+        empty = not output
         if not output:
-            if self.ignore_replies > 0:
-                self.ignore_replies -= 1
+            if request.retry_on_empty:
+                self.send(request.retry_on_empty, redirect_view=request.redirect_view,
+                          on_reply=request.on_reply)
                 return
+            output = self.last_output
+
+        output = self._clean_output(self._interrupted(output))
+        if (self.pending_error is not None and not request.redirect_view and
+                request.on_reply is None):
+            output, self.pending_error = self.pending_error, None
+
+        if request.on_reply is not None:
+            request.on_reply(output)
+            return
 
-            if self.retry_on_empty:
-                self.send(self.retry_on_empty, redirect_view=self.redirect_view)
+        output_view = request.redirect_view or self.coqtop_view
+        output_view.run_command('coq_output', {'output': output})
+        if request.redirect_view:
+            return
+
+        self.theorem = re.sub(r'.*\|(.*)\|.*', r'\1', prompt)
+        if request.expect_success:
+            if re.search(RE_ERROR, output, re.M) is None:
+                self.reply_result = ('' if empty else output, self.theorem)
+                self.editor_view.run_command('coq_success', {'prompt': prompt})
             else:
-                output = self.last_output
+                self.autorun_enabled = False
+                return
+
+        if re.search(RE_ERROR, output, re.M) is None:
+            self.last_output = output
+
+    # Editing the proven part of the buffer retracts coqtop to just before the
+    # first statement that changed. While coqtop is busy the retraction waits
+    # for the reply, and no further statements of a pipelined run are sent.
+
+    def edit_point(self):
+        if self.empty():
+            return None
+
+        _kind, begin, _scope, _defined, _state = self.stack[-1]
+        regions = self.editor_view.get_regions(self._ident(_kind, begin))
+        if (regions and regions[0].begin() == begin and regions[0].end() == self.position and
+                all(region.begin() > self.position for region in self.editor_view.sel())):
+            return None
+
+        old = self.index.text[:self.position + 1]
+        new = self.editor_view.substr(sublime.Region(0, self.position + 1))
+        if old == new:
+            return None
+        return first_difference(old, new)
+
+    def defer_retract(self, point, exact=False):
+        with self.pipeline_lock:
+            if self.retract_point is None or point < self.retract_point:
+                self.retract_point, self.retract_exact = point, exact
+            self.pipeline_queue.clear()
+
+    def _retract_deferred(self):
+        if self.retract_point is not None and self.ready:
+            point, self.retract_point = self.retract_point, None
+            if self.parallel_rerun is not None and self.parallel_rerun[0] != point:
+                self.parallel_rerun = None
+            self.editor_view.run_command('coq_retract', {'point': point,
+                                                         'exact': self.retract_exact})
+        # A proof that failed in a parallel worker is run again once retracted.
+        if self.parallel_rerun is not None and self.retract_point is None and self.ready:
+            point, self.parallel_rerun = self.parallel_rerun[1], None
+            self.editor_view.run_command('coq_go_here', {'point': point})
+
+    def _proof_failed(self, state, output):
+        # Backends that check proofs asynchronously report failures after the
+        # statement was already recorded as proven.
+        for _kind, position, _scope, _defined, entry_state in self.stack:
+            if entry_state == state:
+                if self.debug:
+                    print('coq: proof failed at {}'.format(position))
+                self.pending_error = output
+                if self.ready:
+                    self.editor_view.run_command('coq_retract', {'point': position, 'exact': True})
+                else:
+                    self.defer_retract(position, exact=True)
+                return
 
+    def frontier(self):
+        if self.empty():
+            return self.position
+        _kind, begin, _scope, _defined, _state = self.stack[-1]
+        regions = self.editor_view.get_regions(self._ident(_kind, begin))
+        if regions:
+            return regions[0].end()
+        return self.position
+
+    def schedule_replay(self):
+        change_count = self.editor_view.change_count()
+        def replay():
+            if self.editor_view.change_count() != change_count or self.coqtop is None:
+                return
+            if not self.ready:
+                self.schedule_replay()
+                return
+            regions = self.editor_view.get_regions('coq_replay')
+            self.editor_view.erase_regions('coq_replay')
+            if regions and regions[0].end() > self.position:
+                self.editor_view.run_command('coq_go_here', {'point': regions[0].end()})
+        sublime.set_timeout(replay, self.settings.get('coq_replay_delay') or 0)
+
+    def _update_state(self, prompt):
+        state, _theorems, _depth = parse_prompt(prompt)
+        if state is not None:
+            self.state = state
+            if self.base_state is None:
+                self.base_state = state
+                self.startup_latency = time.time() - self.start_time
+                if self.debug:
+                    print('coq: started in {:.3f}s ({})'
+                          .format(self.startup_latency, 'warm' if self.warm else 'cold'))
+                sublime.status_message('Coq started in {:.0f} ms'
+                                       .format(self.startup_latency * 1000))
+
+    def _clean_output(self, output):
         # Clean up some useless messages
-        output = re.sub(r'''
+        return re.sub(r'''
             \AToplevel\ input,.+\n
         |   \ \(ID\ \d+\)
         |   \(dependent\ evars:\ \(printing\ disabled\)\ \)
         ''', '', output, flags=re.X)
 
-        output_view = self.redirect_view or self.coqtop_view
-        output_view.run_command('coq_output', {'output': output})
-        if self.redirect_view:
+    # Pipelined execution: keep up to `coq_pipeline_window` sentences queued in
+    # coqtop, match replies to sentences in order, and record proven regions in
+    # batches. Coqtop keeps reading its input after an error, so any sentence
+    # that succeeds behind a failed one is rolled back with `BackTo`.
+
+    def run_pipelined(self, sentences, output_width, tolerant=False):
+        if self.suspended:
+            self.resume(lambda: self.run_pipelined(sentences, output_width, tolerant))
+            return
+        self.last_used = time.time()
+        with self.pipeline_lock:
+            self._pipeline_reset(sentences, focus=True)
+            self.pipeline_tolerant = tolerant
+            if self.output_width != output_width:
+                self.output_width = output_width
+                self._pipeline_send('ignore', None,
+                                    'Set Printing Width {:d}.'.format(output_width))
+            self._pipeline_fill()
+            if not self.inflight:
+                self._pipeline_finish()
+            else:
+                self.watch()
+
+    def run_prelude(self, sentences, sent):
+        # Right after starting, the leading imports (if any) are run as a
+        # pipeline whose first reply is the welcome message. A process from the
+        # pool has been sent them already, and replies as soon as it is attached.
+        with self.pipeline_lock:
+            self._pipeline_reset([], focus=False)
+            self.inflight.append(('welcome', None, None, self.start_time))
+            self.inflight_statements += 1
+            for kind, region, statement in sentences:
+                self._pipeline_send(kind, region, statement, send=not sent)
+
+    def _pipeline_reset(self, sentences, focus):
+        self.ready = False
+        self.pipeline_queue = deque(sentences)
+        self.pipeline_window = max(self.settings.get('coq_pipeline_window') or 1, 1)
+        self.pipeline_error = None
+        self.pipeline_rollback = False
+        self.pipeline_output = self.last_output
+        self.pipeline_focus = focus
+        self.pipeline_tolerant = False
+        self.pipeline_interrupted = False
+        self.pipeline_failures = 0
+        self.proven_batch = []
+        if self.debug:
+            print('coq: pipelining {} sentences, {} in flight'
+                  .format(len(sentences), self.pipeline_window))
+
+        self.coqtop_view.run_command('coq_output', {'output': 'Running...'})
+
+    def _pipeline_send(self, kind, region, statement, send=True):
+        self.inflight.append((kind, region, statement, time.time()))
+        if kind not in ['comment', 'skipped', 'dropped']:
+            self.inflight_statements += 1
+            if send:
+                self.coqtop.send(statement)
+
+    def _pipeline_fill(self):
+        while (self.pipeline_queue and self.pipeline_error is None and
+                self.inflight_statements < self.pipeline_window):
+            self._pipeline_send(*self.pipeline_queue.popleft())
+        self._pipeline_settle()
+
+    def _pipeline_settle(self):
+        # Comments need no reply; they are proven once everything before them is.
+        # So are the sentences of proofs left to parallel workers.
+        while self.inflight and self.inflight[0][0] in ['comment', 'skipped', 'dropped']:
+            kind, region, statement, _sent_at = self.inflight.popleft()
+            if self.pipeline_error is not None:
+                continue
+            if kind == 'dropped':
+                self._pipeline_drop(statement, region)
+            elif kind == 'comment':
+                self._pipeline_push('comment', region, self.scope)
+            elif statement is None:
+                self._parallel_push('comment', region, self.scope, admitted=False)
+            else:
+                kind, scope, _defined = self.classify(statement, [])
+                self._parallel_push(kind, region, scope, admitted=False)
+
+    def _pipeline_push(self, kind, region, scope, defined=[]):
+        region_name = self.push(kind, region, scope, defined)
+        self.proven_batch.append([region_name, region.begin(), region.end()])
+
+    def _pipeline_flush(self):
+        if self.proven_batch:
+            self.editor_view.run_command('coq_add_regions', {'regions': self.proven_batch,
+                                                             'focus': self.pipeline_focus})
+            self.proven_batch = []
+
+    def _pipeline_finish(self):
+        self._pipeline_flush()
+        if self.restoring:
+            self._restore_finish()
+        if self.parallel is not None:
+            self._parallel_prune()
+        self.autorun_enabled = False
+        self.autorun_point = None
+        self.pipeline_interrupted = False
+
+        self.last_output = self.pipeline_output
+        self.ready = True
+        output = self.pipeline_error or self.last_output
+        if self.pipeline_failures and self.pipeline_error is None:
+            output = '{} sentence{} failed; "Coq: Show Errors" lists {}.'.format(
+                self.pipeline_failures, 's' if self.pipeline_failures > 1 else '',
+                'them' if self.pipeline_failures > 1 else 'it')
+        self.coqtop_view.run_command('coq_output', {'output': output})
+        if self.retract_point is not None:
+            self.autorun_enabled = False
+
+    def _receive_pipelined(self, output, prompt):
+        kind, region, statement, sent_at = self.inflight.popleft()
+        if kind == 'rollback' and self.pipeline_interrupted and 'User interrupt' in output:
+            # A signal that reached coqtop between sentences; the rollback
+            # is still to come.
+            self.inflight.appendleft((kind, region, statement, sent_at))
             return
+        self.inflight_statements -= 1
+        self.sentence_no += 1
+        self._update_state(prompt)
+        self._time_reply(max(sent_at, self.last_reply_at or sent_at), output)
+
+        output = self._clean_output(self._interrupted(output.strip()))
+        failed = re.search(RE_ERROR, output, re.M) is not None
+        if kind == 'welcome':
+            if not self.restoring:
+                self.pipeline_output = output
+        elif kind in ['ignore', 'rollback']:
+            pass
+        elif kind == 'restore':
+            self._restore_reply(region, output, failed)
+        elif self.pipeline_error is not None:
+            self.pipeline_rollback = self.pipeline_rollback or not failed
+        elif failed and self.pipeline_tolerant and kind != 'close':
+            self._pipeline_tolerate(region, statement, output)
+        elif failed:
+            if self.debug:
+                print('coq: pipeline stopped at {}'.format(region))
+            self.pipeline_error = output
+            self.pipeline_state = self.state
+            self.pipeline_queue.clear()
+        elif kind == 'admit':
+            self.theorem = re.sub(r'.*\|(.*)\|.*', r'\1', prompt)
+            kind, scope, _defined = self.classify(statement, [])
+            self._parallel_push(kind, region, scope, admitted=True)
+        elif kind == 'close':
+            self.theorem = re.sub(r'.*\|(.*)\|.*', r'\1', prompt)
+            kind, scope, _defined = self.classify(statement, [])
+            self.reply_timing = self.reply_result = None
+            self.push(kind, region, scope)
+        else:
+            self.theorem = re.sub(r'.*\|(.*)\|.*', r'\1', prompt)
+            defined = re.findall(RE_DEFINED, output, re.M)
+            kind, scope, defined = self.classify(statement, defined)
+            self.reply_result = (output, self.theorem)
+            self._pipeline_push(kind, region, scope, defined)
+            if output:
+                self.pipeline_output = output
+
+        self._pipeline_settle()
+        self._pipeline_fill()
+        if self.inflight:
+            self.watch()
+            if self.pipeline_interrupted:
+                self._interrupt_next()
+            if len(self.proven_batch) >= self.pipeline_window:
+                self._pipeline_flush()
+        elif self.pipeline_rollback and self.pipeline_state is not None:
+            self.pipeline_rollback = False
+            self._pipeline_send('rollback', None,
+                                'BackTo {:d}.'.format(self.pipeline_state))
+        else:
+            self._pipeline_finish()
+
+    # Skipping errors: "Coq: Check File, Skipping Errors" pipelines the rest
+    # of the buffer, but goes on past sentences that fail. A proof with a
+    # failing sentence is admitted where it failed, and the rest of it passed
+    # over; so is a statement that failed to open one, with its proof. What was
+    # passed over is left unmarked and has no states, and the sentences that
+    # failed are underlined and listed by "Coq: Show Errors".
+
+    def _pipeline_tolerate(self, region, statement, output):
+        # Coqtop ran what was sent after the failed sentence where it failed:
+        # that is undone, and sent again less what can't work now.
+        sentences = [entry[:3] for entry in self.inflight if entry[1] is not None]
+        sentences += list(self.pipeline_queue)
+        sent = [entry for entry in self.inflight if entry[0] not in ['comment', 'skipped', 'dropped']]
+        self.inflight = deque(('ignore', None, None, sent_at) for _kind, _region, _statement, sent_at in sent)
+        if sent:
+            self._pipeline_send('ignore', None, 'BackTo {:d}.'.format(self.state))
+
+        opened = self.scope != 'toplevel'
+        self.pipeline_failures += 1
+        self._record_error(region, output)
+        if self.debug:
+            print('coq: passed over the error at {}'.format(region))
 
-        self.theorem = re.sub(r'.*\|(.*)\|.*', r'\1', prompt)
-        if self.expect_success:
-            self.expect_success = False
-            if re.search(r'^(Error:|Syntax [Ee]rror:)', output, re.M) is None:
-                self.editor_view.run_command('coq_success', {'prompt': prompt})
+        queue, closer = [], None
+        if opened and RE_CLOSES.match(statement):
+            closer = region
+        else:
+            self._pipeline_drop('statement', region)
+            if opened or RE_OPENS.match(statement):
+                while sentences:
+                    kind, region, statement = sentences[0]
+                    if kind != 'comment' and RE_OPENS.match(statement):
+                        break
+                    sentences.pop(0)
+                    if kind != 'comment' and RE_CLOSES.match(statement) and opened:
+                        closer = region
+                        break
+                    queue.append(('dropped', region, 'comment' if kind == 'comment' else 'statement'))
+                    if kind != 'comment' and RE_CLOSES.match(statement):
+                        break
+                if opened and closer is None:
+                    # The proof never ends; nothing after it can be checked.
+                    sentences = []
+        if closer is not None:
+            queue.append(('close', closer, 'Admitted.'))
+        self.pipeline_queue = deque(queue + sentences)
+
+    def _pipeline_drop(self, kind, region):
+        self.reply_timing = self.reply_result = None
+        scope = 'toplevel' if self.scope == 'toplevel' else 'tactic'
+        self.push(kind, region, scope)
+        self.stack[-1] = self.stack[-1][:4] + (None,)
+
+    def _record_error(self, region, output):
+        self.errors[self.position] = (region.begin(), region.end(), output)
+        self.draw_errors()
+
+    def draw_errors(self):
+        regions = [sublime.Region(begin, end) for begin, end, _output in self.errors.values()]
+        self.editor_view.add_regions('coq_errors', regions, 'invalid', 'circle',
+                                     sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE |
+                                     sublime.DRAW_SQUIGGLY_UNDERLINE)
+
+    # Interrupting: coqtop abandons the sentence it is running on SIGINT and
+    # replies with an error, staying at the last good state. Sentences that
+    # take longer than `coq_sentence_timeout` seconds are interrupted too.
+    # Nothing more is sent after an interrupt, and whatever is in flight
+    # is interrupted as it comes up.
+
+    def interrupt(self, reason=None):
+        with self.pipeline_lock:
+            if self.ready:
+                return True
+            if self.inflight and all(entry[0] == 'rollback' for entry in self.inflight):
+                return True
+            self.pipeline_queue.clear()
+            self.autorun_enabled = False
+            self.interrupt_reason = reason
+            if self.inflight:
+                self.pipeline_interrupted = True
+                self.pipeline_tolerant = False
+        return self.coqtop.interrupt()
+
+    def _interrupt_next(self):
+        # Coqtop reads on past the sentence it was stopped on: each one sent
+        # already is stopped in turn unless it replies first, and rolled back
+        # with the rest. Not at once, as coqtop answers a signal it gets
+        # while waiting for input.
+        sentence_no = self.sentence_no
+        def stop():
+            with self.pipeline_lock:
+                if (self.pipeline_interrupted and self.sentence_no == sentence_no and
+                        self.inflight and self.inflight[0][0] != 'rollback' and
+                        self.coqtop is not None):
+                    self.coqtop.interrupt()
+        sublime.set_timeout(stop, 100)
+
+    def watch(self):
+        timeout = self.settings.get('coq_sentence_timeout') or 0
+        if timeout <= 0:
+            return
+        sentence_no = self.sentence_no
+        def expire():
+            if not self.ready and self.sentence_no == sentence_no and self.coqtop is not None:
+                if self.debug:
+                    print('coq: sentence timed out after {}s'.format(timeout))
+                self.interrupt('Timed out after {} seconds.'.format(timeout))
+        sublime.set_timeout(expire, int(timeout * 1000))
+
+    def _interrupted(self, output):
+        if 'User interrupt' in output and self.interrupt_reason is not None:
+            output = re.sub(r'User interrupt\.?', self.interrupt_reason, output)
+        self.interrupt_reason = None
+        return output
+
+    # Timing: every reply is timed, and the timing is kept for the sentence it
+    # proves. Sentences slower than the `coq_timing_thresholds` are marked in
+    # the gutter.
+
+    def _time_reply(self, started, output):
+        self.last_reply_at, parse_time = self.arrived
+        if started is not None:
+            self.reply_timing = (self.last_reply_at - started, len(output), parse_time)
+
+    def _record_timing(self, position, region):
+        latency, size, parse = self.reply_timing
+        self.reply_timing = None
+        timing = Timing(region.begin(), region.end(), latency, size, parse,
+                        self.editor_view.substr(region))
+        self.timings.add(position, timing)
+        if self.debug:
+            print('coq: {:.3f}s for {} bytes ({:.3f}s parsing) at {}'
+                  .format(latency, size, parse, region))
+        if latency >= self._timing_thresholds()[0]:
+            self.draw_timings()
+
+    def _timing_thresholds(self):
+        return sorted(self.settings.get('coq_timing_thresholds') or [float('inf')])
+
+    def draw_timings(self):
+        thresholds = self._timing_thresholds()
+        if not self.settings.get('coq_timing_heatmap'):
+            thresholds = []
+        for level in range(len(TIMING_SCOPES)):
+            self.editor_view.erase_regions('coq_timing_{}'.format(level))
+        for level, timings in enumerate(self.timings.levels(thresholds[:len(TIMING_SCOPES)])):
+            regions = [sublime.Region(timing.begin, timing.end) for timing in timings]
+            self.editor_view.add_regions('coq_timing_{}'.format(level), regions,
+                                         TIMING_SCOPES[level], 'dot',
+                                         sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE)
+
+    # Lookahead: with `coq_lookahead` set, a second coqtop runs that many
+    # statements past the proven part of the buffer while this one is idle.
+    # Stepping over statements it has run takes its process over instead of
+    # running them again, and hands it this one.
+
+    def schedule_lookahead(self, delay=0):
+        if self.lookahead is None:
+            return
+        self.lookahead_generation += 1
+        generation = self.lookahead_generation
+        def follow():
+            if (generation != self.lookahead_generation or self.lookahead is None or
+                    not self.ready or self.inflight):
+                return
+            index = self.sentence_index()
+            upcoming, position = [], self.position
+            while len(upcoming) < self.settings.get('coq_lookahead'):
+                sentence = index.next(position)
+                if sentence is None:
+                    break
+                kind, begin, position = sentence
+                if kind != 'comment':
+                    upcoming.append((begin, position, index.text[begin:position]))
+            self.lookahead.follow(self.proven_sentences()[0], upcoming)
+        sublime.set_timeout(follow, delay)
+
+    def promote(self, sentences, then):
+        # Proves those of `sentences` that were run ahead once the lookahead
+        # hands its process over, then calls `then` with how many. Returns
+        # False, and never calls `then`, if it ran none of them.
+        if self.lookahead is None or not self.ready:
+            return False
+        statements = [(region.begin(), region.end(), text)
+                      for kind, region, text in sentences if kind != 'comment']
+        own, own_states, _state = self.proven_sentences()
+        if None in own_states or self.lookahead.matching(own, statements) == 0:
+            return False
+        lookahead = self.lookahead
+        def taken(taken):
+            sublime.set_timeout(lambda: self._promoted(lookahead, sentences, own, own_states,
+                                                       taken, then), 0)
+        if not lookahead.promote(own, statements, taken):
+            return False
+        self.ready = False
+        return True
+
+    def _promoted(self, lookahead, sentences, own, own_states, taken, then):
+        if lookahead is not self.lookahead:
+            return
+        self.ready = True
+        if taken is None:
+            then(0)
+            self._retract_deferred()
+            return
+
+        coqtop, base_state, states, speculations = taken
+        if self.debug:
+            print('coq: took {} statements from the lookahead'.format(len(speculations)))
+        with self.pipeline_lock:
+            self.lookahead.adopt(self.coqtop, self.base_state, zip(own, own_states))
+            self.coqtop = coqtop
+            coqtop.attach(self)
+
+            # The states recorded on the stack are renumbered after the other
+            # process; options such as the printing width were never set there.
+            states, state = iter(states), base_state
+            for i, (kind, position, scope, defined, _state) in enumerate(self.stack):
+                if kind != 'comment':
+                    state = next(states)
+                self.stack[i] = (kind, position, scope, defined, state)
+            self.base_state = base_state
+            self.output_width = None
+            self.queries.forget_after(None)
+
+            proven, speculations = [], iter(speculations)
+            for count, (kind, region, statement) in enumerate(sentences):
+                if kind != 'comment':
+                    speculation = next(speculations, None)
+                    if speculation is None:
+                        break
+                    output = self._clean_output(speculation.output.strip())
+                    self.state = speculation.state
+                    self.theorem = re.sub(r'.*\|(.*)\|.*', r'\1', speculation.prompt)
+                    self.reply_timing = (speculation.latency, len(speculation.output), 0.0)
+                    defined = re.findall(RE_DEFINED, output, re.M)
+                    kind, scope, defined = self.classify(statement, defined)
+                    self.reply_result = (output, self.theorem)
+                    if output:
+                        self.last_output = output
+                else:
+                    scope, defined = self.scope, []
+                region_name = self.push(kind, region, scope, defined)
+                proven.append([region_name, region.begin(), region.end()])
             else:
-                self.autorun_enabled = False
+                count = len(sentences)
+            self.sentence_no += 1
+
+        self.coqtop_view.run_command('coq_output', {'output': self.last_output})
+        self.editor_view.run_command('coq_add_regions', {'regions': proven})
+        self.schedule_lookahead()
+        then(count)
+        self._retract_deferred()
+
+    # Completion: the names each proven sentence defined are indexed when it
+    # is pushed, and dropped when it is popped (see SymbolIndex). Those of the
+    # libraries a `Require` loads are listed once coqtop has been idle for
+    # `coq_completion_delay` milliseconds, and only once for each `Require`.
+    # They are listed in the side process only: in the editor's coqtop the
+    # search would hold up stepping and write over the output view.
+
+    def schedule_symbols(self):
+        if not self.symbol_jobs or self.symbol_running:
+            return
+        self.symbol_generation += 1
+        generation = self.symbol_generation
+        def due():
+            if (generation == self.symbol_generation and self.coqtop is not None and
+                    self.side is not None and not self.suspended and
+                    not self.symbol_running):
+                self._list_symbols()
+        sublime.set_timeout(due, self.settings.get('coq_completion_delay') or 0)
+
+    def _list_symbols(self):
+        while self.symbol_jobs:
+            position, statement = self.symbol_jobs.pop(0)
+            if not any(entry[1] == position for entry in self.stack):
+                continue
+            modules = required_modules(statement)
+            key = ' '.join(modules)
+            if key in self.symbols.libraries:
+                self.symbols.add(position, self.symbols.libraries[key], key)
+                continue
+
+            def on_reply(output, position=position, statement=statement, key=key):
+                self.symbol_running = False
+                if re.search(RE_ERROR, output, re.M) is None:
+                    self.symbols.libraries[key] = search_results(output)
+                    if any(entry[1] == position for entry in self.stack):
+                        self.symbols.add(position, self.symbols.libraries[key], key)
+                    if self.debug:
+                        print('coq: indexed {} names from {}'
+                              .format(len(self.symbols.libraries[key]), key))
+                sublime.set_timeout(self.schedule_symbols, 0)
+            self.symbol_running = True
+            self.side.query(self.toplevel_sentences()[0],
+                            'SearchPattern _ inside {}.'.format(key),
+                            lambda output: sublime.set_timeout(lambda: on_reply(output), 0))
+            return
+
+    # Result cache: with `coq_result_cache` set, what every proven statement
+    # replied is kept on disk (see ResultCache). On start the leading
+    # statements found there are shown as proven right away, and run again in
+    # the background to rebuild coqtop's state. In "compatible" mode proofs
+    # that ended with `Qed` are run again as `Admitted`, and queries not at all.
+    # Should one fail now, it is retracted and the file's results forgotten.
+
+    def cached_prefix(self):
+        # (kind, region, text, result) for the leading sentences of the buffer
+        # up to the last statement with a cached result.
+        results = self.result_cache.load(self.editor_view.file_name())
+        if not results:
+            return []
+        chain = Chain(*self.launch[1:3])
+        index = self.sentence_index()
+        sentences, length, position = [], 0, 0
+        while True:
+            sentence = index.next(position)
+            if sentence is None:
+                break
+            kind, begin, position = sentence
+            text = index.text[begin:position]
+            result = None
+            if kind != 'comment':
+                result = results.get(chain.next(text))
+                if result is None:
+                    break
+            sentences.append((kind, sublime.Region(begin, position), text, result))
+            if kind != 'comment':
+                length = len(sentences)
+        return sentences[:length]
+
+    def run_restore(self, sentences, sent):
+        # Like run_prelude, but everything is recorded as proven up front; the
+        # first `sent` sentences have been sent by the pool already.
+        compatible = self.settings.get('coq_result_cache_mode') == 'compatible'
+        with self.pipeline_lock:
+            self._pipeline_reset([], focus=False)
+            self.restoring = 'cache'
+            self.inflight.append(('welcome', None, None, self.start_time))
+            self.inflight_statements += 1
+
+            self.state, proven, entries = None, [], []
+            for i, (kind, region, text, result) in enumerate(sentences):
+                scope, defined = self.scope, []
+                if result is not None:
+                    output, self.theorem = result
+                    defined = re.findall(RE_DEFINED, output, re.M)
+                    kind, scope, defined = self.classify(text, defined)
+                    self.reply_result = result
+                    if output:
+                        self.pipeline_output = output
+                if result is not None:
+                    entries.append((len(self.stack), kind, scope, text, i < sent))
+                region_name = self.push(kind, region, scope, defined)
+                proven.append([region_name, region.begin(), region.end()])
+
+            i = 0
+            while i < len(entries):
+                index, kind, scope, text, was_sent = entries[i]
+                i += 1
+                if was_sent:
+                    self._pipeline_send('restore', index, text, send=False)
+                elif compatible and kind == 'comment':
+                    continue
+                elif (compatible and scope == 'theorem' and
+                        self.stack[index][2] == 'toplevel'):
+                    qed = next((later for later in range(i, len(entries))
+                                if entries[later][1] == 'qed'), None)
+                    if qed is not None and entries[qed][3].strip().startswith('Qed'):
+                        self.pipeline_queue.append(('restore', index, text))
+                        self.pipeline_queue.append(('restore', entries[qed][0], 'Admitted.'))
+                        i = qed + 1
+                        continue
+                    self.pipeline_queue.append(('restore', index, text))
+                else:
+                    self.pipeline_queue.append(('restore', index, text))
+            self._pipeline_fill()
+        self.editor_view.run_command('coq_add_regions', {'regions': proven, 'focus': False})
+        self.coqtop_view.run_command('coq_output', {'output': self.pipeline_output})
+
+    def _restore_reply(self, index, output, failed):
+        if self.pipeline_error is not None:
+            self.pipeline_rollback = self.pipeline_rollback or not failed
+        elif failed:
+            if self.debug:
+                print('coq: cached statement failed at {}'.format(self.stack[index][1]))
+            self.pipeline_error = self.pending_error = output
+            self.pipeline_state = self.state
+            self.pipeline_queue.clear()
+            self.retract_point, self.retract_exact = self.stack[index][1], True
+        else:
+            kind, position, scope, defined, _state = self.stack[index]
+            self.stack[index] = (kind, position, scope, defined, self.state)
+
+    def _restore_finish(self):
+        reason, self.restoring = self.restoring, False
+        # Comments and skipped queries are at the state of what comes before.
+        for i, (kind, position, scope, defined, state) in enumerate(self.stack):
+            before = self.stack[i - 1][4] if i else self.base_state
+            if state is None and kind == 'comment' and before is not None:
+                self.stack[i] = (kind, position, scope, defined, before)
+        if self.pipeline_error is not None:
+            self.pipeline_output = ""
+            if reason == 'cache':
+                self.result_cache.forget(self.editor_view.file_name())
+        # What waited for a suspended session to resume is dropped if it
+        # didn't catch up, so that the error is seen.
+        then, self.resume_then = self.resume_then, []
+        if self.pipeline_error is None:
+            for fn in then:
+                sublime.set_timeout(fn, 0)
+
+    def save_results(self):
+        if self.result_cache is None or self.restoring:
+            return
+        ends = [entry[1] for entry in self.stack[1:]] + [self.position]
+        chain, results = Chain(*self.launch[1:3]), []
+        for (kind, begin, _scope, _defined, _state), end in zip(self.stack, ends):
+            result = self.results.get(begin)
+            if result is None:
+                if kind == 'comment':
+                    continue
+                break
+            text = self.editor_view.substr(sublime.Region(begin, end))
+            results.append((chain.next(text),) + tuple(result))
+        if results:
+            cache, file_name = self.result_cache, self.editor_view.file_name()
+            sublime.set_timeout_async(lambda: cache.save(file_name, results), 0)
+
+    # Checkpoints: "Coq: Checkpoint" compiles the proven part of the buffer up
+    # to the last proof that ended at top level (see Checkpoint) on another
+    # thread, then starts a coqtop that loads it in place of this one, and
+    # runs only what comes after it again. The statements it holds stay
+    # proven, but like proofs restored as admitted have no states of their
+    # own: going back into them starts over, and drops the checkpoint.
+
+    def checkpoint_index(self):
+        # The number of stack entries up to the last `qed` at top level.
+        for index in range(len(self.stack), 0, -1):
+            scope = self.stack[index][2] if index < len(self.stack) else self.scope
+            if self.stack[index - 1][0] == 'qed' and scope == 'toplevel':
+                return index
+        return None
+
+    def start_checkpoint(self):
+        index = self.checkpoint_index()
+        if index is None:
+            sublime.status_message('No proof has been finished at top level yet.')
+            return
+        if self.checkpoint is not None and self.checkpoint[1] == index:
+            sublime.status_message('Already running from a checkpoint there.')
+            return
+        coqc = self.settings.get('coqc_path') or find_coqtop('coqc')
+        if coqc is None:
+            sublime.error_message('Cannot find coqc.')
+            return
+
+        end = self._position_at(index)
+        text = self.editor_view.substr(sublime.Region(0, end))
+        ends = [entry[1] for entry in self.stack[1:index]] + [end]
+        statements = [self.editor_view.substr(sublime.Region(entry[1], stop))
+                      for entry, stop in zip(self.stack[:index], ends) if entry[0] != 'comment']
+        source = (self.editor_view.file_name() or
+                  'buffer-{}'.format(self.editor_view.buffer_id()))
+        checkpoint = Checkpoint(os.path.join(sublime.cache_path(), 'Sublime-Coq', 'checkpoints'),
+                                source, statements, self.launch[1], self.coqc_args)
+        if self.checkpoint_pending is not None:
+            self.checkpoint_pending[0].cancel()
+        self.checkpoint_pending = (checkpoint, index)
+
+        def compile():
+            started = time.time()
+            error = None
+            if not checkpoint.compiled():
+                error = checkpoint.compile(coqc, self.coqc_args, text)
+            if self.debug:
+                print('coq: checkpoint {} {} in {:.3f}s'.format(
+                    checkpoint.module, 'failed' if error else 'compiled', time.time() - started))
+            sublime.set_timeout(lambda: self._checkpoint_compiled(checkpoint, index, text, error), 0)
+        sublime.status_message('Compiling a checkpoint...')
+        thread = threading.Thread(target=compile)
+        thread.daemon = True
+        thread.start()
+
+    def _checkpoint_compiled(self, checkpoint, index, text, error):
+        if self.checkpoint_pending is None or self.checkpoint_pending[0] is not checkpoint:
+            return
+        if error is None and not self.ready:
+            sublime.set_timeout(lambda: self._checkpoint_compiled(checkpoint, index, text, error), 100)
+            return
+        self.checkpoint_pending = None
+        if error is not None:
+            sublime.status_message('Checkpoint failed.')
+            if self.ready:
+                self.coqtop_view.run_command('coq_output', {'output': error})
+            return
+        if (len(self.stack) < index or self._position_at(index) != len(text) or
+                self.editor_view.substr(sublime.Region(0, len(text))) != text):
+            sublime.status_message('Checkpoint dropped; the proven part has changed.')
+            return
+        self.resume_from(checkpoint, index)
+
+    def resume_from(self, checkpoint, index):
+        backend, path, args, debug = self.launch
+        ends = [entry[1] for entry in self.stack[1:]] + [self.position]
+        self.suspended = False
+        with self.pipeline_lock:
+            old = self.coqtop
+            self._pipeline_reset([], focus=False)
+            self.restoring = 'checkpoint'
+            self.start_time = time.time()
+            self.inflight.append(('welcome', None, None, self.start_time))
+            self.inflight_statements += 1
+            self.state = self.base_state = None
+
+            replay, after = [], []
+            for i, ((kind, position, scope, defined, _state), end) in enumerate(zip(self.stack, ends)):
+                text = self.editor_view.substr(sublime.Region(position, end))
+                if i < index:
+                    self.stack[i] = (kind, position, scope, defined, None)
+                    if kind != 'comment' and scope == 'toplevel' and RE_REPLAY.match(text):
+                        replay.append(('ignore', None, text))
+                elif kind != 'comment':
+                    after.append(('restore', i, text))
+            self.pipeline_queue.extend(replay)
+            self.pipeline_queue.append(('restore', index - 1, checkpoint.statement()))
+            self.pipeline_queue.extend(after)
+
+            self.output_width = None
+            self.queries.forget_after(None)
+            self.checkpoint = (checkpoint, index)
+            self.coqtop = backend(Idle(), path, args + checkpoint.args(), debug)
+            self.coqtop.output_limit = self.output_limit
+            self._pipeline_fill()
+        self.coqtop.attach(self)
+        old.attach(Idle())
+        old.kill()
+        if self.debug:
+            print('coq: resumed from {} after {} entries'.format(checkpoint.module, index))
+
+    # Suspending: when the sessions running are over the budget (see
+    # SessionBudget), idle ones have their processes stopped. The stack and the
+    # proven regions stay, and whatever next has to be sent resumes the
+    # session first: a new coqtop runs the stack again, with proofs that ended
+    # in `Qed` admitted, as when restoring cached results, and sentences that
+    # have no state left out. Undoing needs no process, so it doesn't resume.
+
+    def idle(self):
+        return (self.ready and not self.suspended and self.coqtop is not None and
+                self.base_state is not None and not self.inflight and not self.restoring and
+                not self.autorun_enabled and self.parallel is None and
+                self.checkpoint_pending is None and not self.symbol_running and
+                self.queries.running is None and self.queries.waiting is None)
+
+    def processes(self):
+        procs = [self.coqtop.proc] if self.coqtop is not None else []
+        if self.side is not None and self.side.session is not None:
+            procs.append(self.side.session.coqtop.proc)
+        if self.lookahead is not None:
+            procs.append(self.lookahead.coqtop.proc)
+        return procs
+
+    def suspend(self):
+        if not self.idle():
+            return False
+        if self.debug:
+            print('coq: suspending after {} entries'.format(len(self.stack)))
+        self.suspended = True
+        self.coqtop.attach(Idle())
+        self.coqtop.kill()
+        for helper in [self.side, self.lookahead]:
+            if helper is not None:
+                helper.kill()
+        self.side = self.lookahead = None
+        self.queries.forget_after(None)
+        return True
+
+    def resume(self, then=None):
+        # `then` is called once the session has caught up.
+        if not self.suspended:
+            return
+        if then is not None:
+            self.resume_then.append(then)
+        self.suspended = False
+        self.last_used = time.time()
+        if self.debug:
+            print('coq: resuming {} entries'.format(len(self.stack)))
+        if self.checkpoint is not None:
+            self.resume_from(*self.checkpoint)
+        else:
+            self._replay()
+        self._start_helpers()
+        budget.schedule()
+
+    def _replay(self):
+        backend, path, args, debug = self.launch
+        ends = [entry[1] for entry in self.stack[1:]] + [self.position]
+        scopes = [entry[2] for entry in self.stack[1:]] + [self.scope]
+        text = lambda i: self.editor_view.substr(sublime.Region(self.stack[i][1], ends[i]))
+        with self.pipeline_lock:
+            self._pipeline_reset([], focus=False)
+            self.restoring = 'suspended'
+            self.start_time = time.time()
+            self.inflight.append(('welcome', None, None, self.start_time))
+            self.inflight_statements += 1
+            self.state = self.base_state = None
+            self.output_width = None
+            self.queries.forget_after(None)
+
+            states = [entry[4] for entry in self.stack]
+            self.stack = [entry[:4] + (None,) for entry in self.stack]
+            i = 0
+            while i < len(self.stack):
+                kind, _position, scope, _defined, _state = self.stack[i]
+                if kind == 'comment' or states[i] is None:
+                    i += 1
+                    continue
+                self.pipeline_queue.append(('restore', i, text(i)))
+                end = i
+                while end < len(self.stack) and scopes[end] != 'toplevel':
+                    end += 1
+                # A proof that left sentences out is admitted as well.
+                if (scope == 'toplevel' and scopes[i] == 'theorem' and end < len(self.stack) and
+                        (text(end).strip().startswith('Qed') or None in states[i:end + 1])):
+                    self.pipeline_queue.append(('restore', end, 'Admitted.'))
+                    i = end
+                i += 1
+
+            self.coqtop = backend(Idle(), path, args, debug)
+            self.coqtop.output_limit = self.output_limit
+            self.warm = False
+            self._pipeline_fill()
+        self.coqtop.attach(self)
+
+    # Parallel checking: "Coq: Check File in Parallel" runs the rest of the
+    # buffer with the bodies of proofs ended with `Qed` admitted, while up to
+    # `coq_parallel_workers` other coqtops check those bodies (see
+    # ParallelCheck). Until a body has been checked it is outlined as pending.
+    # Like proofs restored as admitted, its sentences have no states of their
+    # own. A body that fails is retracted to its statement, and the error shown.
+
+    def run_parallel(self, sentences, output_width):
+        if self.suspended:
+            self.resume(lambda: self.run_parallel(sentences, output_width))
+            return
+        own = self.proven_sentences()[0]
+        texts = own + [text for kind, _region, text in sentences if kind != 'comment']
+        proofs = plan(texts)
+        script, jobs = skeleton(texts, proofs, len(own))
+        proofs = [proof for proof in proofs if proof[0] >= len(own)]
+        if not jobs:
+            self.run_pipelined(sentences, output_width)
+            return
+
+        # Past a proof's statement only `Admitted.` is sent, in place of `Qed`.
+        queue, at, n, job = [], {}, len(own) - 1, 0
+        for kind, region, text in sentences:
+            if kind != 'comment':
+                n += 1
+            if job < len(proofs):
+                begin, end = proofs[job]
+                inside = begin <= n < end if kind == 'comment' else begin < n <= end
+            else:
+                inside = False
+            if not inside:
+                queue.append((kind, region, text))
+                continue
+            at[region.begin()] = job
+            if kind != 'comment' and n == end:
+                queue.append(('admit', region, 'Admitted.'))
+                job += 1
+            else:
+                queue.append(('skipped', region, None if kind == 'comment' else text))
+
+        backend, path, args, debug = self.launch
+        workers = self.settings.get('coq_parallel_workers') or multiprocessing.cpu_count()
+        if self.parallel is not None:
+            self.parallel.kill()
+        with self.pipeline_lock:
+            self.parallel_at = at
+            self.parallel_proofs = dict((job, {'regions': [], 'sentences': [], 'end': None,
+                                               'failure': False})
+                                        for job in range(len(jobs)))
+            self.parallel_counts = [0, 0]
+            self.parallel = run = ParallelCheck(
+                backend, path, args, script, jobs, workers,
+                lambda job, failure, seconds: sublime.set_timeout(
+                    lambda: self._parallel_result(run, job, failure), 0),
+                debug, self.output_limit)
+        if self.debug:
+            print('coq: checking {} proofs in {} workers'.format(len(jobs), run.workers))
+        self.run_pipelined(queue, output_width)
+
+    def _parallel_push(self, kind, region, scope, admitted):
+        job = self.parallel_at.pop(region.begin(), None)
+        self.reply_timing = self.reply_result = None
+        region_name = self.push(kind, region, scope)
+        if not admitted:
+            self.stack[-1] = self.stack[-1][:4] + (None,)
+        proof = self.parallel_proofs.get(job)
+        if proof is not None:
+            proof['regions'].append([region_name, region.begin(), region.end()])
+            if kind != 'comment':
+                proof['sentences'].append(region.end())
+            if admitted:
+                proof['end'] = region.end()
+            self.parallel_pending[region_name] = job
+        self.proven_batch.append([region_name, region.begin(), region.end()])
+
+    def _parallel_result(self, run, job, failure):
+        with self.pipeline_lock:
+            if run is not self.parallel or job not in self.parallel_proofs:
                 return
+            self.parallel_proofs[job]['failure'] = failure
+        self._parallel_apply()
 
-        self.last_output = output
+    def _parallel_apply(self):
+        # Marks the proofs that were checked and are on the stack as proven,
+        # and retracts to the first that failed.
+        if self.parallel is None:
+            return
+        checked, failed = [], None
+        with self.pipeline_lock:
+            for job in sorted(self.parallel_proofs):
+                proof = self.parallel_proofs[job]
+                if proof['end'] is None or proof['failure'] is False:
+                    continue
+                del self.parallel_proofs[job]
+                for region_name, _begin, _end in proof['regions']:
+                    self.parallel_pending.pop(region_name, None)
+                if proof['failure'] is None:
+                    checked.extend(proof['regions'])
+                    self.parallel_counts[0] += 1
+                else:
+                    self.parallel_counts[1] += 1
+                    if failed is None:
+                        failed = proof
+            done = self._parallel_done()
+
+        if checked:
+            self.editor_view.run_command('coq_add_regions', {'regions': checked, 'focus': False})
+        if failed is not None:
+            # The sentences of the body have no states of their own, so it is
+            # retracted whole, then run again through the sentence that failed
+            # for this coqtop to stop there.
+            index, error = failed['failure']
+            point = failed['regions'][0][1]
+            sentences = failed['sentences']
+            self.pending_error = self._clean_output(error)
+            if self.debug:
+                print('coq: parallel proof failed at sentence {} after {}'.format(index, point))
+            self.defer_retract(point, exact=True)
+            self.parallel_rerun = (point, sentences[min(index, len(sentences) - 1)])
+            self._retract_deferred()
+        elif not done:
+            sublime.status_message('Checked {} of {} proofs'.format(
+                sum(self.parallel_counts), sum(self.parallel_counts) + len(self.parallel_proofs)))
+
+    def _parallel_prune(self):
+        # Stops checking the proofs that are no longer, or never made it, on
+        # the stack.
+        dropped = [job for job, proof in self.parallel_proofs.items()
+                   if proof['end'] is None or proof['end'] > self.position]
+        if dropped:
+            self.parallel.drop_from(min(dropped))
+        for job in dropped:
+            for region_name, _begin, _end in self.parallel_proofs.pop(job)['regions']:
+                self.parallel_pending.pop(region_name, None)
+        self._parallel_done()
+
+    def _parallel_done(self):
+        if self.parallel_proofs or self.parallel is None:
+            return False
+        self.parallel.kill()
+        self.parallel = None
+        sublime.status_message('{} proofs checked in parallel, {} failed'.format(
+            sum(self.parallel_counts), self.parallel_counts[1]))
+        return True
+
+    def classify(self, statement, defined):
+        scope = self.scope
+        if self.theorem:
+            if scope == 'toplevel':
+                defined = defined + [self.theorem]
+                scope = 'theorem'
+            elif scope == 'theorem':
+                if self.debug:
+                    print('coq: started proof')
+                scope = 'tactic'
+
+        match = re.match(r'\s*([A-Z][a-z]+)', statement)
+        if match:
+            keyword = match.group(0)
+        else:
+            keyword = ""
+
+        if keyword in ['Show', 'Print', 'Check']:
+            kind = 'comment'
+        elif keyword in ['Qed', 'Admitted', 'Save', 'Defined']:
+            kind = 'qed'
+            scope = 'toplevel'
+        else:
+            kind = 'statement'
+
+        if defined and self.debug:
+            print('coq: defined ' + ', '.join(defined))
+
+        return kind, scope, defined
+
+    def sentence_index(self):
+        if self.index_dirty:
+            self.index.update(self.editor_view.substr(sublime.Region(0, self.editor_view.size())))
+            self.index_dirty = False
+            self.index_edits = []
+        if self.index_edits:
+            self.index.edit(self.index_edits)
+            self.index_edits = []
+        return self.index
+
+    def text_changed(self, edits):
+        if self.index_dirty:
+            return
+        self.index_edits.extend(edits)
+        # Left unread for long, the buffer is cheaper to read again.
+        if len(self.index_edits) > 256:
+            self.index_dirty = True
+            self.index_edits = []
 
     def _ident(self, kind, position):
         return "coq-{}".format(position)
@@ -128,16 +1457,35 @@ class CoqtopManager:
         if self.debug:
             print('coq: advance through {} at {} ({}), define {}'
                   .format(kind, region, new_scope, defined))
-        self.stack.append((kind, self.position, self.scope, defined))
+        self.stack.append((kind, self.position, self.scope, defined, self.state))
         self.position, old_position = region.end(), self.position
         self.scope = new_scope
+        if kind != 'comment' and self.reply_timing is not None:
+            self._record_timing(old_position, region)
+        if self.reply_result is not None:
+            self.results[old_position] = self.reply_result
+            self.reply_result = None
+        if defined:
+            self.symbols.add(old_position, defined, 'local')
+        if (kind == 'statement' and self.side is not None and
+                self.settings.get('coq_completion_index')):
+            statement = self.editor_view.substr(region)
+            if required_modules(statement):
+                self.symbol_jobs.append((old_position, statement))
 
         ident = self._ident(kind, old_position)
         return ident
 
     def pop(self):
         old_scope = self.scope
-        kind, self.position, self.scope, defined = self.stack.pop()
+        kind, self.position, self.scope, defined, _state = self.stack.pop()
+        self.results.pop(self.position, None)
+        self.symbols.remove(self.position)
+        if self.errors.pop(self.position, None) is not None:
+            self.errors_stale = True
+        timing = self.timings.remove(self.position)
+        if timing is not None and timing.latency >= self._timing_thresholds()[0]:
+            self.timings_stale = True
         if self.debug:
             print('coq: undo to {} at {} ({}), undefine {}'
                   .format(kind, self.position, self.scope, defined))
@@ -145,21 +1493,290 @@ class CoqtopManager:
         ident = self._ident(kind, self.position)
         return kind, ident, old_scope, defined
 
+    def redraw_popped(self):
+        # Called once the last of a batch of `pop`s is done.
+        if self.errors_stale:
+            self.errors_stale = False
+            self.draw_errors()
+        if self.timings_stale:
+            self.timings_stale = False
+            self.draw_timings()
+
+    # Backtracking: every stack entry records the coqtop state reached after it,
+    # so any number of statements is undone with a single `BackTo`.
+
+    def undo_index(self, top):
+        # Undoing `Qed` undoes the entire proof.
+        index = top - 1
+        if self.stack[index][0] == 'qed':
+            while index > 0 and self.stack[index][2] == 'tactic':
+                index -= 1
+            index -= 1
+        return max(index, 0)
+
+    def backtrack_index(self, point):
+        index = len(self.stack)
+        while index > 0 and self._position_at(index) > point:
+            index = self.undo_index(index)
+        # Proofs restored as admitted have no states to go back to but the
+        # one where they started.
+        while index > 0 and self.stack[index - 1][4] is None:
+            index -= 1
+        return index
+
+    def _position_at(self, index):
+        if index < len(self.stack):
+            return self.stack[index][1]
+        return self.position
+
+    def backtrack(self, index):
+        if index > 0:
+            target = self.stack[index - 1][4]
+        else:
+            target = self.base_state
+
+        self.queries.forget_after(target)
+        if self.checkpoint_pending is not None and index < self.checkpoint_pending[1]:
+            self.checkpoint_pending[0].cancel()
+            self.checkpoint_pending = None
+        if self.checkpoint is not None and index < self.checkpoint[1]:
+            self.checkpoint = None
+        region_names = []
+        while len(self.stack) > index:
+            _kind, region_name, _scope, _defined = self.pop()
+            region_names.append(region_name)
+        self.redraw_popped()
+        if self.parallel is not None:
+            with self.pipeline_lock:
+                self._parallel_prune()
+
+        # A suspended session has nothing to go back in; it replays what is left.
+        if target is not None and target != self.state and not self.suspended:
+            # Options such as the printing width are rolled back too.
+            self.output_width = None
+            if self.scope == 'toplevel':
+                self.last_output = ""
+                self.send('BackTo {:d}.'.format(target))
+            else:
+                self.send('BackTo {:d}.'.format(target), retry_on_empty='Show.')
+        return region_names
+
+    def proof_state(self):
+        # The coqtop state reached by the last proven sentence.
+        if self.stack:
+            return self.stack[-1][4]
+        return self.base_state
+
+    def use_side(self):
+        # Queries inside a proof need its hypotheses, so they go to the side
+        # process only while the main one is busy.
+        return self.side is not None and (not self.ready or self.scope == 'toplevel')
+
+    def toplevel_sentences(self):
+        # The sentences proven up to the last one that ended at top level, and
+        # the state reached there.
+        sentences, _states, state = self.proven_sentences(toplevel=True)
+        return sentences, state
+
+    def proven_sentences(self, toplevel=False):
+        # The sentences proven, with the state reached after each, and the
+        # state reached after the last.
+        with self.pipeline_lock:
+            stack, scope, position = list(self.stack), self.scope, self.position
+        ends = [entry[1] for entry in stack[1:]] + [position]
+        scopes = [entry[2] for entry in stack[1:]] + [scope]
+
+        count = len(stack)
+        while toplevel and count > 0 and scopes[count - 1] != 'toplevel':
+            count -= 1
+        proven = [(kind, begin, end, state)
+                  for (kind, begin, _scope, _defined, state), end in zip(stack[:count], ends)
+                  if kind != 'comment']
+        sentences = [self.editor_view.substr(sublime.Region(begin, end))
+                     for _kind, begin, end, _state in proven]
+        states = [state for _kind, _begin, _end, state in proven]
+        return sentences, states, stack[count - 1][4] if count else self.base_state
+
     def rev_find(self, need_scope):
         found = False
-        for _kind, position, scope, _defined in self.stack[::-1]:
+        for _kind, position, scope, _defined, _state in self.stack[::-1]:
             if found:
                 return position
             if scope == need_scope:
                 found = True
 
+class QueryScheduler:
+    # Live previews ask coqtop a query per keystroke. A query is only sent once
+    # typing pauses for `coq_query_delay` milliseconds; one that is still
+    # running when a newer one is due is interrupted and its reply dropped; and
+    # replies are cached by query, proof state and width, so that retyping or
+    # backspacing is answered without coqtop.
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.cache = OrderedDict()
+        self.latest = 0
+        self.running = None
+        self.running_side = False
+        self.interrupted = False
+        self.waiting = None
+
+    def submit(self, panel, statement, retry_on_empty=None):
+        self.latest += 1
+        # Side queries are answered at top level, whatever the proof state.
+        side = self.manager.use_side()
+        if side:
+            _sentences, state = self.manager.toplevel_sentences()
+        else:
+            state = self.manager.proof_state()
+        key = (statement, state, _get_view_width(panel), side)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.waiting = None
+            panel.run_command('coq_output', {'output': self.cache[key]})
+            return
+
+        generation = self.latest
+        self.waiting = (generation, panel, statement, retry_on_empty, key)
+        sublime.set_timeout(lambda: self._due(generation), self._delay())
+
+    def forget_after(self, state):
+        # States after `state` are about to be reused for other sentences.
+        for key in [key for key in self.cache if state is None or key[1] > state]:
+            del self.cache[key]
+
+    def _delay(self):
+        return self.manager.settings.get('coq_query_delay', 150)
+
+    def _due(self, generation):
+        if self.waiting is None or self.waiting[0] != generation:
+            return
+        if self.running is not None:
+            # Sent once the running query replies.
+            if not self.interrupted:
+                if self.running_side:
+                    self.manager.side.interrupt()
+                    self.interrupted = True
+                else:
+                    self.interrupted = self.manager.coqtop.interrupt()
+        elif not self.waiting[4][3] and not self.manager.ready:
+            # Coqtop is busy with the proof.
+            sublime.set_timeout(lambda: self._due(generation), self._delay())
+        else:
+            self._send()
+
+    def _send(self):
+        generation, panel, statement, retry_on_empty, key = self.waiting
+        self.waiting = None
+        self.running, self.running_side, self.interrupted = generation, key[3], False
+        if key[3]:
+            sentences, _state = self.manager.toplevel_sentences()
+            # The side process replies on its own thread.
+            self.manager.side.query(
+                sentences, statement, retry_on_empty=retry_on_empty, width=key[2],
+                on_reply=lambda output: sublime.set_timeout(lambda: self._reply(
+                    generation, panel, key, self.manager._clean_output(output)), 0))
+        else:
+            self.manager.send(statement, retry_on_empty=retry_on_empty, redirect_view=panel,
+                              need_output_width=key[2],
+                              on_reply=lambda output: self._reply(generation, panel, key, output))
+
+    def _reply(self, generation, panel, key, output):
+        self.running = None
+        if 'User interrupt' not in output:
+            self.cache[key] = output
+            while len(self.cache) > self.manager.settings.get('coq_query_cache_size', 128):
+                self.cache.popitem(last=False)
+        if generation == self.latest:
+            panel.run_command('coq_output', {'output': output})
+        if self.waiting is not None:
+            generation = self.waiting[0]
+            sublime.set_timeout(lambda: self._due(generation), 0)
+
+class SessionBudget:
+    # Suspends the least recently used idle sessions while more than
+    # `coq_max_sessions` run, or they take more than `coq_memory_budget` MiB
+    # (see coqbudget). Checked as sessions start and resume, and every
+    # INTERVAL seconds; the session of the view in front is never suspended.
+    # Sessions are looked at on the UI thread; only their memory is measured
+    # off it.
+
+    INTERVAL = 30
+
+    def __init__(self):
+        self.ticking = False
+
+    def schedule(self, delay=0):
+        sublime.set_timeout(self.check, delay)
+
+    def _tick(self):
+        self.ticking = False
+        self.check()
+
+    def check(self):
+        settings = sublime.load_settings('Sublime-Coq.sublime-settings')
+        max_sessions = settings.get('coq_max_sessions') or 0
+        max_bytes = (settings.get('coq_memory_budget') or 0) << 20
+        running = [manager for manager in list(managers.values()) if not manager.suspended]
+        if not running or not (max_sessions or max_bytes):
+            return
+        if not self.ticking:
+            self.ticking = True
+            sublime.set_timeout(self._tick, self.INTERVAL * 1000)
+
+        window = sublime.active_window()
+        front = window and window.active_view()
+        sessions = [(manager, manager.last_used, manager.processes() if max_bytes else [],
+                     manager.idle() and manager.editor_view != front)
+                    for manager in running]
+        if max_bytes:
+            sublime.set_timeout_async(lambda: self._measure(sessions, max_sessions, max_bytes), 0)
+        else:
+            self._measure(sessions, max_sessions, max_bytes)
+
+    def _measure(self, sessions, max_sessions, max_bytes):
+        sessions = [(manager, used, session_rss(procs), idle)
+                    for manager, used, procs, idle in sessions]
+        victims = over_budget(sessions, max_sessions, max_bytes)
+        if victims:
+            sublime.set_timeout(lambda: self._suspend(victims), 0)
+
+    def _suspend(self, victims):
+        suspended = sum(1 for manager in victims if manager.suspend())
+        if suspended:
+            sublime.status_message('Suspended {} Coq session{} over the budget.'.format(
+                suspended, 's' if suspended > 1 else ''))
+
 managers = {}
+pool = CoqtopPool()
+budget = SessionBudget()
+# The goals last shown in each output view, by view id.
+shown_goals = {}
 
 # Starting/stopping coqtop
 
 def _get_view_width(view):
     return int(view.viewport_extent()[0] / view.em_width()) - 1
 
+def _project_file(view):
+    if view.file_name():
+        return find_project(os.path.dirname(view.file_name()))
+    folders = view.window().folders() if view.window() else []
+    return find_project(folders[0]) if folders else None
+
+def _create_panel(window, name, syntax='Toplevel'):
+    full_name = 'Coq {}'.format(name)
+    panel = window.create_output_panel(full_name)
+    panel.set_syntax_file('Packages/Sublime-Coq/Coq {}.sublime-syntax'.format(syntax))
+    panel.set_read_only(True)
+    panel.settings().set('is_widget', True)
+    panel.settings().set('word_wrap', True)
+    panel.settings().set('wrap_width', 0)
+    panel.settings().set('scroll_past_end', False)
+    panel.settings().set('rulers', [])
+    window.run_command('show_panel', {'panel': 'output.' + full_name})
+    return panel
+
 class ManagerCommand(sublime_plugin.TextCommand):
     def is_enabled(self):
         manager = self._manager()
@@ -204,6 +1821,9 @@ class CoqStartCommand(ManagerCommand):
             CoqtopManager.coqtop_view = coqtop_view
 
         manager.editor_view = self.view
+        if TextChangeListener is not None:
+            manager.text_changes = CoqTextChanges(manager)
+            manager.text_changes.attach(self.view.buffer())
         if manager.start():
             manager.editor_view.settings().set('coq', 'editor')
         else:
@@ -220,9 +1840,14 @@ class CoqStopCommand(ManagerCommand):
 
         manager.coqtop_view.run_command('coq_output', {'output': 'Coq has been stopped.'})
 
+        manager.save_results()
         while not manager.empty():
             _kind, region_name, _scope, _defined = manager.pop()
             manager.editor_view.erase_regions(region_name)
+        manager.redraw_popped()
+        manager.editor_view.erase_regions('coq_replay')
+        for level in range(len(TIMING_SCOPES)):
+            manager.editor_view.erase_regions('coq_timing_{}'.format(level))
         manager.editor_view.settings().set('coq', None)
 
         manager.stop()
@@ -232,54 +1857,115 @@ def plugin_unloaded():
     for manager in list(managers.values()):
         manager.settings.clear_on_change('coq_debug')
         manager.editor_view.run_command('coq_stop')
+    pool.clear()
 
 # Managing the coqtop window
 
 class CoqOutputCommand(sublime_plugin.TextCommand):
+    # From one tactic to the next usually only a few hypotheses and the goal
+    # change. Then only the lines that changed are replaced, so that the view
+    # doesn't have to be tokenized and scrolled all over again.
+
     def run(self, edit, output=""):
-        was_empty = (self.view.size() == 0)
+        goals = parse_goals(output)
+        old = shown_goals.pop(self.view.id(), None)
+        if goals is not None:
+            shown_goals[self.view.id()] = goals
+
         self.view.set_read_only(False)
-        self.view.replace(edit, sublime.Region(0, self.view.size()), output)
-        self.view.set_read_only(True)
-        if was_empty:
-            # Or the entire contents of a view is selected.
-            self.view.sel().clear()
-
-        goal = self.view.find_by_selector('meta.goal.coq')
-        if goal:
-            _, ty = self.view.text_to_layout(goal[0].end())
-            _, h = self.view.viewport_extent()
-            self.view.set_viewport_position((0, ty - h/2), animate=False)
+        if (goals is not None and old is not None and old.shape() == goals.shape() and
+                self.view.size() == old.offsets()[-1]):
+            for begin, end, text in line_edits(old, goals):
+                self.view.replace(edit, sublime.Region(begin, end), text)
+            self.view.set_read_only(True)
+        else:
+            was_empty = (self.view.size() == 0)
+            self.view.replace(edit, sublime.Region(0, self.view.size()), output)
+            self.view.set_read_only(True)
+            if was_empty:
+                # Or the entire contents of a view is selected.
+                self.view.sel().clear()
+
+            goal = self.view.find_by_selector('meta.goal.coq')
+            if goal:
+                _, ty = self.view.text_to_layout(goal[0].end())
+                _, h = self.view.viewport_extent()
+                self.view.set_viewport_position((0, ty - h/2), animate=False)
+
+        self.view.erase_regions('coq_changed')
+        if goals is not None and old is not None:
+            offsets = goals.offsets()
+            regions = [sublime.Region(offsets[hypothesis.line],
+                                      offsets[hypothesis.line] + len(hypothesis.text.rstrip()))
+                       for hypothesis in changed_hypotheses(old, goals)]
+            self.view.add_regions('coq_changed', regions, 'markup.changed.coq', '',
+                                  sublime.DRAW_NO_OUTLINE)
+
+class CoqShowMoreCommand(sublime_plugin.TextCommand):
+    # Replies longer than `coq_output_limit` bytes end with a marker line in
+    # place of the rest; this replaces it with the next page.
 
-# Advancing through the proof
+    def is_enabled(self):
+        return self._target() is not None
+
+    def _target(self):
+        views = [self.view, CoqtopManager.coqtop_view]
+        window = self.view.window()
+        panel = window and window.active_panel()
+        if panel and panel.startswith('output.Coq '):
+            views.insert(1, window.find_output_panel(panel[len('output.'):]))
+        for view in views:
+            if view is not None and _overflow_marker(view) is not None:
+                return view
+
+    def run(self, edit):
+        view = self._target()
+        if view.id() != self.view.id():
+            view.run_command('coq_show_more')
+            return
+
+        region, overflow, offset = _overflow_marker(view)
+        settings = sublime.load_settings('Sublime-Coq.sublime-settings')
+        page, offset = overflow.page(offset, settings.get('coq_output_limit') or 262144)
+        if offset < overflow.size:
+            page += ('' if page.endswith('\n') else '\n') + overflow.marker(offset)
+        shown_goals.pop(view.id(), None)
+        view.set_read_only(False)
+        view.replace(edit, region, page)
+        view.set_read_only(True)
+
+def _overflow_marker(view):
+    # The marker's region, the Overflow it refers to and the offset of the
+    # rest in it; None if the view doesn't end with one.
+    region = view.line(view.size())
+    match = Overflow.RE_MARKER.match(view.substr(region))
+    if match is None:
+        return None
+    overflow = Overflow.find(int(match.group(2)))
+    if overflow is None:
+        return None
+    return region, overflow, overflow.size - int(match.group(1))
 
-RE_COMMENT    = r'\(\*(.|\n)*?\*\)'
-RE_STATEMENT  = r'[*+-]+|(.|\n)*?[^\.]\.(?=\s|$)'
-RE_DEFINITION = r'\s*[A-Z][a-z]+'
+# Advancing through the proof
 
 class CoqCommand(ManagerCommand):
-    def _find_at_pos(self, re, position=None):
+    def _find_next(self, position=None):
         manager = self._manager()
         if position is None:
             position = manager.position
-        position = manager.editor_view.find(r'\s*', position).end()
-        return manager.editor_view.find(re, position)
+        sentence = manager.sentence_index().next(position)
+        if sentence is None:
+            return None, None
+        kind, begin, end = sentence
+        return kind, sublime.Region(begin, end)
 
-    def _substr_find_at_pos(self, re, position=None):
+    def _split_until(self, point):
         manager = self._manager()
-        region = self._find_at_pos(re, position)
-        if region:
-            return manager.editor_view.substr(region)
-
-    def _find_statement(self):
-        manager = self._manager()
-        region = self._find_at_pos(RE_STATEMENT)
-        while manager.editor_view.match_selector(region.end(), 'comment'):
-            next_region = self._find_at_pos(RE_STATEMENT, region.end())
-            if not next_region:
-                return
-            region = sublime.Region(region.begin(), next_region.end())
-        return region
+        sentences = []
+        for kind, begin, end in manager.sentence_index().until(manager.position, point):
+            region = sublime.Region(begin, end)
+            sentences.append((kind, region, manager.editor_view.substr(region)))
+        return sentences
 
     def _focus_point(self, point):
         manager = self._manager()
@@ -294,6 +1980,20 @@ class CoqCommand(ManagerCommand):
         whitespace = manager.editor_view.find(r'(?=\S)| \n\s+(?=\n)|\s(?=\n)', region.end())
         self._focus_point(max(whitespace.end(), region.end() + 1))
 
+    def _add_regions(self, regions, focus=True):
+        manager = self._manager()
+        for region_name, begin, end in regions:
+            if region_name in manager.parallel_pending:
+                manager.editor_view.add_regions(region_name, [sublime.Region(begin, end)],
+                                                'meta.pending.coq', '', sublime.DRAW_NO_FILL)
+            else:
+                manager.editor_view.add_regions(region_name, [sublime.Region(begin, end)],
+                                                'meta.proven.coq')
+        if regions and focus:
+            _region_name, _begin, end = regions[-1]
+            whitespace = manager.editor_view.find(r'(?=\S)| \n\s+(?=\n)|\s(?=\n)', end)
+            self._focus_point(max(whitespace.end(), end + 1))
+
     def _erase_region(self, region_name):
         manager = self._manager()
         region = manager.editor_view.get_regions(region_name)[0]
@@ -301,6 +2001,16 @@ class CoqCommand(ManagerCommand):
         self._focus_point(region.begin())
         return region
 
+    def _backtrack(self, index, focus=True):
+        manager = self._manager()
+        for region_name in manager.backtrack(index):
+            manager.editor_view.erase_regions(region_name)
+        if focus:
+            self._focus_point(manager.position)
+        if manager.ready:
+            output, manager.pending_error = manager.pending_error or manager.last_output, None
+            manager.coqtop_view.run_command('coq_output', {'output': output})
+
     def _autorun(self):
         manager = self._manager()
         if manager.autorun_enabled:
@@ -320,31 +2030,53 @@ class CoqNextStatementCommand(CoqCommand):
     def run(self, edit, until=None):
         manager = self._manager()
 
-        comment_region   = self._find_at_pos(RE_COMMENT)
-        statement_region = self._find_statement()
-        regions = filter(lambda x: x, [comment_region, statement_region])
-        if not regions:
+        kind, region = self._find_next()
+        if region is None:
+            manager.autorun_enabled = False
+            manager.autorun_point = None
             return
-        region = min(regions, key=lambda x: x.begin())
 
-        if region == comment_region:
+        if kind == 'comment':
             region_name = manager.push('comment', region, manager.scope)
             self._add_region(region_name, region)
             self._autorun()
-        elif region == statement_region:
-            statement = manager.editor_view.substr(region)
-            manager.send(statement,
-                         expect_success=True,
-                         need_output_width=_get_view_width(manager.coqtop_view))
+        elif not manager.promote(
+                [(kind, region, manager.editor_view.substr(region))],
+                lambda count: self._autorun() if count else self._send_statement(region)):
+            self._send_statement(region)
+
+    def _send_statement(self, region):
+        manager = self._manager()
+        manager.sent_region = region
+        manager.send(manager.editor_view.substr(region),
+                     expect_success=True,
+                     need_output_width=_get_view_width(manager.coqtop_view))
 
 class CoqGoHereCommand(CoqNextStatementCommand):
     def is_enabled(self):
         return super().is_enabled() and self.view.settings().get('coq') == 'editor'
 
-    def run(self, edit):
+    def run(self, edit, point=None, promote=True):
         manager = self._manager()
 
-        cursor_at = self.view.sel()[0].begin()
+        cursor_at = self.view.sel()[0].begin() if point is None else point
+        if cursor_at < manager.position and not manager.autorun_enabled:
+            self._backtrack(manager.backtrack_index(cursor_at))
+            return
+
+        window = manager.settings.get('coq_pipeline_window') or 1
+        if cursor_at > manager.position and not manager.autorun_enabled:
+            sentences = self._split_until(cursor_at)
+            # Runs again from where the lookahead left off, once it has.
+            if promote and manager.promote(sentences, lambda count: self.view.run_command(
+                    'coq_go_here', {'point': cursor_at, 'promote': count > 0})):
+                return
+            if not sentences:
+                return
+            if window > 1:
+                manager.run_pipelined(sentences, _get_view_width(manager.coqtop_view))
+                return
+
         if (manager.autorun_point is None or
                 manager.autorun_forward and cursor_at < manager.autorun_point or
                 not manager.autorun_forward and cursor_at > manager.autorun_point):
@@ -365,39 +2097,21 @@ class CoqSuccessCommand(CoqCommand):
         defined = list(map(manager.coqtop_view.substr,
                            manager.coqtop_view.find_by_selector('meta.defined.coq')))
 
-        scope = manager.scope
-        if manager.theorem:
-            if scope == 'toplevel':
-                defined.append(manager.theorem)
-                scope = 'theorem'
-            elif scope == 'theorem':
-                if manager.debug:
-                    print('coq: started proof')
-                scope = 'tactic'
-
-        region = self._find_statement()
-        match = re.match(r'\s*([A-Z][a-z]+)', manager.editor_view.substr(region))
-        if match:
-            keyword = match.group(0)
-        else:
-            keyword = ""
-
-        if keyword in ['Show', 'Print', 'Check']:
-            kind = 'comment'
-        elif keyword in ['Qed', 'Admitted', 'Save', 'Defined']:
-            kind = 'qed'
-            scope = 'toplevel'
-        else:
-            kind = 'statement'
-
-        if defined and manager.debug:
-            print('coq: defined ' + ', '.join(defined))
+        region = manager.sent_region
+        kind, scope, defined = manager.classify(manager.editor_view.substr(region), defined)
 
         region_name = manager.push(kind, region, scope, defined)
         self._add_region(region_name, region)
 
         sublime.set_timeout_async(lambda: self._autorun())
 
+class CoqAddRegionsCommand(CoqCommand):
+    def is_enabled(self):
+        return self._manager() is not None
+
+    def run(self, edit, regions, focus=True):
+        self._add_regions(regions, focus)
+
 class CoqClearErrorCommand(CoqCommand):
     def run(self, edit):
         manager = self._manager()
@@ -411,33 +2125,34 @@ class CoqUndoStatementCommand(CoqCommand):
     def run(self, edit):
         manager = self._manager()
 
-        if self._undo_one() == 'qed':
-            while manager.scope == 'tactic':
-                _kind, region_name, _scope, _defined = manager.pop()
-                self._erase_region(region_name)
-
-            self._undo_one()
-
+        self._backtrack(manager.undo_index(len(manager.stack)))
         sublime.set_timeout_async(lambda: self._autorun())
 
-    def _undo_one(self):
+class CoqRetractCommand(CoqCommand):
+    def run(self, edit, point, exact=False):
         manager = self._manager()
 
-        kind, region_name, scope, defined = manager.pop()
-        region = self._erase_region(region_name)
+        # Text typed right after a period may extend that statement.
+        if not exact and not manager.editor_view.substr(point).isspace():
+            point -= 1
+
+        index = manager.backtrack_index(point)
+        if index == len(manager.stack):
+            return
+        if manager.debug:
+            print('coq: edit at {}, retract to {}'.format(point, manager._position_at(index)))
 
-        if kind == 'statement':
-            if scope == 'tactic':
-                manager.send('Undo.')
-            elif manager.theorem and scope == 'theorem':
-                manager.send('Abort.')
-            elif any(defined):
-                for theorem in defined:
-                    manager.send('Reset {}.'.format(theorem))
-        elif kind == 'comment':
-            manager.coqtop_view.run_command('coq_output')
+        if manager.settings.get('coq_replay_after_edit'):
+            frontier = manager.frontier()
+            for region in manager.editor_view.get_regions('coq_replay'):
+                frontier = max(frontier, region.end())
+            manager.editor_view.add_regions('coq_replay', [sublime.Region(frontier)],
+                                            '', '', sublime.HIDDEN)
+            manager.schedule_replay()
 
-        return kind
+        manager.autorun_enabled = False
+        manager.autorun_point = None
+        self._backtrack(index, focus=False)
 
 class CoqAbortProofCommand(CoqCommand):
     def is_enabled(self):
@@ -451,30 +2166,81 @@ class CoqAbortProofCommand(CoqCommand):
         while manager.scope in ['tactic', 'theorem']:
             _kind, region_name, _scope, _defined = manager.pop()
             self._erase_region(region_name)
+        manager.redraw_popped()
+
+class CoqCheckParallelCommand(CoqCommand):
+    def is_enabled(self):
+        return super().is_enabled() and self.view.settings().get('coq') == 'editor'
+
+    def run(self, edit):
+        manager = self._manager()
+
+        sentences = self._split_until(manager.editor_view.size())
+        if sentences:
+            manager.autorun_enabled = False
+            manager.run_parallel(sentences, _get_view_width(manager.coqtop_view))
+
+class CoqCheckSkippingErrorsCommand(CoqCommand):
+    def is_enabled(self):
+        return super().is_enabled() and self.view.settings().get('coq') == 'editor'
+
+    def run(self, edit):
+        manager = self._manager()
+
+        sentences = self._split_until(manager.editor_view.size())
+        if sentences:
+            manager.autorun_enabled = False
+            manager.run_pipelined(sentences, _get_view_width(manager.coqtop_view), tolerant=True)
+
+class CoqShowErrorsCommand(CoqCommand):
+    def is_enabled(self):
+        return self._manager() is not None and bool(self._manager().errors)
+
+    def run(self, edit):
+        manager = self._manager()
+        errors = sorted(manager.errors.values())
+
+        items = []
+        for begin, _end, output in errors:
+            line, _column = manager.editor_view.rowcol(begin)
+            message = re.search(RE_ERROR, output, re.M)
+            message = output[message.start():] if message else output
+            items.append(['line {}'.format(line + 1), ' '.join(message.split())[:120]])
+
+        def show(index):
+            if index >= 0:
+                begin, end, output = errors[index]
+                region = sublime.Region(begin, end)
+                manager.editor_view.show_at_center(region)
+                manager.editor_view.sel().clear()
+                manager.editor_view.sel().add(region)
+                manager.coqtop_view.run_command('coq_output', {'output': output})
+        self.view.window().show_quick_panel(items, show, 0, 0, show)
+
+class CoqCheckpointCommand(CoqCommand):
+    def is_enabled(self):
+        return super().is_enabled() and self._manager().checkpoint_index() is not None
+
+    def run(self, edit):
+        self._manager().start_checkpoint()
 
 # Search
 
 class CoqPanelCommand(CoqCommand):
     def _create_panel(self, name, syntax='Toplevel'):
-        full_name = 'Coq {}'.format(name)
-        window = self.view.window()
-        panel = window.create_output_panel(full_name)
-        panel.set_syntax_file('Packages/Sublime-Coq/Coq {}.sublime-syntax'.format(syntax))
-        panel.set_read_only(True)
-        panel.settings().set('is_widget', True)
-        panel.settings().set('word_wrap', True)
-        panel.settings().set('wrap_width', 0)
-        panel.settings().set('scroll_past_end', False)
-        panel.settings().set('rulers', [])
-        window.run_command('show_panel', {'panel': 'output.' + full_name})
-        return panel
+        return _create_panel(self.view.window(), name, syntax)
 
     def _hide_panel(self, name='Coq'):
         full_name = 'Coq {}'.format(name)
         window = self.view.window()
         window.run_command('hide_panel', {'panel': 'output.' + full_name})
 
-class CoqSearchCommand(CoqPanelCommand):
+class CoqQueryCommand(CoqPanelCommand):
+    def is_enabled(self):
+        manager = self._manager()
+        return manager is not None and (manager.ready or manager.side is not None)
+
+class CoqSearchCommand(CoqQueryCommand):
     def input(self, args):
         panel  = self._create_panel('Search', syntax='Search')
         hide = lambda: self._hide_panel('Search')
@@ -497,25 +2263,19 @@ class CoqSearchQueryInputHandler(sublime_plugin.TextInputHandler):
 
     def preview(self, value):
         if value:
-            kwargs = {
-                'redirect_view': self.panel,
-                'need_output_width': _get_view_width(self.panel)
-            }
-
             if self.quote == '"':
                 # Not sure what's the best way to indicate invalid input here--
                 # let's just sanitize.
                 value = re.sub(re.escape(self.quote), '', value)
-                self.manager.send('{} "{}".'.format(self.kind, value), **kwargs)
+                self.manager.queries.submit(self.panel, '{} "{}".'.format(self.kind, value))
             else:
                 # Not sure what's the best way to indicate invalid input here--
                 # let's just sanitize.
                 value = re.sub(r'\.($|\s+.*)', '', value)
                 # Coq's Search command returns an empty output if an exact match
                 # is found--in that case, print the exact match.
-                self.manager.send('{} ({}).'.format(self.kind, value),
-                                  retry_on_empty='Print {}.'.format(value),
-                                  **kwargs)
+                self.manager.queries.submit(self.panel, '{} ({}).'.format(self.kind, value),
+                                            retry_on_empty='Print {}.'.format(value))
         else:
             self.panel.run_command('coq_output', {'output': 'Enter search query.'})
 
@@ -538,7 +2298,7 @@ class CoqSearchResultInputHandler(sublime_plugin.ListInputHandler):
 
 # Evaluation
 
-class CoqEvaluateCommand(CoqPanelCommand):
+class CoqEvaluateCommand(CoqQueryCommand):
     def input(self, args):
         panel  = self._create_panel('Evaluation')
         cancel = lambda: self._hide_panel('Evaluation')
@@ -560,14 +2320,195 @@ class CoqEvaluateInputHandler(sublime_plugin.TextInputHandler):
             # Not sure what's the best way to indicate invalid input here--
             # let's just sanitize.
             value = re.sub(r'\.($|\s+.*)', '', value)
-            self.manager.send('{} {}.'.format(self.kind, value),
-                              redirect_view=self.panel,
-                              need_output_width=_get_view_width(self.panel))
+            self.manager.queries.submit(self.panel, '{} {}.'.format(self.kind, value))
         else:
             self.panel.run_command('coq_output', {'output': 'Enter an expression.'})
 
+class CoqInterruptCommand(ManagerCommand):
+    def is_enabled(self):
+        manager = self._manager()
+        return manager is not None and not manager.ready
+
+    def run(self, edit):
+        if not self._manager().interrupt():
+            sublime.status_message('Coq cannot be interrupted on this platform.')
+
+# Timing
+
+class CoqSlowestSentencesCommand(CoqCommand):
+    def is_enabled(self):
+        return self._manager() is not None
+
+    def run(self, edit):
+        manager = self._manager()
+        timings = manager.timings.slowest(manager.settings.get('coq_timing_top') or 20)
+        if not timings:
+            sublime.status_message('No sentences have been timed yet.')
+            return
+
+        items = []
+        for timing in timings:
+            line, _column = manager.editor_view.rowcol(timing.begin)
+            items.append(['{:.3f}s  line {}'.format(timing.latency, line + 1),
+                          ' '.join(timing.text.split())[:80]])
+
+        def show(index):
+            if index >= 0:
+                region = sublime.Region(timings[index].begin, timings[index].end)
+                manager.editor_view.show_at_center(region)
+                manager.editor_view.sel().clear()
+                manager.editor_view.sel().add(region)
+        self.view.window().show_quick_panel(items, show, 0, 0, show)
+
+class CoqExportTimingsCommand(CoqCommand):
+    def is_enabled(self):
+        return self._manager() is not None
+
+    def run(self, edit, path=None):
+        manager = self._manager()
+        if path is None:
+            file_name = manager.editor_view.file_name()
+            default = (os.path.splitext(file_name)[0] if file_name else
+                       os.path.join(os.path.expanduser('~'), 'coq')) + '.timings.csv'
+            self.view.window().show_input_panel(
+                'Export timings (.csv or .json):', default,
+                lambda path: self.view.run_command('coq_export_timings', {'path': path}),
+                None, None)
+            return
+
+        count = manager.timings.export(path, manager.editor_view.rowcol)
+        sublime.status_message('Exported timings of {} sentences to {}'.format(count, path))
+
+class CoqLtacProfileCommand(CoqPanelCommand):
+    def run(self, edit):
+        panel = self._create_panel('Ltac Profile')
+        manager = self._manager()
+        manager.send('Show Ltac Profile.', redirect_view=panel,
+                     need_output_width=_get_view_width(panel))
+
+# Building: the files of a _CoqProject that are out of date are compiled with
+# coqc on another thread (see Build), all of them with "Coq: Build Project",
+# and those a file requires when Coq starts on it. The "Coq Build" panel
+# shows a line for each file, once there is something to compile.
+
+def build_project(window, project, required_by=None, on_done=None, quiet=False):
+    # Calls `on_done` with whether everything compiled, once it has. Returns
+    # None, and only says so in the status bar if `quiet`, without coqc.
+    settings = sublime.load_settings('Sublime-Coq.sublime-settings')
+    coqc = settings.get('coqc_path') or find_coqtop('coqc')
+    if coqc is None:
+        if quiet:
+            sublime.status_message('Cannot find coqc; not building the project')
+        else:
+            sublime.error_message('Cannot find coqc.')
+        return None
+    state_file = os.path.join(sublime.cache_path(), 'Sublime-Coq', 'builds',
+        hashlib.sha1(os.path.abspath(project.path).encode('utf-8')).hexdigest() + '.json')
+    build = Build(project, coqc, state_file,
+                  settings.get('coq_build_jobs') or multiprocessing.cpu_count(),
+                  settings.get('coqtop_args'))
+    progress = BuildProgress(window, project)
+
+    def work():
+        try:
+            files, graph = build.plan(required_by)
+            ok = True
+            if files:
+                progress.begin(files, build.jobs)
+                ok = build.run(files, graph, progress.emit)
+                progress.finish(ok, build.cancelled)
+        except OSError as e:
+            progress.fail('Error: {}'.format(e))
+            ok = False
+        if on_done is not None:
+            sublime.set_timeout(lambda: on_done(ok), 0)
+    thread = threading.Thread(target=work)
+    thread.daemon = True
+    thread.start()
+    return build
+
+class BuildProgress:
+    def __init__(self, window, project):
+        self.window = window
+        self.project = project
+        self.lock = threading.Lock()
+        self.panel = None
+        self.header = ''
+        self.footer = ''
+        self.files = OrderedDict()
+        self.started = time.time()
+
+    def begin(self, files, jobs):
+        with self.lock:
+            self.header = 'Compiling {} file{} with {} job{}'.format(
+                len(files), '' if len(files) == 1 else 's', jobs, '' if jobs == 1 else 's')
+            for path in files:
+                self.files[path] = {'status': 'waiting'}
+        sublime.set_timeout(self._show, 0)
+
+    def emit(self, record):
+        with self.lock:
+            self.files[record['file']] = record
+        sublime.set_timeout(self._show, 0)
+
+    def finish(self, ok, cancelled):
+        with self.lock:
+            statuses = [record['status'] for record in self.files.values()]
+            self.footer = '{} in {:.1f}s: {} compiled, {} failed, {} skipped'.format(
+                'Stopped' if cancelled else 'Done' if ok else 'Failed',
+                time.time() - self.started, statuses.count('ok'),
+                statuses.count('failed'), statuses.count('skipped'))
+        sublime.set_timeout(self._show, 0)
+
+    def fail(self, message):
+        with self.lock:
+            self.footer = message
+        sublime.set_timeout(self._show, 0)
+
+    def _show(self):
+        with self.lock:
+            lines = [self.header, '']
+            for path, record in self.files.items():
+                line = '{:<10} {}'.format(record['status'], self.project.module(path))
+                if 'seconds' in record:
+                    line += ' ({:.1f}s)'.format(record['seconds'])
+                if 'blocked_by' in record:
+                    line += ' (requires {})'.format(', '.join(
+                        self.project.module(other) for other in record['blocked_by']))
+                lines.append(line)
+                if record.get('message'):
+                    lines += ['    ' + message for message in record['message'].splitlines()]
+            if self.footer:
+                lines += ['', self.footer]
+        if self.panel is None:
+            self.panel = _create_panel(self.window, 'Build')
+        self.panel.run_command('coq_output', {'output': '\n'.join(lines)})
+
+class CoqBuildProjectCommand(sublime_plugin.TextCommand):
+    def is_enabled(self):
+        return _project_file(self.view) is not None
+
+    def run(self, edit):
+        build_project(self.view.window(), Project(_project_file(self.view)))
+
 # Event listener
 
+if TextChangeListener is not None:
+    class CoqTextChanges(TextChangeListener):
+        # Attached by CoqStart to the buffers it runs Coq for.
+
+        @classmethod
+        def is_applicable(cls, buffer):
+            return False
+
+        def __init__(self, manager):
+            super().__init__()
+            self.manager = manager
+
+        def on_text_changed(self, changes):
+            self.manager.text_changed([(change.a.pt, change.b.pt, change.str)
+                                       for change in changes])
+
 class CoqContext(sublime_plugin.EventListener):
     def on_query_context(self, view, key, operator, operand, match_all):
         if key == 'coq':
@@ -590,21 +2531,41 @@ class CoqContext(sublime_plugin.EventListener):
         if buffer_id in managers:
             return managers[buffer_id]
 
-    def on_selection_modified(self, view):
+    def on_modified(self, view):
         manager = self._manager(view)
-        if manager:
-            pos = view.sel()[-1].end()
-            view.set_read_only(view.size() > 0 and 0 < pos <= manager.position)
-
-    def on_text_command(self, view, command_name, args):
+        if manager and manager.editor_view is not None:
+            if manager.text_changes is None:
+                manager.index_dirty = True
+
+            point = manager.edit_point()
+            if point is not None:
+                if manager.ready:
+                    view.run_command('coq_retract', {'point': point})
+                else:
+                    manager.defer_retract(point)
+
+            if view.get_regions('coq_replay'):
+                manager.schedule_replay()
+            manager.schedule_lookahead(delay=500)
+
+    def on_query_completions(self, view, prefix, locations):
         manager = self._manager(view)
-        if manager:
-            # This fixes the annoying issue that if you set the view read-only such
-            # that the last region can't be erased with backspace, it can't be appended
-            # to either. Only Enter runs a text command though.
-            if (view.is_read_only() and view.sel()[0].begin() == manager.position and
-                    command_name == 'insert'):
-                view.set_read_only(False)
+        if manager is None or view.settings().get('coq') != 'editor' or len(prefix) < 2:
+            return None
+        # After a qualifier only the last component is inserted.
+        begin = locations[0] - len(prefix)
+        qualified = re.match(r"[\w']\.$", view.substr(sublime.Region(begin - 2, begin)))
+        completions = []
+        for key, (name, source) in manager.symbols.complete(prefix):
+            if qualified:
+                name = key
+            completions.append(['{}\t{}'.format(name, source), name])
+        return completions
+
+    def on_post_save(self, view):
+        manager = self._manager(view)
+        if manager and manager.editor_view is not None:
+            manager.save_results()
 
     def _update_output(self, view):
         if (view.settings().get('coq') == 'output' or
@@ -622,11 +2583,15 @@ class CoqContext(sublime_plugin.EventListener):
 
     def on_activated(self, view):
         self._update_output(view)
+        manager = self._manager(view)
+        if manager:
+            manager.last_used = time.time()
 
     def on_deactivated(self, view):
         self._update_output(view)
 
     def on_pre_close(self, view):
+        shown_goals.pop(view.id(), None)
         if view.settings().get('coq') == 'output':
             for manager in list(managers.values()):
                 manager.editor_view.run_command('coq_stop')
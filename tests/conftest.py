@@ -0,0 +1,5 @@
+import os, sys
+
+# The plugin's modules are top-level files; those that don't need Sublime Text
+# are imported from there directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,20 @@
+from coqbudget import over_budget
+
+# (key, last used, bytes, idle)
+SESSIONS = [('a', 3, 100, True), ('b', 1, 200, True), ('c', 2, 300, False)]
+
+def test_within_budget():
+    assert over_budget(SESSIONS) == []
+    assert over_budget(SESSIONS, max_sessions=3, max_bytes=600) == []
+    assert over_budget([], max_sessions=1, max_bytes=1) == []
+
+def test_least_recently_used_first():
+    assert over_budget(SESSIONS, max_sessions=2) == ['b']
+    assert over_budget(SESSIONS, max_bytes=500) == ['b']
+
+def test_busy_sessions_spared():
+    # A busy session is never suspended; the next idle one goes instead, and
+    # the budget may stay exceeded.
+    assert over_budget(SESSIONS, max_sessions=1) == ['b', 'a']
+    assert over_budget(SESSIONS, max_bytes=350) == ['b', 'a']
+    assert over_budget(SESSIONS, max_bytes=100) == ['b', 'a']
@@ -0,0 +1,43 @@
+from coqcomplete import SymbolIndex, Trie, required_modules
+
+def test_trie():
+    trie = Trie()
+    for key in ['map', 'max', 'min', 'map']:
+        trie.add(key, key.upper())
+    assert trie.find('ma', 10) == [('map', 'MAP'), ('max', 'MAX')]
+    assert trie.find('m', 2) == [('map', 'MAP'), ('max', 'MAX')]
+    assert trie.find('x', 10) == []
+    # Added twice, an entry goes once removed twice.
+    trie.remove('map', 'MAP')
+    assert trie.find('map', 10) == [('map', 'MAP')]
+    trie.remove('map', 'MAP')
+    assert trie.find('ma', 10) == [('max', 'MAX')]
+    trie.remove('nothing', 'NOTHING')
+    assert trie.find('', 10) == [('max', 'MAX'), ('min', 'MIN')]
+
+def test_trie_limit():
+    # Nodes list only their first LIMIT entries; those that lose one while
+    # full are listed again.
+    trie = Trie()
+    trie.LIMIT = 3
+    for i in range(6):
+        trie.add('k{:d}'.format(i), i)
+    assert [value for _key, value in trie.find('k', 10)] == [0, 1, 2]
+    trie.remove('k1', 1)
+    assert [value for _key, value in trie.find('k', 10)] == [0, 2, 3]
+    trie.add('k', -1)
+    assert [value for _key, value in trie.find('', 10)] == [-1, 0, 2]
+
+def test_symbol_layers():
+    symbols = SymbolIndex()
+    symbols.add(10, ['Coq.Lists.List.map', 'mapi'], 'List')
+    symbols.add(20, ['map'], 'file')
+    assert [name for _key, (name, _source) in symbols.complete('map')] == [
+        'Coq.Lists.List.map', 'map', 'mapi']
+    symbols.remove(10)
+    assert symbols.complete('map') == [('map', ('map', 'file'))]
+
+def test_required_modules():
+    assert required_modules('Require Import List Arith.') == ['List', 'Arith']
+    assert required_modules('From Coq Require Export Lists.List.') == ['Coq.Lists.List']
+    assert required_modules('Definition x := 1.') == []
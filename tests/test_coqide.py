@@ -0,0 +1,40 @@
+import threading
+import xml.etree.ElementTree as ET
+
+from coqide import CoqideTop
+
+def _top():
+    # Just what handling feedback needs, without a coqidetop.
+    top = CoqideTop.__new__(CoqideTop)
+    top.debug = False
+    top.lock = threading.Lock()
+    top.route_messages = []
+    return top
+
+def _message(i):
+    return ET.fromstring('<message><message_level val="notice"/>'
+                         '<string>line {:d}</string></message>'.format(i))
+
+def test_route_messages_taken_once():
+    top = _top()
+    top._element(_message(1))
+    top._element(_message(2))
+    assert top._route_output() == 'line 1\nline 2'
+    assert top._route_output() == ''
+
+def test_route_messages_while_draining():
+    # Feedback arrives on the I/O thread while the worker takes what came;
+    # none is lost or taken twice.
+    top, count = _top(), 20000
+    messages = [_message(i) for i in range(count)]
+    def feed():
+        for message in messages:
+            top._element(message)
+    thread = threading.Thread(target=feed)
+    thread.start()
+    taken = []
+    while thread.is_alive():
+        taken.extend(filter(None, top._route_output().split('\n')))
+    thread.join()
+    taken.extend(filter(None, top._route_output().split('\n')))
+    assert taken == ['line {:d}'.format(i) for i in range(count)]
@@ -0,0 +1,26 @@
+import io, os, re, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench'))
+from fake_coqtop import DEFAULT_SCRIPT, Fake, sentences
+from coqtop import parse_prompt, RE_ERROR
+
+def test_proofs_and_backtracking():
+    fake = Fake(DEFAULT_SCRIPT)
+    assert parse_prompt(fake.prompt()) == (1, '', 0)
+    assert fake.run('Definition d := 1.') == 'd is defined'
+    assert 'subgoal' in fake.run('Lemma a : True.')
+    assert parse_prompt(fake.prompt()) == (3, 'a', 1)
+    assert fake.run('auto.') == 'No more subgoals.'
+    assert fake.run('Qed.') == 'a is defined'
+    assert parse_prompt(fake.prompt()) == (5, '', 0)
+    assert fake.run('BackTo 2.') == ''
+    assert parse_prompt(fake.prompt()) == (2, '', 0)
+
+def test_scripted_errors():
+    fake = Fake(dict(DEFAULT_SCRIPT, errors={'oops': 'no.'}))
+    assert re.search(RE_ERROR, fake.run('Check oops.'), re.M)
+    assert parse_prompt(fake.prompt())[0] == 1
+
+def test_sentences_from_stream():
+    stream = io.StringIO('Lemma a : T.\nProof. auto.\n(* Qed. *) Qed.\n')
+    assert list(sentences(stream)) == ['Lemma a : T.', 'Proof.', 'auto.', 'Qed.']
@@ -0,0 +1,99 @@
+from coqtop import Overflow, PromptFramer, truncate
+
+STREAM = (b'\xfeLemma a is defined\n<prompt>Coq < 2 || 0 < </prompt>'
+          b'\xfe<prompt>a < 3 |a| 0 < </prompt>')
+REPLIES = [('Lemma a is defined', '<prompt>Coq < 2 || 0 < </prompt>'),
+           ('', '<prompt>a < 3 |a| 0 < </prompt>')]
+
+def test_replies_in_one_chunk():
+    framer = PromptFramer()
+    assert framer.feed(STREAM) == REPLIES
+    assert framer.pending() == 0
+
+def test_replies_cut_anywhere():
+    # However the stream is cut up, the same replies come out.
+    for size in [1, 2, 7, 64]:
+        framer, framed = PromptFramer(), []
+        for i in range(0, len(STREAM), size):
+            framed.extend(framer.feed(STREAM[i:i + size]))
+        assert framed == REPLIES and framer.pending() == 0
+
+def test_incomplete_reply_waits():
+    framer = PromptFramer()
+    assert framer.feed(b'\xfeoutput\n<prompt>Coq < 2 || 0 < </prom') == []
+    assert framer.pending() > 0
+    assert framer.feed(b'pt>') == [('output', '<prompt>Coq < 2 || 0 < </prompt>')]
+
+def test_characters_split_between_chunks():
+    data = b'\xfe' + 'λ-term ∀\n<prompt>Coq < 2 || 0 < </prompt>'.encode('utf-8')
+    framer, framed = PromptFramer(), []
+    for i in range(len(data)):
+        framed.extend(framer.feed(data[i:i + 1]))
+    assert framed == [('λ-term ∀', '<prompt>Coq < 2 || 0 < </prompt>')]
+
+def _big(lines):
+    return b''.join('line {:d}\n'.format(i).encode() for i in range(lines))
+
+def _page_all(marker):
+    match = Overflow.RE_MARKER.match(marker)
+    assert match is not None
+    overflow = Overflow.find(int(match.group(2)))
+    rest, offset = overflow.page(0, overflow.size)
+    assert int(match.group(1)) == offset == overflow.size
+    return rest
+
+def test_limit_in_chunks():
+    # Past the limit, output goes to an Overflow as it is read, and comes back
+    # whole from it, paged by the marker's number.
+    big = _big(2000)
+    framer, framed = PromptFramer(limit=100), []
+    for i in range(0, len(big), 1000):
+        framed.extend(framer.feed(big[i:i + 1000]))
+        assert framer.pending() <= 100 + PromptFramer.TAIL + 1000
+    [(output, prompt)] = framed + framer.feed(b'<prompt>Coq < 4 || 0 < </prompt>')
+    assert prompt == '<prompt>Coq < 4 || 0 < </prompt>'
+    head, marker = output.rsplit('\n', 1)
+    assert len(head) <= 100 and big.decode().startswith(head)
+    assert head + '\n' + _page_all(marker) == big.decode()
+
+def test_limit_in_one_chunk():
+    big = _big(500)
+    framer = PromptFramer(limit=100)
+    [(output, prompt)] = framer.feed(big + b'<prompt>Coq < 4 || 0 < </prompt>')
+    head, marker = output.rsplit('\n', 1)
+    assert len(head) <= 100
+    assert head + '\n' + _page_all(marker) == big.decode()
+
+def test_under_limit_is_untouched():
+    framer = PromptFramer(limit=100)
+    assert framer.feed(b'short\n<prompt>Coq < 2 || 0 < </prompt>') == [
+        ('short', '<prompt>Coq < 2 || 0 < </prompt>')]
+
+def test_prompt_after_overflow():
+    # The prompt of a long reply may be split across the tail kept in memory.
+    big = _big(2000) + b'<prompt>Coq < 4 || 0 < </prompt>\xfe<prompt>Coq < 5 || 0 < </prompt>'
+    framer, framed = PromptFramer(limit=100), []
+    for i in range(0, len(big), 333):
+        framed.extend(framer.feed(big[i:i + 333]))
+    assert [prompt for _output, prompt in framed] == ['<prompt>Coq < 4 || 0 < </prompt>',
+                                                      '<prompt>Coq < 5 || 0 < </prompt>']
+    assert Overflow.RE_MARKER.match(framed[0][0].rsplit('\n', 1)[1])
+    assert framed[1][0] == ''
+
+def test_truncate():
+    text = _big(200).decode()
+    assert truncate(text, None) == (text, None)
+    assert truncate('short', 100) == ('short', None)
+    output, overflow = truncate(text, 100)
+    head, marker = output.rsplit('\n', 1)
+    assert len(head) <= 100 and head + '\n' + _page_all(marker) == text
+
+def test_pages_end_at_lines():
+    overflow = Overflow()
+    overflow.write(_big(100))
+    offset, pages = 0, []
+    while offset < overflow.size:
+        page, offset = overflow.page(offset, 50)
+        pages.append(page)
+    assert all(page.endswith('\n') for page in pages)
+    assert ''.join(pages) == _big(100).decode()
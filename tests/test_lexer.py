@@ -0,0 +1,94 @@
+from coqlexer import SentenceIndex, first_difference, lex, lex_one
+
+def _sentences(text):
+    return [(kind, text[begin:end]) for kind, begin, end in lex(text)]
+
+def test_sentences():
+    text = ('(* a (* b. *) "c. *)" *) Lemma x : Nat.add 1 1 = 2. - auto. { } '
+            'Notation "[ x ; .. ; y ]" := (cons x .. (cons y nil) ..). Check "a. b".\n')
+    assert _sentences(text) == [
+        ('comment', '(* a (* b. *) "c. *)" *)'),
+        ('statement', 'Lemma x : Nat.add 1 1 = 2.'),
+        ('statement', '-'), ('statement', 'auto.'), ('statement', '{'), ('statement', '}'),
+        ('statement', 'Notation "[ x ; .. ; y ]" := (cons x .. (cons y nil) ..).'),
+        ('statement', 'Check "a. b".')]
+
+def test_bullets():
+    assert _sentences('-- auto.\n+++ idtac.\n** now.\n') == [
+        ('statement', '--'), ('statement', 'auto.'), ('statement', '+++'),
+        ('statement', 'idtac.'), ('statement', '**'), ('statement', 'now.')]
+
+def test_incomplete():
+    # Unfinished sentences, comments and strings are not sentences yet.
+    assert lex_one('Definition', 0) is None
+    assert lex_one('(* (* *)', 0) is None
+    assert lex_one('Check "a.', 0) is None
+    assert lex_one('   ', 0) is None
+
+def test_period_at_the_end():
+    # `Nat.` may be the start of `Nat.add`; only whitespace ends a sentence.
+    assert lex_one('Check Nat.', 0) is None
+    assert lex_one('Check Nat.\n', 0) == ('statement', 0, 10)
+    assert _sentences('auto. Qed.') == [('statement', 'auto.')]
+
+def test_first_difference():
+    assert first_difference('abc', 'abd') == 2
+    assert first_difference('abc', 'abc') == 3
+    assert first_difference('abc', 'abcd') == 3
+    assert first_difference('abcd', 'ab') == 2
+    old = 'x' * 200000
+    assert first_difference(old, old[:150000] + 'y' + old[150001:], chunk=4096) == 150000
+
+TEXT = 'Lemma a : T.\nProof.\n  auto.\nQed.\n'
+
+def test_index_lookups():
+    index = SentenceIndex(TEXT)
+    assert index.next(0) == ('statement', 0, 12)
+    assert index.next(13) == ('statement', 13, 19)
+    assert index.before(20) == ('statement', 13, 19)
+    assert index.before(5) is None
+    assert [begin for _kind, begin, _end in index.until(0, 28)] == [0, 13, 22, 28]
+    assert index.next(len(TEXT)) is None
+
+def test_index_update():
+    # Typing just past a period joins two sentences.
+    edited = TEXT[:19] + 'x' + TEXT[19:]
+    index = SentenceIndex(TEXT)
+    index.until(0, len(TEXT))
+    index.update(edited)
+    assert index.next(13) == ('statement', 13, 28)
+    assert index.until(0, len(edited)) == list(lex(edited))
+
+def test_index_lexes_lazily():
+    index = SentenceIndex(TEXT)
+    index.next(0)
+    assert index.lexed == 12
+    index.update('Lemma b : T.' + TEXT[12:])
+    assert index.lexed == 0 and index.next(0) == ('statement', 0, 12)
+
+def test_index_edit():
+    # Edits reported with their range leave the index as re-reading would.
+    for begin, end, text in [(19, 19, 'x'), (0, 5, 'Theorem'), (13, 28, ''),
+                             (len(TEXT), len(TEXT), 'Check T.\n')]:
+        edited = TEXT[:begin] + text + TEXT[end:]
+        index = SentenceIndex(TEXT)
+        index.until(0, len(TEXT))
+        index.edit([(begin, end, text)])
+        assert index.text == edited
+        assert index.until(0, len(edited)) == list(lex(edited))
+
+def test_index_edits_in_one_pass():
+    # Each edit is in the text the ones before it left.
+    end = len(TEXT) + 6
+    edits = [(0, 0, '(* c *)\n'), (27, 27, 'x'), (10, 12, ''), (end, end, 'y.\n'),
+             (8, 9, 'Lemma z : T. '), (0, 8, '')]
+    edited = TEXT
+    for begin, end, text in edits:
+        edited = edited[:begin] + text + edited[end:]
+    index = SentenceIndex(TEXT)
+    index.until(0, len(TEXT))
+    index.edit(edits)
+    assert index.text == edited
+    assert index.until(0, len(edited)) == list(lex(edited))
+    index.edit([])
+    assert index.text == edited
@@ -0,0 +1,35 @@
+from coqparallel import plan, skeleton
+
+SENTENCES = ['Definition d := 1.',
+             'Lemma a : T.', 'Proof.', 'auto.', 'Qed.',
+             'Lemma b : T.', 'auto.', 'Qed.',
+             'Definition e := 2.']
+
+def test_plan():
+    sentences = ['Definition d := 1.',
+                 'Lemma a : T.', 'Proof.', 'auto.', 'Qed.',
+                 'Lemma b : T.', 'Proof.', 'auto.', 'Defined.',
+                 'Theorem c : T.', 'Lemma e : T.', 'auto.', 'Qed.',
+                 'Lemma f : T.', 'auto.']
+    # Only proofs closed with `Qed` can be admitted; an unclosed one, or one
+    # cut short by another statement, is left to the editor.
+    assert plan(sentences) == [(1, 4), (10, 12)]
+
+def test_skeleton():
+    script, jobs = skeleton(SENTENCES, plan(SENTENCES))
+    assert script == ['Definition d := 1.', 'Lemma a : T.', 'Admitted.',
+                      'Lemma b : T.', 'Admitted.', 'Definition e := 2.']
+    assert [tuple(job) for job in jobs] == [(1, ['Proof.', 'auto.', 'Qed.']),
+                                            (3, ['auto.', 'Qed.'])]
+
+def test_skeleton_from():
+    # Proofs before `first` are admitted all the same, but not checked.
+    script, jobs = skeleton(SENTENCES, plan(SENTENCES), first=2)
+    assert len(script) == 6 and [job.statement for job in jobs] == [3]
+
+def test_plan_real_proofs_only():
+    # A statement given with `:=` opens no proof, nor does an `Instance`
+    # without one; neither is taken to run up to the next `Qed`.
+    assert plan(['Lemma c : T := t.', 'Instance i : C.', 'exact 1.', 'Qed.']) == []
+    assert plan(['Lemma a : T.', 'Definition x := 1.', 'Qed.']) == []
+    assert plan(['Lemma a : T.', 'Program Definition x := 1.', 'Qed.']) == []
@@ -0,0 +1,78 @@
+from concurrent.futures import CancelledError
+
+import pytest
+
+from coqtop import Replies
+
+def test_in_order():
+    replies = Replies()
+    first, second = replies.expect('Check T.'), replies.expect()
+    replies.resolve('T : Prop', 'p1')
+    assert first.result(0) == ('T : Prop', 'p1') and not second.done()
+    replies.resolve('', 'p2')
+    assert second.result(0) == ('', 'p2')
+
+def test_one_reply_per_sentence():
+    # A future gets the reply to the last of its sentences; comments get no
+    # reply, bullets do.
+    replies = Replies()
+    future = replies.expect('auto. (* done. *) - idtac.')
+    after = replies.expect()
+    for i in range(2):
+        replies.resolve('', 'p{:d}'.format(i))
+        assert not future.done()
+    replies.resolve('', 'p2')
+    assert future.result(0) == ('', 'p2') and not after.done()
+
+def test_last_sentence_counts():
+    # What is sent is whole: its last period ends a sentence too.
+    replies = Replies()
+    future = replies.expect('Set Printing Width 78. Show.')
+    replies.resolve('', 'p1')
+    assert not future.done()
+    replies.resolve('goals', 'p2')
+    assert future.result(0) == ('goals', 'p2')
+
+def test_no_sentence_still_takes_a_reply():
+    replies = Replies()
+    future, after = replies.expect('(* nothing *)'), replies.expect()
+    replies.resolve('', 'p1')
+    assert future.result(0) == ('', 'p1') and not after.done()
+
+def test_cancelled_is_passed_over():
+    replies = Replies()
+    cancelled, after = replies.expect(), replies.expect()
+    cancelled.cancel()
+    replies.resolve('', 'p1')
+    assert not after.done()
+    replies.resolve('', 'p2')
+    assert after.result(0) == ('', 'p2')
+    with pytest.raises(CancelledError):
+        cancelled.result(0)
+
+def test_reply_with_nothing_waiting():
+    # An interrupt that came too late is answered with nothing pending; it
+    # is the manager's, and not taken by what is sent next.
+    replies = Replies()
+    assert replies.resolve('Error: User interrupt.', 'p1') is True
+    future = replies.expect()
+    replies.resolve('', 'p2')
+    assert future.result(0) == ('', 'p2')
+
+def test_receive_flag():
+    # Replies to what was sent with `receive=False` are only the future's.
+    replies = Replies()
+    replies.expect('Lemma a : T. Proof.', receive=False)
+    replies.expect()
+    assert [replies.resolve('', 'p{:d}'.format(i)) for i in range(3)] == [False, False, True]
+
+def test_fewer_replies_than_sentences():
+    # A process that exits before answering every sentence fails what waits.
+    replies = Replies()
+    future = replies.expect('Lemma a : T. Proof. auto.')
+    replies.resolve('', 'p1')
+    replies.close(EOFError('coqtop exited'))
+    with pytest.raises(EOFError):
+        future.result(0)
+    with pytest.raises(EOFError):
+        replies.expect().result(0)
@@ -0,0 +1,31 @@
+import os, threading
+
+from coqside import SideSession
+from coqtop import Coqtop
+
+FAKE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                    'bench', 'fake_coqtop.py')
+
+def _query(side, sentences, statement):
+    done, replies = threading.Event(), []
+    side.query(sentences, statement, lambda output: (replies.append(output), done.set()))
+    assert done.wait(10)
+    return replies[0]
+
+def test_sync_admits_opaque_proofs():
+    side = SideSession(Coqtop, FAKE, [])
+    try:
+        sentences = ['Definition d := 1.',
+                     'Lemma a : True.', 'Proof.', 'auto.', 'Qed.',
+                     'Lemma b : True.', 'auto.', 'Defined.']
+        assert _query(side, sentences, 'Check d.') == '= 42\n     : nat'
+        assert [sentence for sentence, _state in side.history] == [
+            'Definition d := 1.', 'Lemma a : True.', 'Admitted.',
+            'Lemma b : True.', 'auto.', 'Defined.']
+
+        # What is left in common is kept; the rest is undone and sent again.
+        _query(side, sentences[:1] + ['Lemma c : True.', 'auto.', 'Qed.'], 'Check d.')
+        assert [sentence for sentence, _state in side.history] == [
+            'Definition d := 1.', 'Lemma c : True.', 'Admitted.']
+    finally:
+        side.kill()